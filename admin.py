@@ -0,0 +1,178 @@
+import hmac
+import logging
+import os
+
+from telegram.ext import CommandHandler, filters
+
+import memory
+import profiler
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 管理员查询接口
+# 同一份报告有两个入口：
+#   私聊命令   /trace slow 5，只响应 ADMIN_IDS 里的用户
+#   HTTP       GET /admin/trace?token=...&sort=slow&limit=5，需要 ADMIN_TOKEN
+#              webhook 版挂在 aiohttp 上（add_routes），轮询版挂在健康检查服务器（PORT）上（add_health_routes）
+# 两个都没配置时接口关闭。
+# 参数写法：位置参数按 REPORTS 里的顺序，其余用 key=value，例如 /trace recent 20 chat_id=-100123
+#   /trace    [sort] [limit]            最近或最慢的帖子 trace
+#   /profile  [seconds] [mode] [slow_ms] 剖析事件循环，mode 为 sample 或 cprofile
+#   /memory   [action] [seconds]         action：sizes 各结构大小（默认）/ snapshot 打 tracemalloc 基线 /
+#                                        diff 与基线对比（没有基线时打基线、等 seconds 秒再对比）/ stop
+# 报告可以附带一个文件（剖析结果）：私聊里作为文件发送，HTTP 加 file=1 时直接下载文件。
+
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").replace(",", " ").split()}
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Telegram 单条消息上限 4096 字符
+MESSAGE_LIMIT = 4000
+
+
+async def trace_report(args):
+    options = dict(args)
+    kind = options.pop("kind", "channel_post")
+    sort = options.pop("sort", "recent")
+    limit = int(options.pop("limit", 10))
+    traces = tracing.query(kind, sort, limit, **options)
+    header = f"{kind} traces ({sort}, {len(traces)}), kinds: {', '.join(tracing.kinds()) or '-'}"
+    return f"{header}\n\n{tracing.render(traces)}"
+
+
+async def profile_report(args):
+    mode = args.get("mode", "sample")
+    try:
+        result = await profiler.run(args.get("seconds", 10), mode, args.get("slow_ms"))
+    except profiler.Busy as e:
+        return str(e)
+    if mode == "sample":
+        return result.summary(), "profile.collapsed", result.collapsed().encode("utf-8")
+    return result.summary(), "profile.pstats", result.pstats_dump()
+
+
+async def memory_report(args):
+    action = args.get("action", "sizes")
+    limit = int(args.get("limit", memory.TOP))
+    if action == "sizes":
+        return memory.sizes_report()
+    if action == "snapshot":
+        return memory.take_baseline()
+    if action == "diff":
+        seconds = min(float(args.get("seconds", 30)), profiler.PROFILE_MAX_SECONDS)
+        return await memory.diff_over(seconds, limit)
+    if action == "stop":
+        return memory.stop_tracing()
+    raise ValueError(f"unknown action: {action}")
+
+
+# 报告名 -> (async func(参数字典), 位置参数名)
+# func 返回纯文本，或 (纯文本, 文件名, 文件内容)
+REPORTS = {
+    "trace": (trace_report, ("sort", "limit")),
+    "profile": (profile_report, ("seconds", "mode", "slow_ms")),
+    "memory": (memory_report, ("action", "seconds")),
+}
+
+
+def parse_args(name, words):
+    _, positional = REPORTS[name]
+    args = {}
+    rest = iter(positional)
+    for word in words:
+        key, sep, value = word.partition("=")
+        if sep:
+            args[key] = value
+        else:
+            args[next(rest, key)] = word
+    return args
+
+
+async def run(name, args):
+    func, _ = REPORTS[name]
+    try:
+        result = await func(args)
+    except (ValueError, TypeError) as e:
+        result = f"bad arguments: {e}"
+    if isinstance(result, str):
+        return result, None, None
+    return result
+
+
+def token_ok(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or "", ADMIN_TOKEN)
+
+
+def _chunks(text):
+    while text:
+        cut = text.rfind("\n", 0, MESSAGE_LIMIT) if len(text) > MESSAGE_LIMIT else len(text)
+        if cut <= 0:
+            cut = MESSAGE_LIMIT
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+
+
+def _command(name):
+    async def reply(message, args):
+        text, filename, data = await run(name, args)
+        for chunk in _chunks(text):
+            await message.reply_text(chunk)
+        if filename is not None:
+            await message.reply_document(document=data, filename=filename)
+
+    # 剖析要跑好几秒，放到后台任务里，不占着更新处理（轮询默认逐条处理更新）
+    async def handle(update, context):
+        context.application.create_task(reply(update.message, parse_args(name, context.args or ())), update=update)
+
+    handle.__name__ = f"admin_{name}"
+    return handle
+
+
+# 注册管理员私聊命令，要放在通用的私聊处理器之前
+def add_handlers(application):
+    if not ADMIN_IDS:
+        return
+    only_admins = filters.ChatType.PRIVATE & filters.User(user_id=ADMIN_IDS)
+    for name in REPORTS:
+        application.add_handler(CommandHandler(name, _command(name), filters=only_admins))
+
+
+# aiohttp 路由：/admin/<报告名>
+def add_routes(app):
+    from aiohttp import web
+
+    async def handle(request):
+        if not token_ok(request.query.get("token")):
+            return web.Response(text="Forbidden", status=403)
+        name = request.match_info["name"]
+        if name not in REPORTS:
+            return web.Response(text="Not Found", status=404)
+        args = {k: v for k, v in request.query.items() if k not in ("token", "file")}
+        text, filename, data = await run(name, args)
+        if filename is not None and request.query.get("file") == "1":
+            return web.Response(
+                body=data, content_type="application/octet-stream",
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+        return web.Response(text=text, content_type="text/plain")
+
+    app.router.add_get("/admin/{name}", handle)
+
+
+# 健康检查服务器的路由（轮询版本）
+def add_health_routes():
+    import health
+
+    def route(name):
+        async def handle(query):
+            if not token_ok(query.pop("token", None)):
+                return 403, "Forbidden", "text/plain"
+            download = query.pop("file", None) == "1"
+            text, filename, data = await run(name, query)
+            if filename is not None and download:
+                return 200, data, "application/octet-stream"
+            return 200, text, "text/plain"
+
+        return handle
+
+    for name in REPORTS:
+        health.add_route(f"/admin/{name}", route(name))
@@ -0,0 +1,124 @@
+import logging
+
+from telegram import Update
+from telegram.ext import (
+    CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
+    ChosenInlineResultHandler,
+    CommandHandler,
+    ConversationHandler,
+    InlineQueryHandler,
+    MessageHandler,
+    PollAnswerHandler,
+    PollHandler,
+    PreCheckoutQueryHandler,
+    ShippingQueryHandler,
+    filters,
+)
+
+logger = logging.getLogger(__name__)
+
+# 根据已注册的处理器推算最小的 allowed_updates
+# Telegram 只会推送列表里的更新类型，没有处理器用到的类型就不必经过网络和解析。
+# 推算是保守的：认不出的处理器或过滤器一律按“可能需要所有类型”处理。
+
+ALL_TYPES = frozenset(Update.ALL_TYPES)
+MESSAGE_TYPES = frozenset({
+    Update.MESSAGE, Update.EDITED_MESSAGE, Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST,
+})
+CHAT_MESSAGE_TYPES = frozenset({Update.MESSAGE, Update.EDITED_MESSAGE})
+CHANNEL_TYPES = frozenset({Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST})
+
+_UPDATE_TYPE_FILTERS = {
+    filters.UpdateType.MESSAGE: {Update.MESSAGE},
+    filters.UpdateType.EDITED_MESSAGE: {Update.EDITED_MESSAGE},
+    filters.UpdateType.MESSAGES: CHAT_MESSAGE_TYPES,
+    filters.UpdateType.CHANNEL_POST: {Update.CHANNEL_POST},
+    filters.UpdateType.EDITED_CHANNEL_POST: {Update.EDITED_CHANNEL_POST},
+    filters.UpdateType.CHANNEL_POSTS: CHANNEL_TYPES,
+    filters.UpdateType.EDITED: {Update.EDITED_MESSAGE, Update.EDITED_CHANNEL_POST},
+}
+
+_CHAT_TYPE_FILTERS = {
+    filters.ChatType.CHANNEL: CHANNEL_TYPES,
+    filters.ChatType.PRIVATE: CHAT_MESSAGE_TYPES,
+    filters.ChatType.GROUP: CHAT_MESSAGE_TYPES,
+    filters.ChatType.GROUPS: CHAT_MESSAGE_TYPES,
+    filters.ChatType.SUPERGROUP: CHAT_MESSAGE_TYPES,
+}
+
+_HANDLER_TYPES = {
+    CallbackQueryHandler: {Update.CALLBACK_QUERY},
+    ChatJoinRequestHandler: {Update.CHAT_JOIN_REQUEST},
+    ChosenInlineResultHandler: {Update.CHOSEN_INLINE_RESULT},
+    InlineQueryHandler: {Update.INLINE_QUERY},
+    PollAnswerHandler: {Update.POLL_ANSWER},
+    PollHandler: {Update.POLL},
+    PreCheckoutQueryHandler: {Update.PRE_CHECKOUT_QUERY},
+    ShippingQueryHandler: {Update.SHIPPING_QUERY},
+}
+
+
+def _filter_types(f):
+    if f is None:
+        return MESSAGE_TYPES
+    if f in _UPDATE_TYPE_FILTERS:
+        return frozenset(_UPDATE_TYPE_FILTERS[f])
+    if f in _CHAT_TYPE_FILTERS:
+        return _CHAT_TYPE_FILTERS[f]
+    if isinstance(f, filters._MergedFilter):
+        base = _filter_types(f.base_filter)
+        if f.and_filter is not None:
+            return base & _filter_types(f.and_filter)
+        return base | _filter_types(f.or_filter)
+    if isinstance(f, filters._XORFilter):
+        return _filter_types(f.base_filter) | _filter_types(f.xor_filter)
+    if isinstance(f, filters._InvertedFilter):
+        # 取反后对非消息更新也会返回 True
+        return ALL_TYPES
+    if isinstance(f, filters.MessageFilter):
+        # 系统提示（进群、退群等）不会被编辑
+        if type(f).__qualname__.startswith("StatusUpdate."):
+            return frozenset({Update.MESSAGE, Update.CHANNEL_POST})
+        return MESSAGE_TYPES
+    return ALL_TYPES
+
+
+def _handler_types(handler):
+    if isinstance(handler, ConversationHandler):
+        types = set()
+        for child in handler.entry_points + handler.fallbacks:
+            types |= _handler_types(child)
+        for state_handlers in handler.states.values():
+            for child in state_handlers:
+                types |= _handler_types(child)
+        return types
+    if isinstance(handler, CommandHandler):
+        return set(_filter_types(handler.filters) & MESSAGE_TYPES)
+    if isinstance(handler, MessageHandler):
+        return set(_filter_types(handler.filters))
+    if isinstance(handler, ChatMemberHandler):
+        if handler.chat_member_types == ChatMemberHandler.MY_CHAT_MEMBER:
+            return {Update.MY_CHAT_MEMBER}
+        if handler.chat_member_types == ChatMemberHandler.CHAT_MEMBER:
+            return {Update.CHAT_MEMBER}
+        return {Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER}
+    for handler_class, types in _HANDLER_TYPES.items():
+        if isinstance(handler, handler_class):
+            return set(types)
+    return set(ALL_TYPES)
+
+
+# 返回按 Update.ALL_TYPES 顺序排列的列表，可直接传给 run_polling / set_webhook
+def derive(application):
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            types |= _handler_types(handler)
+    allowed = [str(t) for t in Update.ALL_TYPES if t in types]
+    skipped = [str(t) for t in Update.ALL_TYPES if t not in types]
+    logger.info(
+        f"allowed_updates: {allowed}; filtered out {len(skipped)}/{len(Update.ALL_TYPES)} update types: {skipped}"
+    )
+    return allowed
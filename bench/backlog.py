@@ -0,0 +1,125 @@
+"""积压消化基准：轮询版停机 --outage 秒后恢复，要多久才能处理完积压的更新
+
+流程：
+  1. FakeBotAPI 里预先放好停机期间积压的更新（--rate 条/秒 × --outage 秒），
+     混合 --channels 个频道的按钮帖（删除 + 重发）和私聊消息（每条来自不同用户）
+  2. Bot API 每次调用耗时 --latency 秒（模拟到 Telegram 的往返）
+  3. 依次以 --concurrency 里的每个 UPDATE_CONCURRENCY 启动轮询入口，
+     从第一次 getUpdates 到最后一次 sendMessage 即为消化时间
+  4. 检查每个频道的重发顺序是否和原帖顺序一致（按会话分片后必须保持）
+
+用法（在仓库根目录）：
+    python bench/backlog.py --out backlog.json
+    python bench/backlog.py yunduan4.py --outage 120 --rate 50 --concurrency 1,16,64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from e2e import ROOT, TOKEN
+from fake_bot_api import FakeBotAPI, free_port
+
+POST = re.compile(r"#(\d+)")
+
+
+def backlog(count, channels, private_ratio, seed):
+    rng = random.Random(seed)
+    updates = []
+    for i in range(1, count + 1):
+        if rng.random() < private_ratio:
+            user = {"id": 10_000_000 + i, "is_bot": False, "first_name": f"u{i}"}
+            chat = {"id": user["id"], "type": "private", "first_name": user["first_name"]}
+            message = {"message_id": i, "date": int(time.time()), "chat": chat, "text": "hi", "from": user}
+            updates.append({"update_id": i, "message": message})
+        else:
+            chat = {"id": -1001000000000 - rng.randrange(channels), "type": "channel", "title": "bench"}
+            text = f"帖子 #{i}\n===\n[按钮+https://example.com/{i}]"
+            updates.append({"update_id": i, "channel_post": {"message_id": i, "date": int(time.time()), "chat": chat, "text": text}})
+    return updates
+
+
+# 每个频道的重发顺序是否与原帖顺序一致
+def order_violations(sends):
+    last = {}
+    violations = 0
+    for params in sends:
+        match = POST.search(params.get("text", ""))
+        if match is None:
+            continue
+        chat, seq = params["chat_id"], int(match.group(1))
+        if seq < last.get(chat, 0):
+            violations += 1
+        last[chat] = seq
+    return violations
+
+
+async def run(entry, concurrency, updates, expected_sends, latency):
+    api = FakeBotAPI(latency={"sendMessage": latency, "deleteMessage": latency})
+    api_port = await api.start()
+    api.push_updates(updates)
+    tmp = tempfile.mkdtemp()
+    env = dict(
+        os.environ, TELEGRAM_BOT_TOKEN=TOKEN, BOT_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot",
+        PORT=str(free_port()), UPDATE_CONCURRENCY=str(concurrency), LOG_LEVEL="WARNING",
+        OUTBOX_PATH=os.path.join(tmp, "outbox.db"), JOBS_PATH=os.path.join(tmp, "jobs.db"),
+        MEDIA_CACHE_PATH=os.path.join(tmp, "media.db"),
+    )
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, entry, cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        # FakeBotAPI.wait_calls 每 5ms 扫一遍调用记录，几万条时会拖慢同进程里的 FakeBotAPI
+        while len(api.calls_to("sendMessage")) < expected_sends:
+            if proc.returncode is not None:
+                raise RuntimeError(f"{entry} exited with {proc.returncode}")
+            await asyncio.sleep(0.5)
+        polls = [t for t, method, _ in api.calls if method == "getUpdates"]
+        sends = [(t, params) for t, method, params in api.calls if method == "sendMessage"]
+        drain = sends[-1][0] - polls[0]
+        return {
+            "drain_s": round(drain, 2),
+            "updates_per_s": round(len(updates) / drain, 1),
+            "get_updates_calls": len(polls),
+            "order_violations": order_violations([params for _, params in sends]),
+        }
+    finally:
+        proc.terminate()
+        await proc.wait()
+        await api.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entry", nargs="?", default="yunduan3.py")
+    parser.add_argument("--outage", type=float, default=120, help="停机秒数")
+    parser.add_argument("--rate", type=float, default=30, help="停机期间每秒到达的更新数")
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--private", type=float, default=0.3, help="私聊消息占比")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    updates = backlog(int(args.outage * args.rate), args.channels, args.private, args.seed)
+    # 每条按钮帖重发一次，每个私聊用户回复一次
+    expected_sends = len(updates)
+    results = {"entry": args.entry, "updates": len(updates), "latency_s": args.latency, "runs": {}}
+    print(f"{args.entry}: {len(updates)} queued updates", flush=True)
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        results["runs"][concurrency] = await run(args.entry, concurrency, updates, expected_sends, args.latency)
+        print(concurrency, json.dumps(results["runs"][concurrency]), flush=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,367 @@
+"""端到端基准：把合成的更新流喂给真实的入口脚本，Bot API 由本地 FakeBotAPI 应答
+
+更新流按 --mix 的比例混合以下类型（入口不处理的类型会被跳过）：
+  channel_button  带 === 和按钮的频道文字帖      channel_plain  不带 === 的频道帖
+  channel_photo   带按钮的图片帖                  channel_video  带按钮的视频帖
+  private         私聊消息（每条来自不同用户）    join / leave   群组进群、退群系统提示
+  wizard          yunduan2 的定时帖子向导，每个流程 7 步，收到回复后再发下一步
+
+webhook 入口（yunduan.py、yunduan5.py）：以 --concurrency 个并发 POST 投递，非 200 时像 Telegram 一样重试
+轮询入口（yunduan2/3/4.py）：按 --rate 把更新放进 FakeBotAPI，由 getUpdates 取走
+
+每条更新的完成时间 = max(投递被确认的时间, 最后一个归属于它的 Bot API 调用的时间)，
+调用按 message_id、帖子里的 #u 标记和用户 chat_id 归属。轮询入口没有投递确认，
+不产生任何调用的更新（如不带 === 的帖子）不计入 completed 和延迟。报告：
+  updates_per_s           completed / (最后完成 - 首次投递)
+  latency_ms              端到端延迟 p50/p95/p99，总体和按类型
+  api_calls_per_update    除 getUpdates 和启动调用外的 Bot API 调用数 / 更新数
+  rss_mb                  机器人进程的常驻内存峰值
+
+用法（在仓库根目录）：
+    python bench/e2e.py --out e2e.json
+    python bench/e2e.py yunduan.py --updates 5000 --mix channel_button=5,private=3,join=2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientError
+
+from fake_bot_api import FakeBotAPI, free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCH"
+CHANNEL_ID = -1001000000001
+WEBHOOK_ENTRIES = ["yunduan.py", "yunduan5.py"]
+POLLING_ENTRIES = ["yunduan2.py", "yunduan3.py", "yunduan4.py"]
+CHANNEL_KINDS = ["channel_button", "channel_plain", "channel_photo", "channel_video"]
+SUPPORTED = {
+    "yunduan.py": CHANNEL_KINDS + ["private", "join", "leave"],
+    "yunduan5.py": CHANNEL_KINDS + ["private"],
+    "yunduan2.py": CHANNEL_KINDS + ["private", "wizard"],
+    "yunduan3.py": CHANNEL_KINDS + ["private"],
+    "yunduan4.py": CHANNEL_KINDS + ["private"],
+}
+DEFAULT_MIX = "channel_button=4,channel_plain=2,channel_photo=1,channel_video=1,private=3,join=2,leave=1,wizard=1"
+SETUP_METHODS = {"getMe", "getUpdates", "getWebhookInfo", "setWebhook", "deleteWebhook"}
+# 向导的每一步和这一步会发给用户的消息数
+WIZARD_STEPS = [
+    ("开始设置定时帖子", 1),
+    ("向导帖子 #u{idx}", 1),
+    ("2", 1),
+    ("[1],[2]", 1),
+    ("1[按钮A+https://a.example.com]\n2[按钮B+https://b.example.com]", 2),
+    ("@benchchannel", 1),
+    ("2099/01/01 00:00", 1),
+]
+TAG = re.compile(r"#u(\d+)")
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    return {f"p{q}": round(values[min(int(q / 100 * len(values)), len(values) - 1)] * 1000, 1) for q in (50, 95, 99)}
+
+
+class Stream:
+    def __init__(self, count, mix, groups, seed):
+        self.updates = []
+        self.wizards = []
+        self._random = random.Random(seed)
+        kinds, weights = zip(*mix.items())
+        for _ in range(count):
+            self._add(self._random.choices(kinds, weights)[0], groups)
+
+    def _message(self, idx, chat, **fields):
+        return dict({"message_id": idx, "date": int(time.time()), "chat": chat}, **fields)
+
+    def _add(self, kind, groups):
+        idx = len(self.updates) + 1
+        user = {"id": 10_000_000 + idx, "is_bot": False, "first_name": f"u{idx}"}
+        group = {"id": -1002000000000 - self._random.randrange(groups), "type": "supergroup", "title": "bench"}
+        channel = {"id": CHANNEL_ID, "type": "channel", "title": "bench"}
+        buttons = f"===\n[按钮+https://example.com/{idx}],[按钮2+https://example.org/{idx}]"
+        if kind == "channel_button":
+            update = {"channel_post": self._message(idx, channel, text=f"帖子 #u{idx}\n{buttons}")}
+        elif kind == "channel_plain":
+            update = {"channel_post": self._message(idx, channel, text=f"普通帖子 #u{idx}")}
+        elif kind == "channel_photo":
+            photo = [{"file_id": f"photo{idx}", "file_unique_id": f"p{idx}", "width": 1280, "height": 720}]
+            update = {"channel_post": self._message(idx, channel, photo=photo, caption=f"图片 #u{idx}\n{buttons}")}
+        elif kind == "channel_video":
+            video = {"file_id": f"video{idx}", "file_unique_id": f"v{idx}", "width": 1280, "height": 720, "duration": 10}
+            update = {"channel_post": self._message(idx, channel, video=video, caption=f"视频 #u{idx}\n{buttons}")}
+        elif kind == "private":
+            chat = {"id": user["id"], "type": "private", "first_name": user["first_name"]}
+            update = {"message": self._message(idx, chat, text="hi", **{"from": user})}
+        elif kind == "join":
+            update = {"message": self._message(idx, group, new_chat_members=[user], **{"from": user})}
+        elif kind == "leave":
+            update = {"message": self._message(idx, group, left_chat_member=user, **{"from": user})}
+        else:
+            # 向导的各步按顺序排在一起，投递时整个流程串行
+            chat = {"id": user["id"], "type": "private", "first_name": user["first_name"]}
+            steps = []
+            for text, replies in WIZARD_STEPS:
+                step_idx = len(self.updates) + 1
+                message = self._message(step_idx, chat, text=text.format(idx=step_idx), **{"from": user})
+                self.updates.append({"update_id": step_idx, "message": message, "_kind": "wizard", "_replies": replies})
+                steps.append(step_idx)
+            self.wizards.append((user["id"], steps))
+            return
+        update.update({"update_id": idx, "_kind": kind})
+        self.updates.append(update)
+
+    def filtered(self, kinds):
+        return [u for u in self.updates if u["_kind"] in kinds]
+
+
+class Run:
+    def __init__(self, entry, updates, api):
+        self.entry = entry
+        self.updates = {u["update_id"]: u for u in updates}
+        self.api = api
+        self.delivered = {}
+        self.acked = {}
+        self.retries = 0
+        self.rss_peak = 0.0
+
+    @staticmethod
+    def payload(update):
+        return {k: v for k, v in update.items() if not k.startswith("_")}
+
+    # 把每个 Bot API 调用归到对应的更新上，返回每条更新的最后一次调用时间
+    def attribute(self):
+        by_message = {}
+        by_user = {}
+        for update_id, update in self.updates.items():
+            message = update.get("message") or update.get("channel_post")
+            by_message[message["message_id"]] = update_id
+            if update["_kind"] in ("private", "wizard"):
+                by_user.setdefault(message["chat"]["id"], []).append(update_id)
+        last = {}
+        calls = 0
+        for t, method, params in self.api.calls:
+            if method in SETUP_METHODS:
+                continue
+            calls += 1
+            update_id = None
+            if method == "deleteMessages":
+                # 一次删除整批系统提示，每条都算在这次调用上
+                for message_id in json.loads(params.get("message_ids", "[]")):
+                    update_id = by_message.get(int(message_id))
+                    if update_id is not None:
+                        last[update_id] = max(last.get(update_id, 0), t)
+                continue
+            if method == "deleteMessage":
+                update_id = by_message.get(int(params.get("message_id", 0)))
+            tag = TAG.search(params.get("text", "") or params.get("caption", ""))
+            if update_id is None and tag:
+                update_id = by_message.get(int(tag.group(1)))
+            chat_id = params.get("chat_id", "")
+            if update_id is None and chat_id.lstrip("-").isdigit() and int(chat_id) in by_user:
+                # 同一用户的多步流程：归给调用前最后投递的那一步
+                steps = [s for s in by_user[int(chat_id)] if self.delivered.get(s, float("inf")) <= t]
+                update_id = steps[-1] if steps else None
+            if update_id is not None:
+                last[update_id] = max(last.get(update_id, 0), t)
+        return last, calls
+
+    def report(self, started):
+        last, calls = self.attribute()
+        latencies = {}
+        done = []
+        for update_id, update in self.updates.items():
+            if update_id not in self.delivered:
+                continue
+            finished = max(self.acked.get(update_id, 0), last.get(update_id, 0))
+            if not finished:
+                continue
+            done.append(finished)
+            latencies.setdefault(update["_kind"], []).append(finished - self.delivered[update_id])
+        duration = max(done) - started if done else 0
+        return {
+            "updates": len(self.updates),
+            "completed": len(done),
+            "duration_s": round(duration, 3),
+            "updates_per_s": round(len(done) / duration, 1) if duration else None,
+            "latency_ms": dict(
+                {"all": percentiles([v for values in latencies.values() for v in values])},
+                **{kind: percentiles(values) for kind, values in sorted(latencies.items())},
+            ),
+            "api_calls": calls,
+            "api_calls_per_update": round(calls / len(self.updates), 3) if self.updates else None,
+            "delivery_retries": self.retries,
+            "rss_mb": round(self.rss_peak, 1),
+        }
+
+
+def read_rss(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+async def watch_rss(run, pid):
+    while True:
+        run.rss_peak = max(run.rss_peak, read_rss(pid))
+        await asyncio.sleep(0.2)
+
+
+async def wait_quiet(api, quiet, timeout):
+    deadline = time.monotonic() + timeout
+    count = -1
+    changed = time.monotonic()
+    while time.monotonic() - changed < quiet and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        calls = [c for c in api.calls if c[1] != "getUpdates"]
+        if len(calls) != count:
+            count, changed = len(calls), time.monotonic()
+
+
+async def wait_replies(api, chat_id, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sent = [p for _, m, p in api.calls if m.startswith("send") and p.get("chat_id") == str(chat_id)]
+        if len(sent) >= count:
+            return
+        await asyncio.sleep(0.005)
+
+
+async def deliver_webhook(run, session, url, update):
+    run.delivered[update["update_id"]] = time.monotonic()
+    while True:
+        try:
+            async with session.post(url, json=run.payload(update)) as resp:
+                await resp.read()
+                if resp.status == 200:
+                    run.acked[update["update_id"]] = time.monotonic()
+                    return
+        except ClientError:
+            pass
+        run.retries += 1
+        await asyncio.sleep(0.05)
+
+
+async def drive(run, stream_wizards, args, port):
+    api = run.api
+    wizard_steps = {step for _, steps in stream_wizards for step in steps}
+    singles = [u for u in run.updates.values() if u["update_id"] not in wizard_steps]
+    wizards = [(user, steps) for user, steps in stream_wizards if steps[0] in run.updates]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with ClientSession() as session:
+        url = f"http://127.0.0.1:{port}/{TOKEN}"
+
+        async def send(update):
+            if run.entry in WEBHOOK_ENTRIES:
+                async with semaphore:
+                    await deliver_webhook(run, session, url, update)
+            else:
+                run.delivered[update["update_id"]] = time.monotonic()
+                api.push_updates([run.payload(update)])
+
+        async def wizard(user_id, steps):
+            expected = 0
+            for step in steps:
+                expected += run.updates[step]["_replies"]
+                await send(run.updates[step])
+                await wait_replies(api, user_id, expected)
+
+        tasks = [asyncio.ensure_future(wizard(user, steps)) for user, steps in wizards]
+        for update in singles:
+            tasks.append(asyncio.ensure_future(send(update)))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+            elif len(tasks) % 100 == 0:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+
+async def bench_entry(entry, stream, args):
+    updates = stream.filtered(SUPPORTED[entry])
+    api = FakeBotAPI(latency={"*": args.api_latency})
+    api_port = await api.start()
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+        "PORT": str(port),
+        # 状态文件都放在临时目录，不写进仓库
+        "OUTBOX_PATH": os.path.join(tmp, "outbox.db"),
+        "JOBS_PATH": os.path.join(tmp, "jobs.db"),
+        "MEDIA_CACHE_PATH": os.path.join(tmp, "media.db"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, entry, cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    run = Run(entry, updates, api)
+    watcher = asyncio.ensure_future(watch_rss(run, proc.pid))
+    try:
+        # 等机器人启动完成：webhook 入口看 setWebhook，轮询入口看第一次 getUpdates
+        await api.wait_calls("setWebhook" if entry in WEBHOOK_ENTRIES else "getUpdates", 1, timeout=60)
+        if entry in WEBHOOK_ENTRIES:
+            await asyncio.sleep(0.2)
+        started = time.monotonic()
+        await drive(run, stream.wizards, args, port)
+        await wait_quiet(api, args.quiet, args.timeout)
+        return run.report(started)
+    finally:
+        watcher.cancel()
+        proc.terminate()
+        await proc.wait()
+        await api.stop()
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entries", nargs="*", default=WEBHOOK_ENTRIES + POLLING_ENTRIES)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--groups", type=int, default=200, help="进群/退群分布的群组数")
+    parser.add_argument("--rate", type=float, default=0, help="每秒投递的更新数，0 为尽快投递")
+    parser.add_argument("--concurrency", type=int, default=50, help="webhook 并发投递数")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="每个 Bot API 调用的延迟（秒）")
+    parser.add_argument("--quiet", type=float, default=3.0, help="多少秒没有新调用视为处理完毕")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    stream = Stream(args.updates, parse_mix(args.mix), args.groups, args.seed)
+    results = {"config": {k: v for k, v in vars(args).items() if k != "out"}, "entries": {}}
+    for entry in args.entries:
+        results["entries"][entry] = await bench_entry(entry, stream, args)
+        print(entry, json.dumps(results["entries"][entry], ensure_ascii=False), flush=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
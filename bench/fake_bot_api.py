@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+
+from aiohttp import web
+
+# 本地的 Bot API 替身，供基准测试和离线调试使用
+# 记录每一次调用 (时间, 方法, 参数)，按方法配置延迟；
+# 行为尽量贴近真实接口：重复删除同一条消息会返回 400。
+#
+# 故障注入，按方法配置概率（"*" 表示所有方法）：
+#   faults={"sendMessage": {"429": 0.1, "5xx": 0.05, "drop": 0.01}}
+#     429   返回 Too Many Requests，parameters.retry_after = retry_after
+#     5xx   返回 502 Bad Gateway
+#     drop  不回应直接断开连接
+# 也可以用 inject(method, kind, count) 指定接下来 count 次调用必定出错，便于断言调用顺序。
+#
+# 单独运行时作为常驻服务，入口脚本设置 BOT_API_BASE_URL=http://127.0.0.1:8081/bot 即可连上：
+#     python bench/fake_bot_api.py --port 8081 --latency sendVideo=0.5 --fault sendMessage:429=0.1
+# 控制接口：POST /_updates 追加 getUpdates 返回的更新（JSON 数组），GET /_calls 查看调用记录。
+
+FAULT_KINDS = ("429", "5xx", "drop")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeBotAPI:
+    def __init__(self, updates=(), latency=None, faults=None, retry_after=1, seed=None):
+        self.updates = list(updates)
+        self.latency = dict(latency or {})
+        self.faults = dict(faults or {})
+        self.retry_after = retry_after
+        self.calls = []
+        self._random = random.Random(seed)
+        self._injected = {}
+        self._deleted = set()
+        self._next_message_id = 1000000
+        self._next_update_id = 1
+        self._updates_ready = asyncio.Event()
+        self._runner = None
+        self.port = None
+
+    def calls_to(self, method):
+        return [params for _, name, params in self.calls if name == method]
+
+    # 按顺序返回调用过的方法名，可以忽略 getUpdates 之类的背景调用
+    def call_sequence(self, ignore=("getUpdates",)):
+        return [name for _, name, _ in self.calls if name not in ignore]
+
+    def reset(self):
+        self.calls.clear()
+        self._injected.clear()
+
+    async def wait_calls(self, method, count, timeout=30):
+        deadline = time.monotonic() + timeout
+        while len(self.calls_to(method)) < count:
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f"{method}: expected {count} calls")
+            await asyncio.sleep(0.005)
+
+    # 接下来 count 次调用 method 时必定返回 kind 类型的故障
+    def inject(self, method, kind, count=1):
+        if kind not in FAULT_KINDS:
+            raise ValueError(f"unknown fault kind: {kind}")
+        self._injected.setdefault(method, []).extend([kind] * count)
+
+    # 追加更新，正在长轮询的 getUpdates 会立即返回；没有 update_id 的自动编号
+    def push_updates(self, updates):
+        for update in updates:
+            if "update_id" not in update:
+                update = dict(update, update_id=self._next_update_id)
+            self._next_update_id = max(self._next_update_id, update["update_id"] + 1)
+            self.updates.append(update)
+        self._updates_ready.set()
+
+    async def start(self, port=None):
+        # 上传文件时请求体可能很大（Bot API 本身限制 50MB）
+        app = web.Application(client_max_size=1 << 30)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/bot{token}/{method}", self._handle)
+        app.router.add_post("/_updates", self._push_updates)
+        app.router.add_get("/_calls", self._list_calls)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        self.port = port or free_port()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        return self.port
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def _pick_fault(self, method):
+        injected = self._injected.get(method)
+        if injected:
+            return injected.pop(0)
+        for key in (method, "*"):
+            for kind, probability in self.faults.get(key, {}).items():
+                if self._random.random() < probability:
+                    return kind
+        return None
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((time.monotonic(), method, params))
+        delay = self.latency.get(method, self.latency.get("*"))
+        if delay:
+            await asyncio.sleep(delay)
+        fault = self._pick_fault(method)
+        if fault == "drop":
+            request.transport.close()
+            raise asyncio.CancelledError()
+        if fault == "429":
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if fault == "5xx":
+            return self._error(502, "Bad Gateway")
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return self._ok(True)
+        return await handler(params)
+
+    async def _push_updates(self, request):
+        updates = await request.json()
+        self.push_updates(updates if isinstance(updates, list) else [updates])
+        return self._ok(len(self.updates))
+
+    async def _list_calls(self, request):
+        return web.json_response([
+            {"time": t, "method": method, "params": params} for t, method, params in self.calls
+        ])
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, code, description):
+        return web.json_response({"ok": False, "error_code": code, "description": description}, status=code)
+
+    def _message(self, params):
+        self._next_message_id += 1
+        chat_id = params.get("chat_id", "0")
+        chat_type = "channel" if str(chat_id).startswith("-100") else "private"
+        message = {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": chat_type},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        # 上传的文件分配新的 file_id，传 file_id 的原样返回
+        for kind in ("photo", "video"):
+            if kind in params:
+                value = params[kind]
+                file_id = value if isinstance(value, str) else f"{kind}-upload-{self._next_message_id}"
+                media = {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}
+                message[kind] = [media] if kind == "photo" else dict(media, duration=10)
+        return message
+
+    async def _api_getMe(self, params):
+        return self._ok({"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"})
+
+    async def _api_getWebhookInfo(self, params):
+        return self._ok({"url": "", "has_custom_certificate": False, "pending_update_count": 0})
+
+    async def _api_getUpdates(self, params):
+        if not self.updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), min(float(params.get("timeout", 0)), 1))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100))
+        batch, self.updates = self.updates[:limit], self.updates[limit:]
+        return self._ok(batch)
+
+    async def _api_sendMessage(self, params):
+        return self._ok(self._message(params))
+
+    _api_sendPhoto = _api_sendMessage
+    _api_sendVideo = _api_sendMessage
+
+    async def _api_copyMessage(self, params):
+        self._next_message_id += 1
+        return self._ok({"message_id": self._next_message_id})
+
+    async def _api_deleteMessage(self, params):
+        key = (params.get("chat_id"), params.get("message_id"))
+        if key in self._deleted:
+            return self._error(400, "Bad Request: message to delete not found")
+        self._deleted.add(key)
+        return self._ok(True)
+
+    # deleteMessages：删不掉的（已删除的）直接跳过，和真实接口一样整体返回 True
+    async def _api_deleteMessages(self, params):
+        for message_id in json.loads(params.get("message_ids", "[]")):
+            self._deleted.add((params.get("chat_id"), str(message_id)))
+        return self._ok(True)
+
+
+def _parse_pairs(values, cast=float):
+    pairs = {}
+    for value in values or ():
+        key, _, number = value.partition("=")
+        pairs[key] = cast(number)
+    return pairs
+
+
+async def _serve(args):
+    faults = {}
+    for key, probability in _parse_pairs(args.fault).items():
+        method, _, kind = key.rpartition(":")
+        faults.setdefault(method or "*", {})[kind] = probability
+    api = FakeBotAPI(latency=_parse_pairs(args.latency), faults=faults, retry_after=args.retry_after, seed=args.seed)
+    await api.start(args.port)
+    print(f"Fake Bot API listening, BOT_API_BASE_URL={api.base_url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        if args.calls_out:
+            with open(args.calls_out, "w") as f:
+                json.dump([{"time": t, "method": m, "params": p} for t, m, p in api.calls], f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Bot API 替身")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", action="append", metavar="METHOD=SECONDS", help="例如 sendVideo=0.5，* 表示所有方法")
+    parser.add_argument("--fault", action="append", metavar="METHOD:KIND=P", help="KIND 为 429 / 5xx / drop，例如 sendMessage:429=0.1")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--calls-out", help="退出时把调用记录写入该文件")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
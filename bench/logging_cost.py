@@ -0,0 +1,162 @@
+"""日志开销基准：同一批更新在不同日志配置下，webhook 每条更新的 CPU 时间和响应延迟
+
+配置：
+  off        LOG_LEVEL=WARNING，不输出 INFO
+  sampled    默认：后台线程格式化，载荷按 1% 抽样、每秒最多 5 条
+  full       后台线程格式化，每条更新的载荷都输出
+  sync_full  同步输出且每条都输出载荷（改动前的行为）
+
+日志写到临时文件，统计机器人进程的 CPU 时间（/proc/<pid>/stat）和 webhook 响应时间。
+进程级的数字包含 SQLite、HTTP 等所有开销，另外在本进程里单独测一遍 webhook 的日志语句
+在调用线程（也就是事件循环）上的耗时，结果在 event_loop_us_per_update。
+
+用法（在仓库根目录）：
+    python bench/logging_cost.py --updates 3000 --out logging.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession
+
+from e2e import Stream, percentiles
+from fake_bot_api import FakeBotAPI, free_port
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logsetup  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCH"
+CONFIGS = {
+    "off": {"LOG_LEVEL": "WARNING"},
+    "sampled": {},
+    "full": {"LOG_PAYLOAD_SAMPLE": "1", "LOG_PAYLOAD_PER_SECOND": "0"},
+    "sync_full": {"LOG_QUEUE": "0", "LOG_PAYLOAD_SAMPLE": "1", "LOG_PAYLOAD_PER_SECOND": "0"},
+}
+TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / TICKS
+
+
+# 在当前线程里执行 webhook 每条更新的日志语句，返回每条更新的微秒数
+def event_loop_cost(name, updates):
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    stream = logging.StreamHandler(open(os.path.join(tempfile.mkdtemp(), "log"), "w"))
+    stream.setFormatter(logging.Formatter(logsetup.FORMAT))
+    listener = None
+    if name == "sync_full":
+        logger.addHandler(stream)
+    else:
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, stream)
+        listener.start()
+        logger.addHandler(logsetup.DeferredQueueHandler(records))
+    logger.setLevel(logging.WARNING if name == "off" else logging.INFO)
+    sampler = logsetup.Sampler() if name == "sampled" else logsetup.Sampler(1, 0)
+
+    started = time.perf_counter()
+    for update in updates:
+        if name == "sync_full":
+            # 改动前：f-string 在调用线程格式化，同步写入
+            logger.info(f"Received JSON: {update}")
+            logger.info("Update processed successfully")
+        else:
+            if sampler.allow():
+                logger.info("Received JSON: %s", update)
+            logger.debug("Update processed successfully")
+    elapsed = time.perf_counter() - started
+    if listener is not None:
+        listener.stop()
+    return round(elapsed / len(updates) * 1e6, 2)
+
+
+async def run_config(name, env_overrides, updates, args):
+    api = FakeBotAPI()
+    api_port = await api.start()
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+        "PORT": str(port),
+        "OUTBOX_PATH": os.path.join(tmp, "outbox.db"),
+        "JOBS_PATH": os.path.join(tmp, "jobs.db"),
+        "MEDIA_CACHE_PATH": os.path.join(tmp, "media.db"),
+    })
+    env.update(env_overrides)
+    log_path = os.path.join(tmp, "bot.log")
+    with open(log_path, "w") as log:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, args.entry, cwd=ROOT, env=env, stdout=log, stderr=log,
+        )
+    try:
+        await api.wait_calls("setWebhook", 1, timeout=60)
+        await asyncio.sleep(0.5)
+        latencies = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+        url = f"http://127.0.0.1:{port}/{TOKEN}"
+        async with ClientSession() as session:
+            async def post(update):
+                async with semaphore:
+                    started = time.perf_counter()
+                    async with session.post(url, json=update) as resp:
+                        await resp.read()
+                    latencies.append(time.perf_counter() - started)
+
+            cpu_before = cpu_seconds(proc.pid)
+            wall = time.perf_counter()
+            await asyncio.gather(*[post(u) for u in updates])
+            wall = time.perf_counter() - wall
+            # 等日志线程把队列写完再计 CPU
+            await asyncio.sleep(0.5)
+            cpu = cpu_seconds(proc.pid) - cpu_before
+        return {
+            "cpu_us_per_update": round(cpu / len(updates) * 1e6, 1),
+            "updates_per_s": round(len(updates) / wall, 1),
+            "latency_ms": percentiles(latencies),
+            "log_bytes": os.path.getsize(log_path),
+        }
+    finally:
+        proc.terminate()
+        await proc.wait()
+        await api.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entry", default="yunduan.py")
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    # 私聊、普通频道帖、带按钮的频道帖大约各占三分之一
+    stream = Stream(args.updates, {"private": 1, "channel_plain": 1, "channel_button": 1}, 1, seed=1)
+    updates = [{k: v for k, v in u.items() if not k.startswith("_")} for u in stream.updates]
+    results = {"entry": args.entry, "updates": len(updates), "configs": {}}
+    for name in args.configs.split(","):
+        results["configs"][name] = await run_config(name, CONFIGS[name], updates, args)
+        results["configs"][name]["event_loop_us_per_update"] = event_loop_cost(name, updates)
+        print(name, json.dumps(results["configs"][name]), flush=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""事件循环基准：默认 asyncio 循环 vs uvloop（EVENT_LOOP=uvloop）
+
+对 --loops 里的每种循环测两项：
+  webhook    用 e2e.py 的流程把 --updates 条更新喂给 yunduan.py（EVENT_LOOP 设为该循环），
+             报告吞吐和端到端延迟
+  jitter     在本进程里用该循环跑一个 --interval 秒的周期定时器，同时有 --load 个任务经本地 TCP
+             互相收发小包，统计定时器每次醒来比预定时间晚了多少（p50/p99/max）
+
+没装 uvloop 时跳过它（入口脚本本身会退回 asyncio，测出来的就不是 uvloop 了）。
+
+用法（在仓库根目录）：
+    python bench/loop_policy.py --out loop_policy.json
+    python bench/loop_policy.py --updates 5000 --load 500
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import time
+
+from e2e import Stream, bench_entry, percentiles
+
+MIX = {"channel_button": 4, "channel_plain": 2, "private": 3, "join": 2, "leave": 1}
+
+
+def new_loop(name):
+    if name == "uvloop":
+        import uvloop
+
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+async def echo(reader, writer):
+    while data := await reader.read(64):
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+async def chatter(port, stop):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    while not stop.is_set():
+        writer.write(b"x" * 32)
+        await writer.drain()
+        await reader.read(64)
+    writer.close()
+
+
+async def measure_jitter(seconds, interval, load):
+    server = await asyncio.start_server(echo, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    stop = asyncio.Event()
+    workers = [asyncio.ensure_future(chatter(port, stop)) for _ in range(load)]
+    await asyncio.sleep(0.5)
+    loop = asyncio.get_running_loop()
+    late = []
+    deadline = loop.time() + seconds
+    while loop.time() < deadline:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        late.append(max(loop.time() - expected, 0))
+    stop.set()
+    await asyncio.gather(*workers, return_exceptions=True)
+    server.close()
+    await server.wait_closed()
+    return dict(percentiles(late), max=round(max(late) * 1000, 1), wakeups=len(late))
+
+
+def jitter(name, args):
+    loop = new_loop(name)
+    try:
+        return loop.run_until_complete(measure_jitter(args.seconds, args.interval, args.load))
+    finally:
+        loop.close()
+
+
+async def webhook(name, stream, args):
+    os.environ["EVENT_LOOP"] = name
+    try:
+        report = await bench_entry("yunduan.py", stream, args)
+    finally:
+        os.environ.pop("EVENT_LOOP", None)
+    return {
+        "completed": report["completed"], "updates_per_s": report["updates_per_s"],
+        "latency_ms": report["latency_ms"]["all"], "rss_mb": report["rss_mb"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loops", default="asyncio,uvloop")
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100, help="webhook 并发投递数")
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--seconds", type=float, default=10, help="jitter 测量时长")
+    parser.add_argument("--interval", type=float, default=0.01, help="jitter 定时器周期（秒）")
+    parser.add_argument("--load", type=int, default=200, help="jitter 测量时的背景连接数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    # bench_entry 需要的 e2e 参数
+    args.rate, args.quiet, args.timeout = 0, 2.0, 300
+
+    stream = Stream(args.updates, MIX, 200, args.seed)
+    results = {"config": {k: v for k, v in vars(args).items() if k != "out"}, "loops": {}}
+    for name in args.loops.split(","):
+        if name == "uvloop" and importlib.util.find_spec("uvloop") is None:
+            print("uvloop is not installed, skipping", flush=True)
+            continue
+        started = time.monotonic()
+        results["loops"][name] = {
+            "webhook": asyncio.run(webhook(name, stream, args)),
+            "jitter_ms": jitter(name, args),
+        }
+        print(name, json.dumps(results["loops"][name], ensure_ascii=False), f"({time.monotonic() - started:.0f}s)", flush=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
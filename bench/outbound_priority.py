@@ -0,0 +1,81 @@
+"""优先级调度基准：大批量定时发送进行中，私聊回复要等多久
+
+流程：
+  1. FakeBotAPI 的每次 sendMessage 耗时 --latency 秒
+  2. 一次性发起 --bulk 条 bulk 发送（相当于一大批定时任务同时到点）
+  3. 同时以 --interactive-rate 条/秒发私聊回复，共 --interactive 条，另有少量频道重发
+  4. 统计各类请求从发起到完成的 p50/p95/p99
+
+--fifo 时所有请求都归入同一类，相当于没有优先级的对照组。
+
+用法（在仓库根目录）：
+    python bench/outbound_priority.py
+    python bench/outbound_priority.py --fifo
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from fake_bot_api import FakeBotAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bulk", type=int, default=1000)
+    parser.add_argument("--interactive", type=int, default=50)
+    parser.add_argument("--interactive-rate", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--fifo", action="store_true")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency={"sendMessage": args.latency})
+    api_port = await api.start()
+    os.environ["BOT_API_BASE_URL"] = f"http://127.0.0.1:{api_port}/bot"
+    os.environ["OUTBOUND_CONCURRENCY"] = str(args.concurrency)
+    import botclient
+    import metrics
+    import priority
+
+    bot = botclient.application_builder("123456:BENCH").build().bot
+    await bot.initialize()
+
+    async def send(cls, chat_id, text):
+        with priority.use(priority.BULK if args.fifo else cls):
+            await bot.send_message(chat_id=chat_id, text=text)
+
+    # 按请求本来的分类计时：--fifo 时调度器看到的都是 bulk
+    async def timed(cls, chat_id, text):
+        started = asyncio.get_running_loop().time()
+        await send(cls, chat_id, text)
+        metrics.observe("bench_latency_seconds", asyncio.get_running_loop().time() - started, priority=cls)
+
+    bulk = [asyncio.ensure_future(timed(priority.BULK, -1001, f"bulk {i}")) for i in range(args.bulk)]
+    interactive = []
+    for i in range(args.interactive):
+        interactive.append(asyncio.ensure_future(timed(priority.INTERACTIVE, 1000 + i, f"reply {i}")))
+        if i % 5 == 0:
+            interactive.append(asyncio.ensure_future(timed(priority.REPOST, -1002, f"repost {i}")))
+        await asyncio.sleep(1 / args.interactive_rate)
+    await asyncio.gather(*interactive)
+    await asyncio.gather(*bulk)
+    await bot.shutdown()
+    await api.stop()
+
+    results = {"fifo": args.fifo, "bulk": args.bulk, "latency_ms": {}}
+    for cls in priority.CLASSES:
+        q = metrics.quantiles("bench_latency_seconds", priority=cls)
+        results["latency_ms"][cls] = {f"p{int(k * 100)}": round(v * 1000, 1) for k, v in q.items()}
+    print(json.dumps(results, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
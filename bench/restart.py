@@ -0,0 +1,140 @@
+"""重启基准：在持续的频道发帖负载下重启 webhook 进程，统计丢失的帖子
+
+流程：
+  1. 启动 FakeBotAPI（sendMessage 带延迟，保证重启时有处理到一半的帖子）和机器人进程 A
+  2. 按固定速率投递带 === 的频道帖子；非 200 或连接失败时像 Telegram 一样重试
+  3. 投递到 --restart-at 比例时向 A 发送信号（默认 SIGTERM），A 退出后在同一端口启动 B
+  4. 全部投递成功后统计：被删除但没有重发的帖子即为丢失
+
+用法（在仓库根目录）：
+    python bench/restart.py --posts 300 --rate 100
+    python bench/restart.py --signal KILL   # 对照：不经过优雅停机直接杀进程
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientError
+
+from fake_bot_api import FakeBotAPI, free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCH"
+CHANNEL_ID = -1001234567890
+
+
+def channel_post(i):
+    return {
+        "update_id": i,
+        "channel_post": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": CHANNEL_ID, "type": "channel", "title": "bench"},
+            "text": f"post {i}\n===\n[按钮+https://example.com/{i}]",
+        },
+    }
+
+
+async def start_bot(entry, api_port, port, outbox_path):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+        "PORT": str(port),
+        # 新旧进程共用同一个发件箱（任务表、媒体缓存也放在同一个临时目录）
+        "OUTBOX_PATH": outbox_path,
+        "JOBS_PATH": os.path.join(os.path.dirname(outbox_path), "jobs.db"),
+        "MEDIA_CACHE_PATH": os.path.join(os.path.dirname(outbox_path), "media.db"),
+    })
+    return await asyncio.create_subprocess_exec(
+        sys.executable, entry, cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+async def deliver(session, port, update, stats):
+    url = f"http://127.0.0.1:{port}/{TOKEN}"
+    while True:
+        try:
+            async with session.post(url, json=update) as resp:
+                if resp.status == 200:
+                    return
+                stats["retries"] += 1
+        except ClientError:
+            stats["retries"] += 1
+        await asyncio.sleep(0.05)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entry", nargs="?", default="yunduan.py")
+    parser.add_argument("--posts", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=100, help="每秒投递的帖子数")
+    parser.add_argument("--send-latency", type=float, default=0.3)
+    parser.add_argument("--restart-at", type=float, default=0.5)
+    parser.add_argument("--signal", default="TERM", choices=["TERM", "KILL"])
+    parser.add_argument("--settle", type=float, default=1.0, help="投递完成后等待后台重发的秒数")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency={"sendMessage": args.send_latency})
+    api_port = await api.start()
+    port = free_port()
+    outbox_path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+    bot = await start_bot(args.entry, api_port, port, outbox_path)
+    stats = {"retries": 0}
+
+    async def restart():
+        nonlocal bot
+        started = time.perf_counter()
+        bot.send_signal(getattr(signal, f"SIG{args.signal}"))
+        await bot.wait()
+        bot = await start_bot(args.entry, api_port, port, outbox_path)
+        stats["restart_exit_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async with ClientSession() as session:
+        tasks = []
+        restart_task = None
+        for i in range(1, args.posts + 1):
+            tasks.append(asyncio.ensure_future(deliver(session, port, channel_post(i), stats)))
+            if restart_task is None and i >= args.posts * args.restart_at:
+                restart_task = asyncio.ensure_future(restart())
+            await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        await restart_task
+    # 等最后一批重发和发件箱重试完成
+    await asyncio.sleep(args.send_latency + args.settle)
+    bot.terminate()
+    await bot.wait()
+    await api.stop()
+
+    deleted = {int(p["message_id"]) for p in api.calls_to("deleteMessage")}
+    reposted = {}
+    for p in api.calls_to("sendMessage"):
+        n = int(p["text"].split()[1])
+        reposted[n] = reposted.get(n, 0) + 1
+    results = {
+        "entry": args.entry,
+        "signal": args.signal,
+        "posts": args.posts,
+        "deleted": len(deleted),
+        "reposted": len(reposted),
+        "lost_posts": len(deleted - set(reposted)),
+        "duplicate_reposts": sum(c - 1 for c in reposted.values()),
+        "delivery_retries": stats["retries"],
+        "restart_exit_ms": stats.get("restart_exit_ms"),
+    }
+    print(json.dumps(results, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
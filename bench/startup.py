@@ -0,0 +1,132 @@
+"""启动耗时基准
+
+对每个入口脚本测量：
+  import_ms         导入模块耗时（含 telegram / aiohttp 等依赖）
+  import_rss_mb     导入后的常驻内存
+  first_update_ms   从启动进程到第一条私聊消息被回复的耗时
+                    webhook 版本：不断向 /{TOKEN} 投递更新直到返回 200
+                    轮询版本：本地 Bot API 在第一次 getUpdates 时返回这条更新，收到回复即结束
+
+所有 Bot API 调用都由本地的 FakeBotAPI 应答，不需要真实 token 和网络。
+
+用法（在仓库根目录）：
+    python bench/startup.py --runs 5 --out startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientError
+
+from fake_bot_api import FakeBotAPI, free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCH"
+WEBHOOK_ENTRIES = ["yunduan.py", "yunduan5.py"]
+POLLING_ENTRIES = ["yunduan2.py", "yunduan3.py", "yunduan4.py"]
+
+PRIVATE_UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 1000, "type": "private", "first_name": "bench"},
+        "from": {"id": 1000, "is_bot": False, "first_name": "bench"},
+        "text": "hi",
+    },
+}
+
+
+def _env(api_port, port):
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "BOT_API_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+        "PORT": str(port),
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "OUTBOX_PATH": os.path.join(tmp, "outbox.db"),
+        "JOBS_PATH": os.path.join(tmp, "jobs.db"),
+        "MEDIA_CACHE_PATH": os.path.join(tmp, "media.db"),
+    })
+    return env
+
+
+def measure_import(entry):
+    module = entry[:-3]
+    code = (
+        "import time, resource; t = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - t) * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=_env(1, 1),
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return float(out[-2]), float(out[-1])
+
+
+async def measure_first_update(entry):
+    api = FakeBotAPI(updates=[PRIVATE_UPDATE])
+    api_port = await api.start()
+    port = free_port()
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, entry, cwd=ROOT, env=_env(api_port, port),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        if entry in WEBHOOK_ENTRIES:
+            async with ClientSession() as session:
+                while True:
+                    try:
+                        async with session.post(f"http://127.0.0.1:{port}/{TOKEN}", json=PRIVATE_UPDATE) as resp:
+                            if resp.status == 200:
+                                break
+                    except ClientError:
+                        await asyncio.sleep(0.005)
+        else:
+            await api.wait_calls("sendMessage", 1, timeout=60)
+        return (time.perf_counter() - start) * 1000
+    finally:
+        proc.terminate()
+        await proc.wait()
+        await api.stop()
+
+
+def _summary(values):
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out")
+    parser.add_argument("entries", nargs="*", default=WEBHOOK_ENTRIES + POLLING_ENTRIES)
+    args = parser.parse_args()
+
+    results = {}
+    for entry in args.entries:
+        imports = [measure_import(entry) for _ in range(args.runs)]
+        first = [await measure_first_update(entry) for _ in range(args.runs)]
+        results[entry] = {
+            "import_ms": _summary([i[0] for i in imports]),
+            "import_rss_mb": _summary([i[1] for i in imports]),
+            "first_update_ms": _summary(first),
+        }
+        print(entry, json.dumps(results[entry], ensure_ascii=False))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
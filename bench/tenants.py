@@ -0,0 +1,130 @@
+"""多租户内存基准：同样 N 个机器人，host.py 单进程托管 vs 每个机器人一个 yunduan.py 进程
+
+每个机器人先处理 --updates 条更新（频道按钮帖、普通帖、私聊混合），然后读常驻内存（VmRSS）：
+  host       一个 host.py 进程的 RSS，以及相对 1 个租户时每多一个租户增加的内存
+  separate   N 个 yunduan.py 进程的 RSS 之和（只跑到 --separate-max 个，再多就按比例即可）
+
+用法（在仓库根目录）：
+    python bench/tenants.py --tenants 1,5,20,50 --out tenants.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from aiohttp import ClientSession
+
+from e2e import ROOT, Stream, read_rss
+from fake_bot_api import FakeBotAPI, free_port
+
+MIX = {"channel_button": 2, "channel_plain": 1, "private": 2}
+
+
+def token(i):
+    return f"{100000 + i}:TENANT"
+
+
+async def start(script, env, api, count):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, script, cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    await api.wait_calls("setWebhook", count, timeout=120)
+    return proc
+
+
+async def feed(session, port, bot_token, updates):
+    url = f"http://127.0.0.1:{port}/{bot_token}"
+    for update in updates:
+        async with session.post(url, json=update) as resp:
+            await resp.read()
+
+
+async def stop(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        await proc.wait()
+
+
+async def bench_host(n, updates, base_env):
+    api = FakeBotAPI()
+    api_port = await api.start()
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    config = [
+        {"name": f"t{i}", "token": token(i), "env": {"OUTBOX_PATH": os.path.join(tmp, f"outbox{i}.db")}}
+        for i in range(n)
+    ]
+    with open(os.path.join(tmp, "tenants.json"), "w") as f:
+        json.dump(config, f)
+    env = dict(base_env, BOT_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot", PORT=str(port),
+               HOST_CONFIG=os.path.join(tmp, "tenants.json"))
+    proc = await start("host.py", env, api, n)
+    try:
+        idle = read_rss(proc.pid)
+        async with ClientSession() as session:
+            await asyncio.gather(*(feed(session, port, token(i), updates) for i in range(n)))
+        await asyncio.sleep(0.5)
+        return {"rss_idle_mb": round(idle, 1), "rss_mb": round(read_rss(proc.pid), 1)}
+    finally:
+        await stop([proc])
+        await api.stop()
+
+
+async def bench_separate(n, updates, base_env):
+    api = FakeBotAPI()
+    api_port = await api.start()
+    tmp = tempfile.mkdtemp()
+    procs, ports = [], []
+    try:
+        for i in range(n):
+            ports.append(free_port())
+            env = dict(base_env, BOT_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot", PORT=str(ports[-1]),
+                       TELEGRAM_BOT_TOKEN=token(i), OUTBOX_PATH=os.path.join(tmp, f"outbox{i}.db"))
+            procs.append(await start("yunduan.py", env, api, i + 1))
+        idle = sum(read_rss(p.pid) for p in procs)
+        async with ClientSession() as session:
+            await asyncio.gather(*(feed(session, ports[i], token(i), updates) for i in range(n)))
+        await asyncio.sleep(0.5)
+        return {"rss_idle_mb": round(idle, 1), "rss_mb": round(sum(read_rss(p.pid) for p in procs), 1)}
+    finally:
+        await stop(procs)
+        await api.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", default="1,5,20,50")
+    parser.add_argument("--updates", type=int, default=200, help="每个机器人处理的更新数")
+    parser.add_argument("--separate-max", type=int, default=5)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    updates = [{k: v for k, v in u.items() if not k.startswith("_")} for u in Stream(args.updates, MIX, 1, 1).updates]
+    base_env = dict(os.environ, WEBHOOK_URL="http://127.0.0.1", LOG_LEVEL="WARNING")
+    counts = [int(n) for n in args.tenants.split(",")]
+    results = {"updates_per_bot": args.updates, "host": {}, "separate": {}}
+    for n in counts:
+        results["host"][n] = await bench_host(n, updates, base_env)
+        print("host", n, json.dumps(results["host"][n]), flush=True)
+        if n <= args.separate_max:
+            results["separate"][n] = await bench_separate(n, updates, base_env)
+            print("separate", n, json.dumps(results["separate"][n]), flush=True)
+
+    # 每多一个机器人增加的内存
+    base = results["host"][counts[0]]["rss_mb"]
+    results["host_mb_per_extra_tenant"] = {
+        n: round((r["rss_mb"] - base) / (n - counts[0]), 2) for n, r in results["host"].items() if n > counts[0]
+    }
+    results["separate_mb_per_bot"] = {n: round(r["rss_mb"] / n, 1) for n, r in results["separate"].items()}
+    print(json.dumps({k: results[k] for k in ("host_mb_per_extra_tenant", "separate_mb_per_bot")}))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+from telegram.error import TimedOut
+from telegram.ext import ApplicationBuilder, ExtBot
+from telegram.request import BaseRequest, HTTPXRequest
+
+import health
+import metrics
+from breaker import Breakers
+from priority import PriorityLimiter
+
+logger = logging.getLogger(__name__)
+
+# Bot API 地址，压测或本地调试时可以指向其他服务器
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+BOT_API_BASE_FILE_URL = os.environ.get("BOT_API_BASE_FILE_URL", "https://api.telegram.org/file/bot")
+
+# 上传文件的方法走 media 连接池，慢的视频上传不会占满其他调用的连接
+MEDIA_METHODS = {
+    "sendPhoto", "sendVideo", "sendAnimation", "sendAudio", "sendDocument",
+    "sendVoice", "sendVideoNote", "sendSticker", "sendMediaGroup",
+    "editMessageMedia", "setChatPhoto", "uploadStickerFile",
+}
+
+
+# 每个连接池（lane）的大小和超时，可用环境变量覆盖，例如 BOT_MEDIA_POOL_SIZE、BOT_MEDIA_READ_TIMEOUT
+# updates: getUpdates 长轮询；media: 发送图片视频、下载文件；control: 其余的小调用
+def _lane_config(lane, size, read, write, connect, pool):
+    prefix = f"BOT_{lane.upper()}_"
+    return dict(
+        connection_pool_size=int(os.environ.get(prefix + "POOL_SIZE", size)),
+        read_timeout=float(os.environ.get(prefix + "READ_TIMEOUT", read)),
+        write_timeout=float(os.environ.get(prefix + "WRITE_TIMEOUT", write)),
+        connect_timeout=float(os.environ.get(prefix + "CONNECT_TIMEOUT", connect)),
+        pool_timeout=float(os.environ.get(prefix + "POOL_TIMEOUT", pool)),
+    )
+
+
+LANES = {
+    "updates": _lane_config("updates", 1, 5, 5, 5, 1),
+    "media": _lane_config("media", 16, 30, 60, 10, 5),
+    "control": _lane_config("control", 256, 5, 5, 5, 1),
+}
+
+# 出站请求的并发上限和每秒放行数（0 为不限），超出时按优先级排队，见 priority.py
+OUTBOUND_CONCURRENCY = int(os.environ.get("OUTBOUND_CONCURRENCY", "32"))
+OUTBOUND_RATE = float(os.environ.get("OUTBOUND_RATE", "0"))
+
+# 熔断：同一方法连续失败 BREAKER_THRESHOLD 次后打开，BREAKER_RESET_SECONDS 秒后试探
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+_ssl_context = None
+# share_pools() 之后所有机器人共用的 (request, get_updates_request)
+_shared_pools = None
+
+
+def _shared_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+# 所有连接池共用一个 SSL 上下文
+# 每个 httpx 客户端默认都会重新加载一遍 CA 证书（每次约 30ms），启动时能省则省
+class SharedSSLRequest(HTTPXRequest):
+    def _build_client(self):
+        return httpx.AsyncClient(verify=_shared_ssl_context(), **self._client_kwargs)
+
+
+# 一个连接池，导出使用情况：
+#   bot_http_pool_size / bot_http_pool_in_flight   池大小与正在进行（含排队等连接）的请求数
+#   bot_http_requests_total / bot_http_pool_timeouts_total   请求数与等不到连接的次数
+class LaneRequest(SharedSSLRequest):
+    def __init__(self, lane, **kwargs):
+        super().__init__(**kwargs)
+        self.lane = lane
+        self._in_flight = 0
+        metrics.set_gauge("bot_http_pool_size", kwargs.get("connection_pool_size", 1), lane=lane)
+        metrics.set_gauge("bot_http_pool_in_flight", 0, lane=lane)
+
+    async def do_request(self, url, *args, **kwargs):
+        self._in_flight += 1
+        started = time.perf_counter()
+        metrics.inc("bot_http_requests_total", lane=self.lane)
+        metrics.set_gauge("bot_http_pool_in_flight", self._in_flight, lane=self.lane)
+        try:
+            return await super().do_request(url, *args, **kwargs)
+        except TimedOut as e:
+            if str(e).startswith("Pool timeout"):
+                metrics.inc("bot_http_pool_timeouts_total", lane=self.lane)
+            raise
+        finally:
+            self._in_flight -= 1
+            metrics.set_gauge("bot_http_pool_in_flight", self._in_flight, lane=self.lane)
+            # 单次 HTTP 请求耗时（不含优先级排队），文件下载统一记为 file
+            method = "file" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+            metrics.histogram("bot_api_request_seconds", time.perf_counter() - started, method=method)
+
+
+# Bot 只区分 getUpdates 和其他调用两个请求对象，这里在“其他调用”内部再按方法分到 media / control
+class LaneRouter(BaseRequest):
+    def __init__(self, media, control):
+        self.media = media
+        self.control = control
+
+    def _lane(self, url):
+        if "/file/bot" in url or url.rsplit("/", 1)[-1] in MEDIA_METHODS:
+            return self.media
+        return self.control
+
+    async def initialize(self):
+        await self.media.initialize()
+        await self.control.initialize()
+
+    async def shutdown(self):
+        await self.media.shutdown()
+        await self.control.shutdown()
+
+    async def do_request(self, url, method, *args, **kwargs):
+        return await self._lane(url).do_request(url, method, *args, **kwargs)
+
+
+# 多个 Bot 共用的请求对象：每个 Bot 初始化和关闭时都会调用 initialize / shutdown，
+# 这里计数，第一个初始化时打开连接池，最后一个关闭时才真正关闭
+class SharedRequest(BaseRequest):
+    def __init__(self, inner):
+        self.inner = inner
+        self._users = 0
+
+    async def initialize(self):
+        if self._users == 0:
+            await self.inner.initialize()
+        self._users += 1
+
+    async def shutdown(self):
+        self._users -= 1
+        if self._users == 0:
+            await self.inner.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        return await self.inner.do_request(*args, **kwargs)
+
+
+def _new_pools():
+    request = LaneRouter(
+        media=LaneRequest("media", **LANES["media"]),
+        control=LaneRequest("control", **LANES["control"]),
+    )
+    return request, LaneRequest("updates", **LANES["updates"])
+
+
+# 多租户 host 调用：之后 application_builder 创建的机器人共用同一组连接池（和 SSL 上下文），
+# 限流器和熔断器仍然每个机器人一份
+def share_pools():
+    global _shared_pools
+    if _shared_pools is None:
+        request, updates = _new_pools()
+        _shared_pools = SharedRequest(request), SharedRequest(updates)
+
+
+# 在 ExtBot 基础上记录每次成功的 getUpdates，供就绪检查使用；
+# 其余调用先过熔断器，接口故障时立即失败而不是排队等超时
+class BotClient(ExtBot):
+    def __init__(self, *args, breakers=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._breakers = breakers
+
+    async def initialize(self):
+        try:
+            await super().initialize()
+        except Exception:
+            # get_me 失败（令牌无效）时 PTB 已经初始化了连接池却不会释放，之后的 shutdown 也是空操作；
+            # 多租户共用连接池时要在这里还回引用计数
+            await asyncio.gather(self._request[0].shutdown(), self._request[1].shutdown(), return_exceptions=True)
+            raise
+
+    async def get_updates(self, *args, **kwargs):
+        updates = await super().get_updates(*args, **kwargs)
+        health.mark_poll()
+        return updates
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        # getUpdates 有 Updater 自己的退避重试
+        if self._breakers is None or endpoint == "getUpdates":
+            return await super()._do_post(endpoint, data, **kwargs)
+        try:
+            return await self._breakers.call(endpoint, super()._do_post, endpoint, data, **kwargs)
+        except Exception as e:
+            metrics.inc("bot_api_errors_total", method=endpoint, error=type(e).__name__)
+            raise
+
+
+# 返回已装好 BotClient 的 ApplicationBuilder，三个连接池的配置见 LANES
+def application_builder(token):
+    request, updates = _shared_pools or _new_pools()
+    bot = BotClient(
+        token=token,
+        base_url=BOT_API_BASE_URL,
+        base_file_url=BOT_API_BASE_FILE_URL,
+        request=request,
+        get_updates_request=updates,
+        rate_limiter=PriorityLimiter(concurrency=OUTBOUND_CONCURRENCY, rate=OUTBOUND_RATE),
+        breakers=Breakers(threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS),
+    )
+    return ApplicationBuilder().bot(bot)
+
+
+# 只有 Telegram 记录的 webhook 和当前不一致时才调用 set_webhook
+# 重启时少一次 setWebhook，也不会因为频繁部署触发它的限流
+async def ensure_webhook(bot, url, allowed_updates):
+    info = await bot.get_webhook_info()
+    if info.url == url and set(info.allowed_updates or ()) == set(allowed_updates):
+        logger.info("Webhook already up to date, skipping set_webhook")
+        return False
+    await bot.set_webhook(url=url, allowed_updates=allowed_updates)
+    return True
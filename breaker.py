@@ -0,0 +1,132 @@
+import logging
+import time
+
+import telegram
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bot API 熔断器，每个方法一个
+# closed     正常调用，连续失败 threshold 次后打开
+# open       直接抛出 CircuitOpen，不再等超时；reset_timeout 秒后进入 half_open
+# half_open  放行一个试探调用：成功则关闭，失败则重新打开
+# 只有网络错误、超时和 5xx 算失败；BadRequest、Forbidden、RetryAfter 说明接口是通的，和成功一样清零连续失败计数。
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# 继承 NetworkError，原有的异常处理不用改；retry_after 是熔断器预计重新试探的时间
+class CircuitOpen(telegram.error.NetworkError):
+    def __init__(self, method, retry_after):
+        super().__init__(f"Circuit open for {method}, retry in {retry_after:.1f}s")
+        self.method = method
+        self.retry_after = retry_after
+
+
+def is_failure(exc):
+    if isinstance(exc, (telegram.error.BadRequest, CircuitOpen)):
+        return False
+    if isinstance(exc, telegram.error.TimedOut) and str(exc).startswith("Pool timeout"):
+        # 本地连接池排满，与服务器状态无关
+        return False
+    return isinstance(exc, telegram.error.NetworkError)
+
+
+# 服务器给出了正常的错误响应（4xx、限流）；BadRequest 在 PTB 里也是 NetworkError 的子类
+def is_response(exc):
+    if isinstance(exc, telegram.error.BadRequest):
+        return True
+    return isinstance(exc, telegram.error.TelegramError) and not isinstance(exc, telegram.error.NetworkError)
+
+
+class CircuitBreaker:
+    def __init__(self, method, threshold=5, reset_timeout=30.0):
+        self.method = method
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        metrics.set_gauge("bot_api_circuit_state", 0, method=method)
+
+    def _transition(self, state):
+        self.state = state
+        metrics.set_gauge("bot_api_circuit_state", STATE_VALUES[state], method=self.method)
+        metrics.inc("bot_api_circuit_transitions_total", method=self.method, state=state)
+        if state == OPEN:
+            logger.warning(f"Circuit for {self.method} opened after {self.failures} failures")
+        else:
+            logger.info(f"Circuit for {self.method} is now {state}")
+
+    # 调用前检查，不能调用时抛出 CircuitOpen
+    def before_call(self):
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == OPEN:
+            remaining = self._opened_at + self.reset_timeout - now
+            if remaining > 0:
+                metrics.inc("bot_api_circuit_rejected_total", method=self.method)
+                raise CircuitOpen(self.method, remaining)
+            self._transition(HALF_OPEN)
+        if self._trial_in_flight:
+            metrics.inc("bot_api_circuit_rejected_total", method=self.method)
+            raise CircuitOpen(self.method, 1.0)
+        self._trial_in_flight = True
+
+    def on_success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            self._trial_in_flight = False
+            self._transition(CLOSED)
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+            self._open()
+        elif self.state == CLOSED and self.failures >= self.threshold:
+            self._open()
+
+    # 试探调用被取消，没有结果
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._transition(OPEN)
+
+
+class Breakers:
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+
+    def get(self, method):
+        breaker = self._breakers.get(method)
+        if breaker is None:
+            breaker = self._breakers[method] = CircuitBreaker(method, self.threshold, self.reset_timeout)
+        return breaker
+
+    async def call(self, method, callback, *args, **kwargs):
+        breaker = self.get(method)
+        breaker.before_call()
+        try:
+            result = await callback(*args, **kwargs)
+        except Exception as e:
+            if is_failure(e):
+                breaker.on_failure()
+            elif is_response(e) or breaker.state == HALF_OPEN:
+                # 收到了正常的错误响应，说明接口是通的：打断连续失败，试探调用则关闭熔断器
+                breaker.on_success()
+            raise
+        except BaseException:
+            breaker.release_trial()
+            raise
+        breaker.on_success()
+        return result
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+
+import telegram
+
+import metrics
+from breaker import CircuitOpen
+from ratelimit import ExpiringMap, SlidingWindowCounter
+
+logger = logging.getLogger(__name__)
+
+# deleteMessages 单次最多删除 100 条
+MAX_BATCH = 100
+
+
+# 群组系统提示（进群/退群）批量删除
+# 同一个群在 window 秒内产生的系统提示先缓存起来，到时间或攒满一批再一起删除。
+# 用 Bot API 的 deleteMessages（API 7.0）一次调用删除整批。固定的 PTB 20.6 还没有 bot.delete_messages，
+# 这时直接按方法名调用（bot._post，和其他调用一样经过限流器和熔断器）。
+# 服务器不认识这个方法（自建的旧版 Bot API 服务器返回 404）时退回逐条删除并控制节奏，避免触发限流。
+# delete_api_calls_saved_total 只算批量删除省下的调用：每批 len-1 次。
+class DeleteBuffer:
+    def __init__(self, bot, window=2.0, pace=0.05):
+        self.bot = bot
+        self.window = window
+        self.pace = pace
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+        self.bulk = True
+
+    # window 为空时使用默认窗口；raid 模式下传入更长的窗口
+    def add(self, chat_id, message_id, window=None):
+        ids = self._pending.setdefault(chat_id, [])
+        ids.append(message_id)
+        if len(ids) >= MAX_BATCH:
+            self._flush(chat_id)
+        elif chat_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(window or self.window, self._flush, chat_id)
+
+    # 熔断期间没删掉的消息放回缓存，delay 秒后再试
+    def _requeue(self, chat_id, ids, delay):
+        self._pending.setdefault(chat_id, []).extend(ids)
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._flush, chat_id)
+        logger.warning(f"Bot API unavailable, {len(ids)} service messages in chat {chat_id} requeued for {delay:.1f}s")
+
+    def pending_count(self):
+        return sum(len(ids) for ids in self._pending.values())
+
+    def _flush(self, chat_id):
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        ids = self._pending.pop(chat_id, None)
+        if not ids:
+            return
+        task = asyncio.ensure_future(self._delete(chat_id, ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # 立即删除所有缓存中的消息并等待完成
+    async def flush_all(self):
+        for chat_id in list(self._pending):
+            self._flush(chat_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _delete(self, chat_id, ids):
+        deleted = 0
+        if self.bulk:
+            deleted, ids = await self._delete_bulk(chat_id, ids)
+        if ids:
+            deleted += await self._delete_paced(chat_id, ids)
+        metrics.inc("service_messages_deleted_total", deleted)
+        logger.info(f"Deleted {deleted}/{len(ids)} service messages in chat {chat_id}")
+
+    async def _delete_messages(self, chat_id, message_ids):
+        if hasattr(self.bot, "delete_messages"):
+            return await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        return await self.bot._post("deleteMessages", {"chat_id": chat_id, "message_ids": message_ids})
+
+    # 返回 (删除数, 需要改为逐条删除的消息)
+    async def _delete_bulk(self, chat_id, ids):
+        deleted = 0
+        for i in range(0, len(ids), MAX_BATCH):
+            chunk = ids[i:i + MAX_BATCH]
+            try:
+                await self._delete_messages(chat_id, chunk)
+            except CircuitOpen as e:
+                self._requeue(chat_id, ids[i:], e.retry_after)
+                break
+            except telegram.error.InvalidToken as e:
+                # 404：服务器没有 deleteMessages，之后都逐条删除
+                self.bulk = False
+                logger.warning(f"deleteMessages is not supported by the Bot API server ({e}), deleting one by one")
+                return deleted, ids[i:]
+            except Exception as e:
+                logger.error(f"Failed to delete service messages in chat {chat_id}: {e}")
+                continue
+            deleted += len(chunk)
+            metrics.inc("delete_api_calls_saved_total", len(chunk) - 1)
+        return deleted, []
+
+    async def _delete_paced(self, chat_id, ids):
+        deleted = 0
+        for n, message_id in enumerate(ids):
+            if n:
+                await asyncio.sleep(self.pace)
+            try:
+                await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except CircuitOpen as e:
+                self._requeue(chat_id, ids[n:], e.retry_after)
+                break
+            except telegram.error.RetryAfter as e:
+                # 被限流时按服务器要求等待后重试一次
+                await asyncio.sleep(e.retry_after)
+                try:
+                    await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                except Exception as e:
+                    logger.error(f"Failed to delete service message {message_id}: {e}")
+                    continue
+            except Exception as e:
+                logger.error(f"Failed to delete service message {message_id}: {e}")
+                continue
+            deleted += 1
+        return deleted
+
+
+# 进群洪水（raid）检测
+# 每个群一个滑动窗口进群计数器，window 秒内进群人数（不是提示条数）达到 threshold 即进入 raid 模式：
+# 删除延后、攒成更大的批次，每次进群也不再按 INFO 记录。
+# 进群速率降到阈值一半以下并持续 calm 秒后自动恢复正常模式。
+class RaidMonitor:
+    def __init__(self, threshold=20, window=10.0, calm=60.0, max_chats=10000):
+        self.threshold = threshold
+        self.window = window
+        self.calm = calm
+        self._counters = ExpiringMap(2 * window, max_chats, name="raid_join_counters")
+        self._busy_at = {}
+
+    def in_raid(self, chat_id):
+        return chat_id in self._busy_at
+
+    # 记录一条进群提示（joined 为其中的新人数，批量拉人时一条提示有多人），返回该群当前是否处于 raid 模式
+    def record_join(self, chat_id, joined=1):
+        now = time.monotonic()
+        counter = self._counters.get(chat_id, now)
+        if counter is None:
+            counter = SlidingWindowCounter(self.window, now)
+        rate = counter.add(now, joined)
+        self._counters.set(chat_id, counter, now)
+
+        if chat_id in self._busy_at:
+            if rate >= self.threshold / 2:
+                self._busy_at[chat_id] = now
+        elif rate >= self.threshold:
+            self._enter(chat_id, now)
+        return chat_id in self._busy_at
+
+    def _enter(self, chat_id, now):
+        self._busy_at[chat_id] = now
+        metrics.inc("raid_mode_enter_total")
+        metrics.set_gauge("raid_mode_chats", len(self._busy_at))
+        logger.warning(f"Join burst detected in chat {chat_id}, switching to raid cleanup mode")
+        asyncio.get_running_loop().call_later(self.calm, self._check_calm, chat_id)
+
+    def _check_calm(self, chat_id):
+        busy_at = self._busy_at.get(chat_id)
+        if busy_at is None:
+            return
+        quiet = time.monotonic() - busy_at
+        if quiet < self.calm:
+            asyncio.get_running_loop().call_later(self.calm - quiet, self._check_calm, chat_id)
+            return
+        del self._busy_at[chat_id]
+        metrics.inc("raid_mode_exit_total")
+        metrics.set_gauge("raid_mode_chats", len(self._busy_at))
+        logger.info(f"Join traffic calmed down in chat {chat_id}, back to normal cleanup mode")
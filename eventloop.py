@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 事件循环实现
+# EVENT_LOOP=uvloop 时换成 uvloop（基于 libuv，需要另外 pip install uvloop），
+# 没装或平台不支持（Windows）时退回 asyncio 默认循环，只记一条警告，不影响启动。
+# 默认 asyncio。两种循环的差别见 bench/loop_policy.py。
+#
+# uvloop 下 profiler 的慢回调统计不可用（回调不经过 asyncio 的 Handle._run），采样照常。
+
+EVENT_LOOP = os.environ.get("EVENT_LOOP", "asyncio")
+
+
+# 在创建事件循环之前（asyncio.run / run_polling 之前）调用，返回实际使用的实现
+# 只换策略，asyncio.run 会按策略自己创建循环。轮询版传 current=True：run_polling 用 asyncio.get_event_loop()
+# 取当前循环（uvloop 的策略不会自动创建），这里按策略新建一个设为当前循环，结束时由 run_polling 关闭
+def install(name=EVENT_LOOP, current=False):
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("EVENT_LOOP=uvloop but uvloop is not installed, using the default asyncio loop")
+            name = "asyncio"
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif name != "asyncio":
+        logger.warning(f"Unknown EVENT_LOOP {name!r}, using the default asyncio loop")
+        name = "asyncio"
+    if current:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    metrics.set_gauge("event_loop_info", 1, loop=name)
+    return name
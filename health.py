@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 健康检查服务器
+# 和 run_polling 跑在同一个事件循环里（通过 post_init 启动），不再额外开线程。
+# 只需要回答几个简单的 GET，直接用 asyncio 的流实现，不引入 Flask / aiohttp。
+#   /        存活检查，只要进程还在就返回 200
+#   /ready   就绪检查，机器人在运行且最近一次 getUpdates 成功的时间不超过 READY_STALE_SECONDS
+#   /metrics 指标
+#   /admin/<报告名> 管理接口（/admin/trace、/admin/profile、/admin/memory），由 admin.add_health_routes 注册
+
+PORT = int(os.environ.get("PORT", "8080"))
+# run_polling 默认长轮询 10 秒，留足余量
+READY_STALE_SECONDS = float(os.environ.get("READY_STALE_SECONDS", "90"))
+REQUEST_TIMEOUT = 10
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 503: "Service Unavailable"}
+
+# 最近一次成功 getUpdates 的时间（time.monotonic）
+last_poll = None
+_application = None
+_server = None
+# 路径 -> async handler(query)，返回 (状态码, 正文, Content-Type)，正文为 str 或 bytes
+_routes = {}
+
+
+def mark_poll():
+    global last_poll
+    last_poll = time.monotonic()
+
+
+def add_route(path, handler):
+    _routes[path] = handler
+
+
+async def keep_alive(query):
+    return 200, "Bot is alive!", "text/plain"
+
+
+async def ready(query):
+    if _application is None or not _application.running:
+        return 503, "Not ready: application not running", "text/plain"
+    if last_poll is None:
+        return 503, "Not ready: no successful getUpdates yet", "text/plain"
+    age = time.monotonic() - last_poll
+    if age > READY_STALE_SECONDS:
+        return 503, f"Not ready: last getUpdates {age:.0f}s ago", "text/plain"
+    return 200, f"Ready: last getUpdates {age:.1f}s ago", "text/plain"
+
+
+async def metrics_endpoint(query):
+    return 200, metrics.render(), "text/plain; version=0.0.4"
+
+
+add_route("/", keep_alive)
+add_route("/ready", ready)
+add_route("/metrics", metrics_endpoint)
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        # 请求头用不到，读完丢弃
+        while True:
+            line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.decode("latin-1").split()
+        method = parts[0] if parts else ""
+        if len(parts) < 2 or method not in ("GET", "HEAD"):
+            status, body, content_type = 400, "Bad Request", "text/plain"
+        else:
+            url = urlsplit(parts[1])
+            handler = _routes.get(url.path)
+            if handler is None:
+                status, body, content_type = 404, "Not Found", "text/plain"
+            else:
+                status, body, content_type = await handler(dict(parse_qsl(url.query)))
+        # 正文是 bytes 时原样返回（管理接口下载的文件）
+        if isinstance(body, bytes):
+            payload = body
+        else:
+            payload = body.encode("utf-8")
+            content_type += "; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head if method == "HEAD" else head + payload)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logger.error(f"Health server error: {e}")
+    finally:
+        writer.close()
+
+
+# 作为 ApplicationBuilder.post_init 使用
+async def start(application):
+    global _application, _server
+    _application = application
+    _server = await asyncio.start_server(_handle, '0.0.0.0', PORT)
+    logger.info(f"Health server started on port {PORT}")
+
+
+# 作为 ApplicationBuilder.post_shutdown 使用
+async def stop(application):
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
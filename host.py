@@ -0,0 +1,203 @@
+import asyncio
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import signal
+
+from aiohttp import web
+
+import admin
+import botclient
+import eventloop
+import logsetup
+import metrics
+
+# 多租户 host：一个进程、一个事件循环、一个 aiohttp 服务器跑多个机器人
+# 每个租户把 yunduan.py（或配置里指定的 webhook 版脚本）作为独立的模块实例加载一次，
+# 模块里的 Application、发件箱、节流、限流器、熔断器都是租户自己的；
+# 解释器、已导入的库、出站连接池（botclient.share_pools）和 HTTP 服务器是共用的。
+# 租户的指标都带 tenant 标签，trace 带 tenant 属性，内存账目按租户分开登记。
+#
+# 配置文件（HOST_CONFIG，默认 tenants.json）：
+#     [
+#       {"name": "shop", "token": "123:abc"},
+#       {"name": "news", "token": "456:def", "script": "yunduan5.py", "env": {"PRIVATE_REPLY_LIMIT": "2"}}
+#     ]
+# env 里的变量只在加载该租户的模块时生效；OUTBOX_PATH 默认为 outbox-<name>.db。
+# WEBHOOK_URL、PORT 以及连接池、限流等设置对所有租户共用，照常从环境变量读取。
+#
+# 启动失败（令牌失效、setWebhook 出错……）的租户 webhook 返回 503，其他租户不受影响；
+# 后台每隔 TENANT_RETRY_SECONDS 秒（失败一次翻倍，最多 TENANT_RETRY_MAX_SECONDS）重试启动，成功后恢复接收。
+# /ready 在所有租户都已启动时返回 200，否则 503 并列出失败的租户和原因；tenant_up 指标按租户为 1 / 0。
+
+logsetup.setup()
+logger = logging.getLogger(__name__)
+
+HOST_CONFIG = os.environ.get("HOST_CONFIG", "tenants.json")
+PORT = int(os.environ.get("PORT", "10000"))
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+TENANT_RETRY_SECONDS = float(os.environ.get("TENANT_RETRY_SECONDS", "30"))
+TENANT_RETRY_MAX_SECONDS = float(os.environ.get("TENANT_RETRY_MAX_SECONDS", "600"))
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# 临时改写环境变量，模块在导入时读取配置
+@contextlib.contextmanager
+def environ(overrides):
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+class Tenant:
+    def __init__(self, name, token, script="yunduan.py", env=None):
+        if not re.fullmatch(r"[A-Za-z0-9_]+", name):
+            raise ValueError(f"tenant name must be alphanumeric: {name!r}")
+        self.name = name
+        self.token = token
+        self.script = script
+        self.env = {"OUTBOX_PATH": f"outbox-{name}.db", **(env or {}), "TELEGRAM_BOT_TOKEN": token}
+        self.module = None
+        # 最近一次启动失败的原因，已启动时为 None
+        self.error = "not started"
+        self._retry = None
+
+    def load(self):
+        spec = importlib.util.spec_from_file_location(f"tenant_{self.name}", os.path.join(ROOT, self.script))
+        module = importlib.util.module_from_spec(spec)
+        with environ(self.env), metrics.scope(tenant=self.name):
+            spec.loader.exec_module(module)
+            module.setup_handlers()
+        self.module = module
+
+    async def webhook(self, request):
+        with metrics.scope(tenant=self.name):
+            return await self.module.webhook(request)
+
+    # 启动失败时安排后台重试
+    async def start(self):
+        if not await self._try_start():
+            self._retry = asyncio.ensure_future(self._retry_start())
+
+    async def _try_start(self):
+        with metrics.scope(tenant=self.name):
+            try:
+                await self.module.start_bot()
+            except Exception as e:
+                # 令牌失效之类的问题只影响这个租户：它的 webhook 返回 503
+                self.module.draining = True
+                self.error = str(e) or type(e).__name__
+                metrics.set_gauge("tenant_up", 0)
+                logger.error(f"Tenant {self.name} failed to start: {e}")
+                # initialize() 成功后 setWebhook 失败时释放 Application，共享连接池的引用计数随之减一；
+                # stop_bot 只在启动成功后才 shutdown
+                try:
+                    await self.module.application.shutdown()
+                except Exception as e:
+                    logger.error(f"Tenant {self.name} failed to shut down: {e}")
+                return False
+            self.module.draining = False
+            self.error = None
+            metrics.set_gauge("tenant_up", 1)
+            return True
+
+    async def _retry_start(self):
+        delay = TENANT_RETRY_SECONDS
+        while True:
+            logger.info(f"Retrying tenant {self.name} in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            if await self._try_start():
+                logger.info(f"Tenant {self.name} started after retrying")
+                return
+            delay = min(delay * 2, TENANT_RETRY_MAX_SECONDS)
+
+    def cancel_retry(self):
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+
+    async def drain(self, deadline):
+        with metrics.scope(tenant=self.name):
+            await self.module.drain(deadline)
+
+    async def stop(self):
+        with metrics.scope(tenant=self.name):
+            await self.module.stop_bot()
+
+
+def load_config(path):
+    with open(path) as f:
+        return [Tenant(**entry) for entry in json.load(f)]
+
+
+async def keep_alive(request):
+    return web.Response(text=f"Host is alive ({len(request.app['tenants'])} bots)")
+
+
+# 所有租户都已启动才算就绪；失败的租户和原因逐行列出
+async def ready(request):
+    failed = [tenant for tenant in request.app["tenants"] if tenant.error is not None]
+    if failed:
+        lines = [f"{tenant.name}: {tenant.error}" for tenant in failed]
+        return web.Response(text=f"Not ready: {len(failed)} tenants not started\n" + "\n".join(lines), status=503)
+    return web.Response(text=f"Ready ({len(request.app['tenants'])} bots)")
+
+
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def main():
+    botclient.share_pools()
+    tenants = load_config(HOST_CONFIG)
+    for tenant in tenants:
+        tenant.load()
+    logger.info(f"Loaded {len(tenants)} tenants from {HOST_CONFIG}")
+
+    app = web.Application()
+    app["tenants"] = tenants
+    for tenant in tenants:
+        app.router.add_post(f"/{tenant.token}", tenant.webhook)
+    app.router.add_get('/', keep_alive)
+    app.router.add_get('/ready', ready)
+    app.router.add_get('/metrics', metrics_endpoint)
+    admin.add_routes(app)
+    runner = web.AppRunner(app, access_log=logsetup.access_logger())
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', PORT)
+    await site.start()
+    logger.info(f"aiohttp server started on port {PORT}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await asyncio.gather(*(tenant.start() for tenant in tenants))
+    await stop.wait()
+
+    # 与单机器人版相同的停机顺序，所有租户一起进行
+    for tenant in tenants:
+        tenant.cancel_retry()
+        tenant.module.draining = True
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    await site.stop()
+    await asyncio.gather(*(tenant.drain(deadline) for tenant in tenants))
+    await runner.cleanup()
+    await asyncio.gather(*(tenant.stop() for tenant in tenants))
+    logger.info("Host shutdown complete")
+
+
+if __name__ == "__main__":
+    eventloop.install()
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+import contextvars
+import json
+
+# Webhook 内联回复
+# Telegram 允许在 webhook 的 HTTP 响应体里直接携带一次 Bot API 调用，
+# 这样简单的回复就不用再单独向 Bot API 发起一次出站请求。
+# webhook() 在处理每个更新前打开一个槽位，处理器里第一个“发出即不管”的调用
+# 可以放进槽位，随 HTTP 响应一起返回；槽位已被占用或未打开时返回 False，
+# 调用方照常走出站请求。
+
+_slot = contextvars.ContextVar("inline_reply_slot", default=None)
+
+
+class InlineReplySlot:
+    __slots__ = ("body",)
+
+    def __init__(self):
+        self.body = None
+
+
+# 预序列化静态文本（例如 HOME_MESSAGE），避免每次回复都重新编码
+def pre_serialize(text):
+    return json.dumps(text, ensure_ascii=False).encode("utf-8")
+
+
+# 为当前请求打开槽位，返回 (槽位, 令牌)，令牌用于 close_slot
+def open_slot():
+    slot = InlineReplySlot()
+    return slot, _slot.set(slot)
+
+
+def close_slot(token):
+    _slot.reset(token)
+
+
+def _claim():
+    slot = _slot.get()
+    if slot is None or slot.body is not None:
+        return None
+    return slot
+
+
+# 用预序列化的文本回复 sendMessage
+def send_message(chat_id, text_json):
+    slot = _claim()
+    if slot is None:
+        return False
+    slot.body = b'{"method":"sendMessage","chat_id":%d,"text":%s}' % (chat_id, text_json)
+    return True
+
@@ -0,0 +1,256 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import socket
+import sqlite3
+import time
+
+import telegram
+
+import metrics
+import priority
+from breaker import CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+# 定时帖子的共享任务表
+# 多个 yunduan2.py 副本指向同一个 SQLite 文件（JOBS_PATH），谁都能看到、取消所有任务；
+# 到期的任务按租约认领：认领时写入自己的副本 ID 和 lease_until，只有持有租约的副本发送。
+# 副本挂掉后租约过期，其他副本会重新认领（reclaim）。
+#
+# 不重复发送靠两点：
+#   认领在 BEGIN IMMEDIATE 事务里完成，同一时刻只有一个副本能改写任务表
+#   发送前续一次租约，续不上（已被别人认领）就放弃；发完按 owner 条件标记完成
+# 只有“发送成功但标记完成前进程被杀”这一种情况会在重新认领后重复一次，和发件箱一样宁可重复不丢。
+#
+# 等其他副本的写锁最多要 JOB_LOCK_TIMEOUT 秒，所以所有读写都放在一个专用线程里（连接只在这个线程上用），
+# 事件循环只 await 结果；对外的 add / pending / cancel / claim 都是协程。
+# pending_count 给 /metrics 用，返回工作循环每轮刷新的缓存值，不碰数据库。
+#
+# 副本在同一台机器上时用默认的 WAL；放在网络盘上时 WAL 不可用，设 JOBS_JOURNAL_MODE=DELETE。
+# JOBS_PATH=:memory: 时退化为单进程内存表（只有一个副本时的替身）。
+#
+# 任务只记向导里那条预览消息的位置（from_chat_id、message_id），到点时 copy_message 到目标频道，
+# 文案、媒体和按钮都由 Telegram 从预览复制，不用再组装。预览被用户删掉后任务会失败。
+#
+# 状态：pending 待发送 / claimed 已被某个副本认领 / done 已发送 / failed 发送失败 / cancelled 已取消
+
+JOBS_PATH = os.environ.get("JOBS_PATH", "jobs.db")
+JOBS_JOURNAL_MODE = os.environ.get("JOBS_JOURNAL_MODE", "WAL")
+# 租约时长，要远大于一次发送的耗时
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# 多久检查一次到期任务
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+# 等其他副本写事务的秒数（在数据库线程里等，不占事件循环）
+JOB_LOCK_TIMEOUT = float(os.environ.get("JOB_LOCK_TIMEOUT", "10"))
+JOB_BATCH = 20
+MAX_ATTEMPTS = 5
+BASE_DELAY = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    from_chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    send_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, send_at);
+"""
+
+
+def replica_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{random.randrange(16 ** 4):04x}"
+
+
+class JobStore:
+    def __init__(self, path=JOBS_PATH, owner=None):
+        self.path = path
+        self.owner = owner or replica_id()
+        # 连接在 __init__ 里建好，之后只在 _executor 的那一个线程上使用
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=JOB_LOCK_TIMEOUT, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute(f"PRAGMA journal_mode={JOBS_JOURNAL_MODE}")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._pending = self._count()
+        self._worker = None
+
+    # 在数据库线程上执行 func(*args)
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # task 与向导里的字典相同：chat_id（目标频道）、from_chat_id 和 message_id（预览消息）、time
+    async def add(self, task, send_at):
+        job_id = await self._call(self._add, task, send_at)
+        self._pending += 1
+        return job_id
+
+    # 所有副本的未完成任务，按发送时间排列（“查看当前任务”和按编号取消都用这个顺序）
+    async def pending(self):
+        return await self._call(self._select_pending)
+
+    # 已被认领（正在发送）的任务不能取消
+    async def cancel(self, job_id):
+        cancelled = await self._call(self._cancel, job_id)
+        if cancelled:
+            self._pending -= 1
+        return cancelled
+
+    # 认领最多 limit 个到期任务：未认领的，以及租约已过期的（原副本挂了）
+    async def claim(self, limit=JOB_BATCH):
+        rows = await self._call(self._claim, limit)
+        reclaimed = [row for row in rows if row["owner"] is not None and row["owner"] != self.owner]
+        if reclaimed:
+            metrics.inc("scheduled_jobs_reclaimed_total", len(reclaimed))
+            logger.warning(f"Reclaimed {len(reclaimed)} scheduled jobs from expired leases of {sorted({r['owner'] for r in reclaimed})}")
+        return [row["id"] for row in rows]
+
+    # 所有副本的未完成任务数（缓存值，工作循环每轮刷新）
+    def pending_count(self):
+        return self._pending
+
+    # 以下在数据库线程上执行
+
+    def _add(self, task, send_at):
+        cursor = self._db.execute(
+            "INSERT INTO jobs (chat_id, from_chat_id, message_id, time, send_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (task["chat_id"], task["from_chat_id"], task["message_id"], task["time"], send_at, time.time()),
+        )
+        return cursor.lastrowid
+
+    def _select_pending(self):
+        return self._db.execute(
+            "SELECT * FROM jobs WHERE status IN ('pending', 'claimed') ORDER BY send_at, id"
+        ).fetchall()
+
+    def _count(self):
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'claimed')").fetchone()[0]
+
+    def _cancel(self, job_id):
+        cursor = self._db.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'pending'", (job_id,))
+        return cursor.rowcount == 1
+
+    def _get(self, job_id):
+        return self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _claim(self, limit):
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._db.execute(
+                "SELECT id, owner FROM jobs WHERE send_at <= ? "
+                "AND (status = 'pending' OR (status = 'claimed' AND lease_until < ?)) ORDER BY send_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            for row in rows:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'claimed', owner = ?, lease_until = ? WHERE id = ?",
+                    (self.owner, now + JOB_LEASE_SECONDS, row["id"]),
+                )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return rows
+
+    # 续租；返回 False 表示租约已经不是自己的了
+    def _renew(self, job_id):
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'claimed' AND lease_until >= ?",
+            (now + JOB_LEASE_SECONDS, job_id, self.owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def _finish(self, job_id, status, error=None):
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = ?, last_error = ?, attempts = attempts + 1 WHERE id = ? AND owner = ?",
+            (status, error, job_id, self.owner),
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, job_id, delay, error):
+        self._db.execute(
+            "UPDATE jobs SET status = 'pending', owner = NULL, lease_until = NULL, send_at = ?, "
+            "attempts = attempts + 1, last_error = ? WHERE id = ? AND owner = ?",
+            (time.time() + delay, error, job_id, self.owner),
+        )
+
+    async def _retry_later(self, job, delay, error):
+        if job["attempts"] + 1 >= MAX_ATTEMPTS:
+            await self._fail(job, error)
+            return
+        await self._call(self._release, job["id"], delay, error)
+        logger.warning(f"Scheduled job {job['id']} send failed, retrying in {delay:.1f}s: {error}")
+
+    async def _fail(self, job, error):
+        await self._call(self._finish, job["id"], "failed", error)
+        metrics.inc("scheduled_jobs_failed_total")
+        logger.error(f"定时任务失败：{error}，chat_id: {job['chat_id']}")
+
+    async def _send(self, bot, job):
+        await bot.copy_message(chat_id=job["chat_id"], from_chat_id=job["from_chat_id"], message_id=job["message_id"])
+
+    async def run_job(self, bot, job_id):
+        if not await self._call(self._renew, job_id):
+            metrics.inc("scheduled_jobs_lease_lost_total")
+            logger.warning(f"Lost the lease on scheduled job {job_id}, skipping")
+            return
+        job = await self._call(self._get, job_id)
+        try:
+            # 定时任务排在向导回复和频道重发之后
+            with priority.use(priority.BULK):
+                await self._send(bot, job)
+        except telegram.error.RetryAfter as e:
+            await self._retry_later(job, e.retry_after, str(e))
+        except CircuitOpen as e:
+            await self._retry_later(job, e.retry_after, str(e))
+        except telegram.error.BadRequest as e:
+            await self._fail(job, e.message)
+        except Exception as e:
+            await self._retry_later(job, BASE_DELAY * 2 ** job["attempts"], str(e))
+        else:
+            if not await self._call(self._finish, job_id, "done"):
+                logger.warning(f"Scheduled job {job_id} was sent after its lease expired")
+            metrics.inc("scheduled_jobs_sent_total")
+
+    async def _run(self, bot, interval):
+        logger.info(f"Scheduled job worker {self.owner} started ({self.path})")
+        while True:
+            try:
+                job_ids = await self.claim()
+                for job_id in job_ids:
+                    await self.run_job(bot, job_id)
+                # 其他副本加的、取消的、发完的都算进来
+                self._pending = await self._call(self._count)
+            except Exception as e:
+                logger.error(f"Scheduled job worker error: {e}")
+                job_ids = ()
+            # 一批没处理完说明还有到期的，直接进入下一轮
+            if len(job_ids) < JOB_BATCH:
+                await asyncio.sleep(interval)
+
+    def start(self, bot, interval=JOB_POLL_INTERVAL):
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run(bot, interval))
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
@@ -0,0 +1,101 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# 日志管道
+# 事件循环线程只把日志记录放进队列，格式化（包括 msg % args 和时间戳）和写 stderr 都在后台线程里做；
+# 大的载荷（整条更新的 JSON）按比例抽样并限速，不会每条更新都打一遍。
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# LOG_QUEUE=0 时退回同步输出（对照基准用）
+LOG_QUEUE = os.environ.get("LOG_QUEUE", "1") == "1"
+# 更新载荷的抽样比例和每秒上限（0 为不限）
+LOG_PAYLOAD_SAMPLE = float(os.environ.get("LOG_PAYLOAD_SAMPLE", "0.01"))
+LOG_PAYLOAD_PER_SECOND = float(os.environ.get("LOG_PAYLOAD_PER_SECOND", "5"))
+# aiohttp 访问日志
+LOG_ACCESS = os.environ.get("LOG_ACCESS", "0") == "1"
+
+_listener = None
+
+
+# 标准 QueueHandler 会在调用线程里先把消息格式化好再入队，这里原样入队，交给后台线程格式化
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+def setup(level=None):
+    global _listener
+    level = level or LOG_LEVEL
+    # httpx 每个 Bot API 请求都打一行 INFO，请求耗时和错误已经在 /metrics 里了
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if not LOG_QUEUE:
+        logging.basicConfig(format=FORMAT, level=level)
+        return
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter(FORMAT))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    # 退出前把队列里剩下的日志写完
+    atexit.register(stop)
+
+
+# 传给 web.AppRunner 的 access_log 参数，None 表示不记录
+def access_logger():
+    return logging.getLogger("aiohttp.access") if LOG_ACCESS else None
+
+
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# 延迟求值：只有记录真正输出时才在后台线程里调用 func
+#     logger.info("link: %s", Lazy(make_link, message))
+class Lazy:
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+# 抽样加令牌桶限速：先按 sample 比例抽中，再受每秒 per_second 条的上限约束
+class Sampler:
+    def __init__(self, sample=LOG_PAYLOAD_SAMPLE, per_second=LOG_PAYLOAD_PER_SECOND):
+        self.sample = sample
+        self.per_second = per_second
+        self._tokens = per_second
+        self._updated = time.monotonic()
+        self.dropped = 0
+
+    def allow(self):
+        if self.sample < 1 and random.random() >= self.sample:
+            return False
+        if not self.per_second:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.per_second, self._tokens + (now - self._updated) * self.per_second)
+        self._updated = now
+        if self._tokens < 1:
+            self.dropped += 1
+            return False
+        self._tokens -= 1
+        return True
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import sqlite3
+import time
+
+import telegram
+from telegram import InputFile
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 本地媒体文件的上传缓存：内容哈希 -> file_id
+# 定时帖子可以用服务器上 MEDIA_DIR 里的图片、视频（向导里第一行写 file:文件名，仅限管理员）。
+# 第一次发送时上传文件并记下 Telegram 返回的 file_id，之后同样内容的文件（改名、复制也算）直接发 file_id，
+# 不再上传。file_id 只对上传它的机器人有效，所以按机器人分开记录。
+#
+# 文件不会整个读进内存：哈希按块读取，上传时把文件对象交给 httpx 按块发送
+# （PTB 自己的 InputFile 会先把整个文件 read() 出来）。
+# 没有用 mmap：映射的页算在 RSS 里，大视频会让 memory.py 的内存预算告警误报。
+#
+# 任务表里本地文件记为 "file:相对路径"，发送时才解析，MEDIA_DIR 之外的路径一律拒绝。
+
+# 允许使用的本地媒体目录，不设置时不能使用本地文件
+MEDIA_DIR = os.environ.get("MEDIA_DIR", "")
+MEDIA_CACHE_PATH = os.environ.get("MEDIA_CACHE_PATH", "media.db")
+LOCAL_PREFIX = "file:"
+CHUNK_SIZE = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    bot_id INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (bot_id, digest, kind)
+);
+"""
+
+
+def is_local(value):
+    return isinstance(value, str) and value.startswith(LOCAL_PREFIX)
+
+
+# "file:相对路径" -> MEDIA_DIR 下的绝对路径；没有配置 MEDIA_DIR、路径跑出目录或文件不存在时抛 ValueError
+def resolve(value):
+    if not MEDIA_DIR:
+        raise ValueError("MEDIA_DIR is not configured")
+    root = os.path.realpath(MEDIA_DIR)
+    path = os.path.realpath(os.path.join(root, value[len(LOCAL_PREFIX):].strip()))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"no such media file: {value}")
+    return path
+
+
+# 按扩展名判断是图片还是视频，都不是时返回 None
+def kind_of(path):
+    mimetype = mimetypes.guess_type(path, strict=False)[0] or ""
+    if mimetype.startswith("image/"):
+        return "photo"
+    if mimetype.startswith("video/"):
+        return "video"
+    return None
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        while n := f.readinto(buffer):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+# 不把内容读进内存的 InputFile：field_tuple 返回文件对象本身，由 httpx 按块读取上传
+class StreamedInputFile(InputFile):
+    __slots__ = ("_file",)
+
+    def __init__(self, file, filename):
+        self._file = file
+        self.input_file_content = None
+        self.attach_name = None
+        self.filename = filename
+        self.mimetype = mimetypes.guess_type(filename, strict=False)[0] or "application/octet-stream"
+
+    @property
+    def field_tuple(self):
+        # 请求重试时从头再读
+        self._file.seek(0)
+        return self.filename, self._file, self.mimetype
+
+
+# Telegram 拒绝 file_id 时的错误信息（小写比较）
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "file reference", "wrong remote file")
+
+
+def is_stale_file_id(error):
+    message = error.message.lower()
+    return any(text in message for text in STALE_FILE_ID_ERRORS)
+
+
+def _file_id(message, kind):
+    if kind == "photo":
+        return message.photo[-1].file_id
+    return message.video.file_id
+
+
+class MediaCache:
+    def __init__(self, path=MEDIA_CACHE_PATH):
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=10)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        # 同一个文件同时发送多次时只上传一次
+        self._uploading = {}
+        # (路径, 大小, 修改时间) -> 哈希，文件没变时不用再读一遍
+        self._digests = {}
+
+    async def digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = await asyncio.to_thread(file_hash, path)
+        return self._digests[key]
+
+    def lookup(self, bot_id, digest, kind):
+        row = self._db.execute(
+            "SELECT file_id FROM media WHERE bot_id = ? AND digest = ? AND kind = ?", (bot_id, digest, kind)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(self, bot_id, digest, kind, file_id, size):
+        self._db.execute(
+            "INSERT OR REPLACE INTO media (bot_id, digest, kind, file_id, size, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (bot_id, digest, kind, file_id, size, time.time()),
+        )
+
+    def forget(self, bot_id, digest, kind):
+        self._db.execute("DELETE FROM media WHERE bot_id = ? AND digest = ? AND kind = ?", (bot_id, digest, kind))
+
+    async def _call(self, bot, kind, media, **kwargs):
+        if kind == "photo":
+            return await bot.send_photo(photo=media, **kwargs)
+        return await bot.send_video(video=media, **kwargs)
+
+    async def _upload(self, bot, kind, path, digest, **kwargs):
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            message = await self._call(bot, kind, StreamedInputFile(f, os.path.basename(path)), **kwargs)
+        self.record(bot.id, digest, kind, _file_id(message, kind), size)
+        metrics.inc("media_uploads_total", kind=kind)
+        metrics.inc("media_upload_bytes_total", size, kind=kind)
+        logger.info(f"Uploaded {os.path.basename(path)} ({size} bytes), cached as {digest[:12]}")
+        return message
+
+    # 发送图片（kind="photo"）或视频（kind="video"）：value 是 file_id 时直接发送，
+    # 是 "file:..." 时走上传缓存；kwargs 原样传给 send_photo / send_video（chat_id、caption、reply_markup……）
+    async def send(self, bot, kind, value, **kwargs):
+        if not is_local(value):
+            return await self._call(bot, kind, value, **kwargs)
+        path = resolve(value)
+        digest = await self.digest(path)
+        key = (bot.id, digest, kind)
+        while key in self._uploading:
+            await asyncio.shield(self._uploading[key])
+        file_id = self.lookup(*key)
+        if file_id is not None:
+            try:
+                message = await self._call(bot, kind, file_id, **kwargs)
+                metrics.inc("media_cache_hits_total", kind=kind)
+                return message
+            except telegram.error.BadRequest as e:
+                # 只有 file_id 失效（例如换了机器人令牌）时重新上传；其他错误（文案太长、频道不存在……）重传也没用
+                if not is_stale_file_id(e):
+                    raise
+                logger.warning(f"Cached file_id for {digest[:12]} rejected ({e.message}), uploading again")
+                self.forget(*key)
+        upload = self._uploading[key] = asyncio.get_running_loop().create_future()
+        try:
+            return await self._upload(bot, kind, path, digest, **kwargs)
+        finally:
+            del self._uploading[key]
+            upload.set_result(None)
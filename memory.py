@@ -0,0 +1,243 @@
+import asyncio
+import collections.abc
+import logging
+import os
+import sys
+import tracemalloc
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 内存账目
+# 宿主按固定的 RSS 上限直接杀进程，事先没有任何提示。这里做三件事：
+#   1. 登记机器人自己的数据结构（定时任务、向导草稿、PTB 的 user_data/chat_data、会话状态、
+#      缓存、队列……），/metrics 导出条目数，管理接口按需算出近似字节数
+#   2. tracemalloc 快照对比：先打基线，过一段时间再对比，看是哪几行代码在涨
+#   3. 后台每 MEMORY_CHECK_INTERVAL 秒检查 RSS，超过上限的 MEMORY_WARN_RATIO / MEMORY_CRITICAL_RATIO
+#      时记 WARNING / ERROR 日志（附最大的几个结构），并计入 memory_budget_warnings_total
+#
+# 字节数只沿着 dict / list / set / deque 之类的容器往下算，遇到其他对象只算对象本身，
+# 不会顺着引用把 Application、Bot 整个算进去，是偏小的近似值。
+
+# 宿主的 RSS 上限，0 表示不检查
+MEMORY_LIMIT_MB = float(os.environ.get("MEMORY_LIMIT_MB", "0"))
+MEMORY_WARN_RATIO = float(os.environ.get("MEMORY_WARN_RATIO", "0.8"))
+MEMORY_CRITICAL_RATIO = float(os.environ.get("MEMORY_CRITICAL_RATIO", "0.95"))
+MEMORY_CHECK_INTERVAL = float(os.environ.get("MEMORY_CHECK_INTERVAL", "30"))
+# 回落到阈值以下这么多才算恢复，避免在阈值附近反复告警
+HYSTERESIS = 0.05
+# tracemalloc 每次分配记录的栈深度，越深越准也越慢
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", "1"))
+# 计算单个结构的字节数时最多遍历的对象数
+MAX_WALK = 200000
+TOP = 15
+
+CONTAINERS = (list, tuple, set, frozenset, collections.deque)
+LEVELS = ("ok", "warning", "critical")
+
+# 名称 -> 返回该结构的函数
+_structures = {}
+_baseline = None
+_started_tracing = False
+_watcher = None
+
+
+def _count(obj):
+    if hasattr(obj, "qsize"):
+        return obj.qsize()
+    return len(obj)
+
+
+# 登记一个结构，getter 返回容器（或带 qsize() 的队列），每次查询时才调用
+# 多租户时名称前加上租户名
+def register(name, getter):
+    tenant = metrics.scope_labels().get("tenant")
+    _structures[f"{tenant}/{name}" if tenant else name] = getter
+    metrics.register_gauge("memory_structure_items", lambda: _count(getter()), structure=name)
+
+
+# 登记 PTB Application 里随用户增长的部分
+def register_application(application):
+    register("ptb_user_data", lambda: application.user_data)
+    register("ptb_chat_data", lambda: application.chat_data)
+    register("ptb_update_queue", lambda: application.update_queue)
+    for group in application.handlers.values():
+        for handler in group:
+            conversations = getattr(handler, "_conversations", None)
+            if conversations is not None:
+                name = getattr(handler, "name", None) or "conversation"
+                register(f"ptb_{name}_states", lambda handler=handler: handler._conversations)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # 非 Linux：只能拿到峰值
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+metrics.register_gauge("process_resident_memory_bytes", rss_bytes)
+
+
+def deep_size(obj):
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack and len(seen) < MAX_WALK:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, collections.abc.Mapping):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, CONTAINERS):
+            stack.extend(item)
+        elif isinstance(item, asyncio.Queue):
+            stack.extend(item._queue)
+    return size
+
+
+def _mb(size):
+    return f"{size / 1048576:.1f}MB"
+
+
+def structure_sizes(with_bytes=True):
+    sizes = []
+    for name, getter in _structures.items():
+        try:
+            obj = getter()
+            sizes.append((name, _count(obj), deep_size(obj) if with_bytes else 0))
+        except Exception as e:
+            logger.debug(f"Cannot size {name}: {e}")
+    return sizes
+
+
+def sizes_report():
+    rss = rss_bytes()
+    limit = f" / limit {MEMORY_LIMIT_MB:.0f}MB ({rss / (MEMORY_LIMIT_MB * 1048576):.0%})" if MEMORY_LIMIT_MB else ""
+    lines = [f"rss {_mb(rss)}{limit}"]
+    try:
+        loop = asyncio.get_running_loop()
+        lines.append(f"asyncio: {len(asyncio.all_tasks())} tasks, {len(getattr(loop, '_scheduled', ()))} timers")
+    except RuntimeError:
+        pass
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: {_mb(current)} traced, peak {_mb(peak)}")
+    lines.append("")
+    lines.append(f"{'structure':<28} {'items':>8} {'bytes':>10}")
+    for name, items, size in sorted(structure_sizes(), key=lambda s: s[2], reverse=True):
+        lines.append(f"{name:<28} {items:>8} {size:>10}")
+    return "\n".join(lines)
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+# 打基线；tracemalloc 没开时先打开（之后的分配才会被记录）
+def take_baseline():
+    global _baseline, _started_tracing
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        _started_tracing = True
+    _baseline = _snapshot()
+    current, _ = tracemalloc.get_traced_memory()
+    return f"baseline taken, {_mb(current)} traced"
+
+
+def diff(limit=TOP):
+    if _baseline is None:
+        return "no baseline, run snapshot first"
+    stats = _snapshot().compare_to(_baseline, "lineno")
+    total = sum(stat.size_diff for stat in stats)
+    lines = [f"{total / 1024:+.1f}KB since baseline, top {limit}:"]
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"  {stat.size_diff / 1024:+9.1f}KB {stat.count_diff:+7d} blocks  "
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return "\n".join(lines)
+
+
+# 没有基线时打基线、等 seconds 秒再对比，用完关掉 tracemalloc
+async def diff_over(seconds, limit=TOP):
+    if _baseline is not None:
+        return diff(limit)
+    take_baseline()
+    try:
+        await asyncio.sleep(seconds)
+        return diff(limit)
+    finally:
+        stop_tracing()
+
+
+def stop_tracing():
+    global _baseline, _started_tracing
+    _baseline = None
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+    return "tracemalloc stopped"
+
+
+def _level(ratio, current):
+    thresholds = (0, MEMORY_WARN_RATIO, MEMORY_CRITICAL_RATIO)
+    level = 2 if ratio >= thresholds[2] else 1 if ratio >= thresholds[1] else 0
+    if level < current and ratio >= thresholds[current] - HYSTERESIS:
+        return current
+    return level
+
+
+async def _watch(interval):
+    level = 0
+    while True:
+        try:
+            rss = rss_bytes()
+            new_level = _level(rss / (MEMORY_LIMIT_MB * 1048576), level)
+            if new_level > level:
+                metrics.inc("memory_budget_warnings_total", level=LEVELS[new_level])
+                largest = sorted(structure_sizes(with_bytes=False), key=lambda s: s[1], reverse=True)[:5]
+                logger.log(
+                    logging.ERROR if new_level == 2 else logging.WARNING,
+                    "RSS %s is %.0f%% of the %.0fMB limit; largest structures: %s",
+                    _mb(rss), rss / (MEMORY_LIMIT_MB * 1048576) * 100, MEMORY_LIMIT_MB,
+                    ", ".join(f"{name}={items}" for name, items, _ in largest),
+                )
+            elif new_level < level:
+                logger.info(f"RSS back to {_mb(rss)}, below the {LEVELS[level]} threshold")
+            level = new_level
+            metrics.set_gauge("memory_budget_level", level)
+        except Exception as e:
+            logger.error(f"Memory watcher error: {e}")
+        await asyncio.sleep(interval)
+
+
+# 在事件循环里调用；没有设置 MEMORY_LIMIT_MB 时不启动
+def start(interval=MEMORY_CHECK_INTERVAL):
+    global _watcher
+    if MEMORY_LIMIT_MB and _watcher is None:
+        _watcher = asyncio.ensure_future(_watch(interval))
+
+
+async def stop():
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
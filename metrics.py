@@ -0,0 +1,176 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import time
+
+# 进程内指标
+# 指标只在事件循环线程里更新，计数就是普通的字典累加，不加锁；
+# 导出时先复制一份字典，即使从其他线程读取也是安全的。
+
+_counters = {}
+_gauges = {}
+# 摘要：保留最近 SUMMARY_SAMPLES 个样本算分位数，另记总数和总和
+_summaries = {}
+SUMMARY_SAMPLES = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+# 直方图：固定分桶，每次记录只是一次二分查找加一次计数
+_histograms = {}
+# 导出时才计算的指标（队列长度之类），热路径上没有任何开销
+_gauge_callbacks = {}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 附加在当前上下文所有指标上的标签（多租户时的 tenant），见 scope()
+_scope = contextvars.ContextVar("metric_labels", default=None)
+
+
+# 在 with 块内（包括其中创建的任务和 call_later 回调）记录的指标都带上这些标签：
+#     with metrics.scope(tenant="shop"):
+#         await handle(...)
+@contextlib.contextmanager
+def scope(**labels):
+    token = _scope.set({**(_scope.get() or {}), **labels})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def scope_labels():
+    return _scope.get() or {}
+
+
+def _key(name, labels):
+    extra = _scope.get()
+    if extra:
+        labels = {**extra, **labels} if labels else extra
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    summary = _summaries.get(key)
+    if summary is None:
+        summary = _summaries[key] = [collections.deque(maxlen=SUMMARY_SAMPLES), 0, 0.0]
+    summary[0].append(value)
+    summary[1] += 1
+    summary[2] += value
+
+
+def histogram(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+    hist[1][bisect.bisect_left(buckets, value)] += 1
+    hist[2] += value
+
+
+def quantiles(name, **labels):
+    summary = _summaries.get(_key(name, labels))
+    if not summary:
+        return {}
+    samples = sorted(summary[0])
+    return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+
+def register_gauge(name, callback, **labels):
+    _gauge_callbacks[_key(name, labels)] = callback
+
+
+def get(name, **labels):
+    key = _key(name, labels)
+    return _counters.get(key, _gauges.get(key, 0))
+
+
+def _format(name, labels, value):
+    if labels:
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+
+# Prometheus 文本格式
+def render():
+    lines = []
+    gauges = _gauges.copy()
+    for key, callback in _gauge_callbacks.copy().items():
+        try:
+            gauges[key] = callback()
+        except Exception:
+            pass
+    for kind, values in (("counter", _counters.copy()), ("gauge", gauges)):
+        seen = set()
+        for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(_format(name, labels, value))
+    seen = set()
+    for (name, labels), (samples, count, total) in sorted(_summaries.copy().items(), key=lambda item: item[0]):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} summary")
+        samples = sorted(samples)
+        for q in QUANTILES:
+            value = samples[min(int(q * len(samples)), len(samples) - 1)]
+            lines.append(_format(name, labels + (("quantile", q),), round(value, 6)))
+        lines.append(_format(f"{name}_count", labels, count))
+        lines.append(_format(f"{name}_sum", labels, round(total, 6)))
+    seen = set()
+    for (name, labels), (buckets, counts, total) in sorted(_histograms.copy().items(), key=lambda item: item[0]):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(buckets + ("+Inf",), list(counts)):
+            cumulative += count
+            lines.append(_format(f"{name}_bucket", labels + (("le", bound),), cumulative))
+        lines.append(_format(f"{name}_count", labels, cumulative))
+        lines.append(_format(f"{name}_sum", labels, round(total, 6)))
+    return "\n".join(lines) + "\n"
+
+
+def _timed(name, callback):
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            inc("handler_errors_total", handler=name)
+            raise
+        finally:
+            histogram("handler_duration_seconds", time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+def _handlers(handlers):
+    for handler in handlers:
+        yield handler
+        # ConversationHandler 的子处理器
+        for attr in ("entry_points", "fallbacks"):
+            yield from _handlers(getattr(handler, attr, ()))
+        for state_handlers in getattr(handler, "states", {}).values():
+            yield from _handlers(state_handlers)
+
+
+# 给所有已注册处理器的回调套上计时，按回调函数名导出 handler_duration_seconds；
+# 在 add_handler 全部完成后调用一次
+def instrument_handlers(application):
+    for group in application.handlers.values():
+        for handler in _handlers(group):
+            callback = getattr(handler, "callback", None)
+            if callback is not None and not getattr(callback, "_timed", False):
+                handler.callback = _timed(callback.__name__, callback)
+                handler.callback._timed = True
@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+
+import telegram
+from telegram import InlineKeyboardMarkup
+
+import metrics
+import priority
+import tracing
+from breaker import CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+# 频道帖子重发的持久化发件箱
+# handle_channel_post 先把要重发的内容写进发件箱，再删除原消息，然后发送；
+# 发送失败（超时、限流、按钮链接不合法……）时按指数退避加随机抖动重试，
+# 成功后标记完成，进程崩溃重启后也会接着重试，删掉的帖子不会丢。
+#
+# 每次重发要提交三次（记录、标记已删除、标记完成），提交要等磁盘，所以读写都放在一个专用线程里
+# （连接只在这个线程上用），事件循环只 await 结果，和 jobs.py 一样。
+#
+# 状态：pending 待发送 / done 已完成 / failed 超过最大重试次数 / discarded 原消息未删除，无需重发
+
+BASE_DELAY = 2.0
+MAX_DELAY = 600.0
+MAX_ATTEMPTS = 10
+# 刚写入的条目由处理器自己发送，这段时间内后台重试不去碰它
+IN_FLIGHT_GRACE = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER,
+    kind TEXT NOT NULL,
+    content TEXT,
+    file_id TEXT,
+    reply_markup TEXT,
+    drop_markup INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+def backoff(attempts):
+    delay = min(BASE_DELAY * 2 ** attempts, MAX_DELAY)
+    return delay * random.uniform(0.5, 1.5)
+
+
+class Outbox:
+    def __init__(self, path="outbox.db"):
+        self.path = path
+        # 连接在 __init__ 里建好，之后只在 _executor 的那一个线程上使用
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-db")
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # WAL + NORMAL：进程崩溃不丢数据，写入也足够快
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._worker = None
+
+    # 在数据库线程上执行 func(*args)
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # 在删除原消息之前调用，返回条目 ID；message_id 是要删除的原消息
+    async def add(self, chat_id, kind, content, file_id=None, reply_markup=None, message_id=None):
+        markup = reply_markup.to_json() if reply_markup else None
+        return await self._call(self._insert, chat_id, message_id, kind, content, file_id, markup)
+
+    async def mark_deleted(self, entry_id):
+        await self._call(self._execute, "UPDATE outbox SET deleted = 1 WHERE id = ?", (entry_id,))
+
+    # 原消息没删掉（删除失败），不需要重发
+    async def discard(self, entry_id):
+        await self._call(self._execute, "UPDATE outbox SET status = 'discarded' WHERE id = ?", (entry_id,))
+
+    async def backlog(self):
+        return await self._call(self._backlog)
+
+    # 以下在数据库线程上执行
+
+    def _execute(self, sql, params=()):
+        self._db.execute(sql, params)
+
+    def _insert(self, chat_id, message_id, kind, content, file_id, reply_markup):
+        cursor = self._db.execute(
+            "INSERT INTO outbox (chat_id, message_id, kind, content, file_id, reply_markup, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, message_id, kind, content, file_id, reply_markup, time.time() + IN_FLIGHT_GRACE, time.time()),
+        )
+        return cursor.lastrowid
+
+    def _backlog(self):
+        return self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending' AND deleted = 1").fetchone()[0]
+
+    def _get(self, entry_id):
+        return self._db.execute("SELECT * FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+
+    def _due(self, limit, include_failed=False, before=None):
+        statuses = ("pending", "failed") if include_failed else ("pending",)
+        return self._db.execute(
+            f"SELECT id FROM outbox WHERE status IN ({','.join('?' * len(statuses))}) AND deleted = 1 "
+            "AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (*statuses, time.time() if before is None else before, limit),
+        ).fetchall()
+
+    # 清理一天前已完成或无需重发的条目，failed 的留给回放工具
+    def _prune(self):
+        self._db.execute(
+            "DELETE FROM outbox WHERE status IN ('done', 'discarded') AND created_at < ?",
+            (time.time() - 86400,),
+        )
+
+    # 新进程启动时：上一个进程留下的条目不会再有人发送，立即到期；返回删除期间被打断的条目
+    def _take_over(self):
+        self._db.execute(
+            "UPDATE outbox SET next_attempt_at = ? WHERE status = 'pending' AND deleted = 1", (time.time(),)
+        )
+        return [row["id"] for row in self._db.execute("SELECT id FROM outbox WHERE status = 'pending' AND deleted = 0")]
+
+    async def _send(self, bot, row):
+        reply_markup = None
+        if row["reply_markup"] and not row["drop_markup"]:
+            reply_markup = InlineKeyboardMarkup.de_json(json.loads(row["reply_markup"]), bot)
+        if row["kind"] == "photo":
+            return await bot.send_photo(
+                chat_id=row["chat_id"], photo=row["file_id"], caption=row["content"], reply_markup=reply_markup
+            )
+        if row["kind"] == "video":
+            return await bot.send_video(
+                chat_id=row["chat_id"], video=row["file_id"], caption=row["content"], reply_markup=reply_markup
+            )
+        return await bot.send_message(chat_id=row["chat_id"], text=row["content"], reply_markup=reply_markup)
+
+    # count=False 时不计入重试次数（熔断期间没有真正发出请求）
+    async def _retry_later(self, row, delay, error, count=True):
+        attempts = row["attempts"] + (1 if count else 0)
+        status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+        tracing.annotate(outcome="failed" if status == "failed" else "retry_scheduled", error=error[:80])
+        await self._call(
+            self._execute,
+            "UPDATE outbox SET attempts = ?, status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, status, time.time() + delay, error, row["id"]),
+        )
+        if status == "failed":
+            metrics.inc("outbox_failed_total")
+            logger.error(f"Outbox entry {row['id']} failed after {attempts} attempts: {error}")
+        else:
+            metrics.inc("outbox_retries_total")
+            logger.warning(f"Outbox entry {row['id']} send failed, retrying in {delay:.1f}s: {error}")
+
+    # 记录 -> 删除原消息 -> 发送；返回新消息，发送失败时返回 None 并交给后台重试
+    async def repost(self, bot, chat_id, message_id, kind, content, file_id=None, reply_markup=None):
+        with tracing.span("record"):
+            entry_id = await self.add(chat_id, kind, content, file_id, reply_markup, message_id)
+        tracing.annotate(entry=entry_id)
+        try:
+            with tracing.span("delete"), priority.use(priority.REPOST):
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except Exception:
+            await self.discard(entry_id)
+            tracing.annotate(outcome="not_deleted")
+            raise
+        await self.mark_deleted(entry_id)
+        return await self.deliver(bot, entry_id)
+
+    # 发送一个条目，成功返回新消息，失败安排重试并返回 None
+    async def deliver(self, bot, entry_id):
+        row = await self._call(self._get, entry_id)
+        if row is None or row["status"] == "done":
+            return None
+        try:
+            with tracing.span("send"), priority.use(priority.REPOST):
+                message = await self._send(bot, row)
+        except telegram.error.RetryAfter as e:
+            await self._retry_later(row, e.retry_after, str(e))
+            return None
+        except CircuitOpen as e:
+            # 熔断期间留在发件箱里，等熔断器试探时再发
+            await self._retry_later(row, e.retry_after, str(e), count=False)
+            return None
+        except telegram.error.BadRequest as e:
+            if row["reply_markup"] and not row["drop_markup"]:
+                # 多半是按钮不合法，去掉按钮也要把内容发出去
+                await self._call(self._execute, "UPDATE outbox SET drop_markup = 1 WHERE id = ?", (entry_id,))
+                await self._retry_later(row, 0, str(e))
+            else:
+                await self._retry_later(row, backoff(row["attempts"]), str(e))
+            return None
+        except Exception as e:
+            await self._retry_later(row, backoff(row["attempts"]), str(e))
+            return None
+        await self._call(self._execute, "UPDATE outbox SET status = 'done', attempts = attempts + 1 WHERE id = ?", (entry_id,))
+        metrics.inc("outbox_sent_total")
+        tracing.annotate(outcome="sent", new_message_id=message.message_id)
+        return message
+
+    # 上一个进程在删除原消息期间退出，不知道删没删掉：再删一次（失败也无妨）然后重发
+    # 宁可偶尔重复一条，也不丢帖子
+    async def _recover(self, bot, entry_ids):
+        for entry_id in entry_ids:
+            row = await self._call(self._get, entry_id)
+            if row["message_id"] is not None:
+                try:
+                    await bot.delete_message(chat_id=row["chat_id"], message_id=row["message_id"])
+                except Exception:
+                    pass
+            await self._call(
+                self._execute, "UPDATE outbox SET deleted = 1, next_attempt_at = ? WHERE id = ?", (time.time(), entry_id)
+            )
+        if entry_ids:
+            logger.warning(f"Recovered {len(entry_ids)} outbox entries interrupted during delete")
+
+    # 后台重试：每 interval 秒处理一次到期条目，速率不超过 rate 条/秒
+    async def _run(self, bot, rate, interval, taken_over):
+        await self._recover(bot, await taken_over)
+        limit = max(int(rate * interval), 1)
+        while True:
+            rows = []
+            try:
+                rows = await self._call(self._due, limit)
+                for row in rows:
+                    started = time.monotonic()
+                    with tracing.trace("outbox_retry", entry=row["id"]):
+                        await self.deliver(bot, row["id"])
+                    await asyncio.sleep(max(1 / rate - (time.monotonic() - started), 0))
+                metrics.set_gauge("outbox_backlog", await self.backlog())
+                await self._call(self._prune)
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+            # 这一轮没处理完说明还有积压，直接进入下一轮
+            if len(rows) < limit:
+                await asyncio.sleep(interval)
+
+    def start(self, bot, rate=5.0, interval=5.0):
+        if self._worker is None:
+            # 现在就提交：数据库线程按提交顺序执行，之后 add 的新条目不会被当成上一个进程留下的
+            taken_over = asyncio.wrap_future(self._executor.submit(self._take_over))
+            self._worker = asyncio.ensure_future(self._run(bot, rate, interval, taken_over))
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    # 故障恢复后按固定速率清空积压（包括已标记 failed 的条目）
+    async def replay(self, bot, rate=5.0, include_failed=True):
+        sent = 0
+        for row in await self._call(self._due, -1, include_failed, float("inf")):
+            await self._call(
+                self._execute,
+                "UPDATE outbox SET status = 'pending', attempts = 0 WHERE id = ? AND status = 'failed'",
+                (row["id"],),
+            )
+            if await self.deliver(bot, row["id"]) is not None:
+                sent += 1
+            await asyncio.sleep(1 / rate)
+        return sent
+
+
+async def _replay_main(args):
+    import botclient
+
+    bot = telegram.Bot(os.environ["TELEGRAM_BOT_TOKEN"], base_url=botclient.BOT_API_BASE_URL)
+    box = Outbox(args.path)
+    logger.info(f"Replaying outbox {args.path}: {await box.backlog()} pending")
+    async with bot:
+        sent = await box.replay(bot, rate=args.rate, include_failed=not args.pending_only)
+    logger.info(f"Replayed {sent} entries, {await box.backlog()} still pending")
+
+
+# 回放工具：python outbox.py --rate 5
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="按固定速率重发发件箱中积压的帖子")
+    parser.add_argument("--path", default=os.environ.get("OUTBOX_PATH", "outbox.db"))
+    parser.add_argument("--rate", type=float, default=5.0, help="每秒发送的条目数")
+    parser.add_argument("--pending-only", action="store_true", help="跳过已标记 failed 的条目")
+    asyncio.run(_replay_main(parser.parse_args()))
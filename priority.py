@@ -0,0 +1,151 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import logging
+import time
+
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 出站请求的优先级调度
+# 所有 Bot API 调用（getUpdates 除外）都要先拿到一个并发名额，名额不够时按优先级排队：
+#   interactive  私聊回复、按钮回调（用户在等）
+#   repost       频道帖子的删除和重发
+#   bulk         定时任务、批量发送、清理服务消息
+# 低优先级的请求排队超过 MAX_WAIT 秒后插到前面，大批量任务再多也不会完全饿死。
+INTERACTIVE = "interactive"
+REPOST = "repost"
+BULK = "bulk"
+CLASSES = (INTERACTIVE, REPOST, BULK)
+MAX_WAIT = {INTERACTIVE: None, REPOST: 2.0, BULK: 10.0}
+
+CLEANUP_METHODS = {"deleteMessage", "deleteMessages"}
+INTERACTIVE_METHODS = {"answerCallbackQuery", "answerInlineQuery", "sendChatAction"}
+
+_current = contextvars.ContextVar("priority_class", default=None)
+
+
+# 在 with 块内发出的请求都归入指定的优先级，例如定时任务：
+#     with priority.use(priority.BULK):
+#         await bot.send_message(...)
+@contextlib.contextmanager
+def use(priority_class):
+    token = _current.set(priority_class)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+# 没有显式指定时按方法和目标推断：私聊是 interactive，删除消息是 bulk，其余（频道、群组）是 repost
+def classify(endpoint, data):
+    explicit = _current.get()
+    if explicit is not None:
+        return explicit
+    if endpoint in INTERACTIVE_METHODS:
+        return INTERACTIVE
+    if endpoint in CLEANUP_METHODS:
+        return BULK
+    chat_id = data.get("chat_id") if data else None
+    if isinstance(chat_id, int) and chat_id > 0:
+        return INTERACTIVE
+    return REPOST
+
+
+class PriorityLimiter(BaseRateLimiter):
+    def __init__(self, concurrency=32, rate=0.0):
+        self.concurrency = concurrency
+        # 每秒最多放行的请求数，0 表示不限
+        self.rate = rate
+        self._in_flight = 0
+        self._next_grant_at = 0.0
+        self._waiters = {cls: collections.deque() for cls in CLASSES}
+        self._wakeup = None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+    def queue_depth(self, priority_class):
+        return len(self._waiters[priority_class])
+
+    # 选出下一个放行的队列：先看有没有等待超时的低优先级请求，否则按优先级
+    def _pick(self, now):
+        overdue = None
+        for cls in CLASSES:
+            queue = self._waiters[cls]
+            if queue and MAX_WAIT[cls] is not None and now - queue[0][0] > MAX_WAIT[cls]:
+                if overdue is None or queue[0][0] < self._waiters[overdue][0][0]:
+                    overdue = cls
+        if overdue is not None:
+            return overdue
+        for cls in CLASSES:
+            if self._waiters[cls]:
+                return cls
+        return None
+
+    def _dispatch(self):
+        self._wakeup = None
+        while self._in_flight < self.concurrency:
+            now = time.monotonic()
+            cls = self._pick(now)
+            if cls is None:
+                return
+            if self.rate and now < self._next_grant_at:
+                self._wakeup = asyncio.get_running_loop().call_later(self._next_grant_at - now, self._dispatch)
+                return
+            _, waiter = self._waiters[cls].popleft()
+            metrics.set_gauge("outbound_queue_depth", len(self._waiters[cls]), priority=cls)
+            if waiter.done():
+                continue
+            self._grant(now)
+            waiter.set_result(None)
+
+    def _grant(self, now):
+        self._in_flight += 1
+        if self.rate:
+            self._next_grant_at = max(now, self._next_grant_at) + 1 / self.rate
+
+    def _release(self):
+        self._in_flight -= 1
+        if self._wakeup is None:
+            self._dispatch()
+
+    async def _acquire(self, cls):
+        now = time.monotonic()
+        idle = not any(self._waiters.values())
+        if idle and self._in_flight < self.concurrency and (not self.rate or now >= self._next_grant_at):
+            self._grant(now)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[cls].append((now, waiter))
+        metrics.set_gauge("outbound_queue_depth", len(self._waiters[cls]), priority=cls)
+        if self._wakeup is None:
+            self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 已经拿到名额才被取消，要还回去
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        cls = rate_limit_args if rate_limit_args in CLASSES else classify(endpoint, data)
+        started = time.monotonic()
+        await self._acquire(cls)
+        granted = time.monotonic()
+        metrics.observe("outbound_queue_seconds", granted - started, priority=cls)
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            self._release()
+            metrics.observe("outbound_latency_seconds", time.monotonic() - started, priority=cls)
@@ -0,0 +1,194 @@
+import asyncio
+import collections
+import cProfile
+import inspect
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 按需性能剖析
+# 不重新部署就能看线上的事件循环在忙什么。由管理员命令 /profile 或 HTTP /admin/profile 触发，
+# 限时运行，结束后一切复原；不剖析时没有任何钩子、线程或计时，开销为零。
+#
+# 两种模式：
+#   sample    后台线程每 PROFILE_INTERVAL 秒抓一次事件循环线程的调用栈，输出 collapsed stack
+#             （每行 "f1;f2;f3 次数"，可直接交给 flamegraph.pl / speedscope）
+#   cprofile  在事件循环线程上开 cProfile，输出 pstats 文件（python -m pstats 打开），开销较大
+# 两种模式都会临时替换 asyncio 的 Handle._run，记录执行时间超过阈值的回调（阻塞事件循环的元凶）。
+# uvloop（EVENT_LOOP=uvloop）的回调在 C 里调度，不经过 Handle._run，这时只有采样 / cProfile，没有慢回调统计。
+
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SLOW_CALLBACK = float(os.environ.get("PROFILE_SLOW_CALLBACK", "0.05"))
+# 事件循环空闲时停在 selector 里，这些栈单独计数，不算进热点
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "kqueue", "control"}
+TOP = 15
+
+_running = False
+
+
+class Busy(Exception):
+    pass
+
+
+class Result:
+    def __init__(self, mode, seconds, threshold):
+        self.mode = mode
+        self.seconds = seconds
+        self.threshold = threshold
+        self.samples = 0
+        self.idle = 0
+        # collapsed stack -> 次数
+        self.stacks = collections.Counter()
+        # (耗时, 回调描述)
+        self.slow = []
+        self.callbacks = 0
+        # 当前事件循环能否统计慢回调（uvloop 不能）
+        self.timed_callbacks = True
+        self.stats = None
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def pstats_dump(self):
+        # 与 Stats.dump_stats 写出的文件格式相同
+        return marshal.dumps(self.stats.stats) if self.stats is not None else b""
+
+    def summary(self):
+        lines = [f"{self.mode} profile, {self.seconds:.1f}s, {self.callbacks} callbacks"]
+        if not self.timed_callbacks:
+            lines[0] = f"{self.mode} profile, {self.seconds:.1f}s"
+            lines.append("\nslow callbacks not available on this event loop")
+        elif self.slow:
+            lines.append(f"\nslow callbacks (>= {self.threshold * 1000:.0f}ms):")
+            for elapsed, description in sorted(self.slow, reverse=True)[:TOP]:
+                lines.append(f"  {elapsed * 1000:8.1f}ms  {description}")
+        else:
+            lines.append(f"\nno callbacks >= {self.threshold * 1000:.0f}ms")
+        if self.mode == "sample":
+            busy = self.samples - self.idle
+            lines.append(f"\n{self.samples} samples, {busy} busy ({busy / max(self.samples, 1):.0%})")
+            leaves = collections.Counter()
+            for stack, count in self.stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            for frame, count in leaves.most_common(TOP):
+                lines.append(f"  {count:6d}  {frame}")
+        elif self.stats is not None:
+            out = io.StringIO()
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(TOP)
+            lines.append(out.getvalue())
+        return "\n".join(lines)
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# uvloop 空闲时等待在 C 里，线程最内层的 Python 帧就是调用 run_until_complete / run_forever 的那一帧：
+# 从当前协程往外找，最外层协程帧的上一帧
+def _loop_entry_frame():
+    entry = None
+    frame = sys._getframe()
+    while frame is not None:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE:
+            entry = frame.f_back
+        frame = frame.f_back
+    return entry
+
+
+def _sample_loop(result, thread_id, stop, entry):
+    while not stop.wait(PROFILE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            continue
+        result.samples += 1
+        if frame is entry or (
+            frame.f_code.co_name in IDLE_FUNCTIONS and frame.f_code.co_filename.endswith("selectors.py")
+        ):
+            result.idle += 1
+            continue
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        result.stacks[";".join(reversed(names))] += 1
+
+
+def _describe(handle):
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f"Task {task.get_name()} {getattr(coro, '__qualname__', coro)}"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+# 临时替换 Handle._run，结束时还原
+def _patch_handles(result, threshold):
+    original = asyncio.events.Handle._run
+
+    def timed_run(handle):
+        started = time.perf_counter()
+        try:
+            return original(handle)
+        finally:
+            elapsed = time.perf_counter() - started
+            result.callbacks += 1
+            if elapsed >= threshold:
+                result.slow.append((elapsed, _describe(handle)))
+
+    asyncio.events.Handle._run = timed_run
+    return original
+
+
+# 在事件循环里调用，剖析接下来的 seconds 秒；slow_ms 是慢回调阈值（毫秒）
+# 同一时间只能有一个剖析，已有剖析在运行时抛出 Busy
+async def run(seconds=10.0, mode="sample", slow_ms=None):
+    global _running
+    if mode not in ("sample", "cprofile"):
+        raise ValueError(f"unknown mode: {mode}")
+    if _running:
+        raise Busy("a profile is already running")
+    seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+    threshold = PROFILE_SLOW_CALLBACK if slow_ms is None else float(slow_ms) / 1000
+    _running = True
+    try:
+        result = Result(mode, seconds, threshold)
+        logger.warning(f"Profiling the event loop for {seconds:.1f}s ({mode})")
+        # 只有 asyncio 自己的事件循环会经过 Handle._run
+        native = isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop)
+        result.timed_callbacks = native
+        original = _patch_handles(result, threshold) if native else None
+        stop = threading.Event()
+        sampler = profile = None
+        try:
+            if mode == "sample":
+                sampler = threading.Thread(
+                    target=_sample_loop, args=(result, threading.get_ident(), stop, None if native else _loop_entry_frame()),
+                    name="profiler", daemon=True,
+                )
+                sampler.start()
+            else:
+                profile = cProfile.Profile()
+                profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            if profile is not None:
+                profile.disable()
+                result.stats = pstats.Stats(profile)
+            stop.set()
+            if sampler is not None:
+                sampler.join()
+            if original is not None:
+                asyncio.events.Handle._run = original
+        return result
+    finally:
+        _running = False
@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+
+import memory
+import metrics
+
+
+# 带过期时间的紧凑映射
+# 每次写入都把键移到末尾，TTL 固定，所以最前面的永远是最早过期的，
+# 清理只需要从头部弹出，均摊 O(1)；max_size 限制内存上限。
+# 指定 name 时按 cache_requests_total{cache=name,result=hit|miss} 统计命中率，并登记到内存账目。
+class ExpiringMap:
+    def __init__(self, ttl, max_size=10000, name=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.name = name
+        self._data = OrderedDict()
+        if name:
+            metrics.register_gauge("cache_entries", self.__len__, cache=name)
+            memory.register(name, lambda: self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, now):
+        item = self._data.get(key)
+        if item is None or item[0] <= now:
+            if self.name:
+                metrics.inc("cache_requests_total", cache=self.name, result="miss")
+            return None
+        if self.name:
+            metrics.inc("cache_requests_total", cache=self.name, result="hit")
+        return item[1]
+
+    def set(self, key, value, now):
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        self._evict(now)
+
+    def _evict(self, now):
+        data = self._data
+        while data:
+            key, (expires_at, _) = next(iter(data.items()))
+            if expires_at > now and len(data) <= self.max_size:
+                break
+            del data[key]
+
+
+# 两段式滑动窗口计数器
+# 只保存当前窗口和上一窗口的计数，按上一窗口剩余的时间比例估算滑动窗口内的总数，
+# 每次更新都是 O(1)，适合大量按群统计的场景。
+class SlidingWindowCounter:
+    __slots__ = ("window", "start", "current", "previous")
+
+    def __init__(self, window, now):
+        self.window = window
+        self.start = now
+        self.current = 0
+        self.previous = 0
+
+    def add(self, now, n=1):
+        self._roll(now)
+        self.current += n
+        return self._estimate(now)
+
+    def count(self, now):
+        self._roll(now)
+        return self._estimate(now)
+
+    def _roll(self, now):
+        elapsed = now - self.start
+        if elapsed < self.window:
+            return
+        self.previous = self.current if elapsed < 2 * self.window else 0
+        self.current = 0
+        self.start = now - elapsed % self.window
+
+    def _estimate(self, now):
+        weight = 1 - (now - self.start) / self.window
+        return self.previous * weight + self.current
+
+
+# 私聊回复节流
+# 每个用户在 window 秒的滑动窗口内最多收到 limit 条回复，
+# 一波连发的消息只回复一次，其余的直接丢弃。
+class ReplyThrottle:
+    def __init__(self, window=10.0, limit=1, max_users=10000):
+        self.window = window
+        self.limit = limit
+        self._recent = ExpiringMap(window, max_users, name="reply_throttle")
+
+    def allow(self, user_id):
+        now = time.monotonic()
+        times = self._recent.get(user_id, now)
+        if times:
+            cutoff = now - self.window
+            times = [t for t in times if t > cutoff]
+        else:
+            times = []
+        if len(times) >= self.limit:
+            return False
+        times.append(now)
+        self._recent.set(user_id, times, now)
+        return True
@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# 轮询模式下按会话分片并发处理更新
+# PTB 的 Updater 每次 getUpdates 取最多 100 条放进队列后立刻发起下一次长轮询，
+# 但默认逐条处理：一条帖子的删除、重发没做完，后面所有会话的更新都在排队。
+# 停机一段时间后积压几千条更新时，恢复速度完全取决于每条的网络往返。
+#
+# 这里把更新按会话（effective_chat，没有时按用户）分片：
+#   同一会话的更新严格按到达顺序一条接一条处理（向导的 ConversationHandler、帖子顺序都依赖这一点）
+#   不同会话之间最多 UPDATE_CONCURRENCY 条同时处理
+# 轮到自己之前等待的更新不占并发名额，一个刷屏的频道不会把其他会话挤在后面。
+#
+# UPDATE_CONCURRENCY=1（默认）时不启用，保持 PTB 的逐条处理。
+# 只影响轮询版；webhook 版在 webhook() 里自己调用 process_update。
+
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "1"))
+# 已取出、等待处理的更新上限；正常情况下远远达不到
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", "100000"))
+
+
+def shard_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatShardedProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency, max_pending=UPDATE_MAX_PENDING):
+        # 基类的信号量在轮到该会话之前就要拿，只用来给排队中的更新数封顶；
+        # 真正的并发上限是 _slots，轮到之后才拿
+        super().__init__(max_pending)
+        self._slots = asyncio.Semaphore(concurrency)
+        # 会话 -> 该会话最后一条更新处理完时 set 的 Event
+        self._tails = {}
+        self._running = 0
+        metrics.register_gauge("updates_processing", lambda: self._running)
+        metrics.register_gauge("update_shards_active", lambda: len(self._tails))
+
+    async def do_process_update(self, update, coroutine):
+        key = shard_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.Event()
+        if key is not None:
+            self._tails[key] = done
+        started = False
+        try:
+            if previous is not None:
+                await previous.wait()
+            async with self._slots:
+                started = True
+                self._running += 1
+                try:
+                    await coroutine
+                finally:
+                    self._running -= 1
+        finally:
+            if not started:
+                # 停机时取消了还在排队的更新
+                coroutine.close()
+            done.set()
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# 给 ApplicationBuilder 装上分片处理器；UPDATE_CONCURRENCY 不大于 1 时原样返回
+def configure(builder, concurrency=UPDATE_CONCURRENCY):
+    if concurrency > 1:
+        builder.concurrent_updates(ChatShardedProcessor(concurrency))
+    return builder
@@ -0,0 +1,40 @@
+import contextlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+from botclient import BotClient  # noqa: E402
+from breaker import Breakers  # noqa: E402
+from priority import PriorityLimiter  # noqa: E402
+
+# 测试都连本地的 FakeBotAPI，经过真实的 BotClient（限流器、熔断器、HTTP 请求）
+TOKEN = "123456:TEST"
+
+
+def make_bot(api, concurrency=32, threshold=5, reset_timeout=30.0):
+    return BotClient(
+        token=TOKEN,
+        base_url=api.base_url,
+        rate_limiter=PriorityLimiter(concurrency=concurrency),
+        breakers=Breakers(threshold=threshold, reset_timeout=reset_timeout),
+    )
+
+
+# 启动 FakeBotAPI 和一个已初始化的 bot，api_kwargs 传给 FakeBotAPI（latency、faults……）
+@contextlib.asynccontextmanager
+async def fake_bot(concurrency=32, threshold=5, reset_timeout=30.0, **api_kwargs):
+    api = FakeBotAPI(**api_kwargs)
+    await api.start()
+    bot = make_bot(api, concurrency, threshold, reset_timeout)
+    try:
+        await bot.initialize()
+        api.reset()
+        yield api, bot
+    finally:
+        await bot.shutdown()
+        await api.stop()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import telegram
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitOpen
+from conftest import fake_bot
+
+CHANNEL_ID = -1001000000001
+
+
+async def send(bot, text="hi"):
+    return await bot.send_message(chat_id=CHANNEL_ID, text=text)
+
+
+def test_opens_after_threshold_and_rejects_without_calling():
+    async def main():
+        async with fake_bot(threshold=2, reset_timeout=30) as (api, bot):
+            breaker = bot._breakers.get("sendMessage")
+            api.inject("sendMessage", "5xx", 2)
+            with pytest.raises(telegram.error.NetworkError):
+                await send(bot)
+            assert breaker.state == CLOSED
+            with pytest.raises(telegram.error.NetworkError):
+                await send(bot)
+            assert breaker.state == OPEN
+            with pytest.raises(CircuitOpen):
+                await send(bot)
+            assert len(api.calls_to("sendMessage")) == 2
+            # 每个方法一个熔断器
+            await bot.copy_message(chat_id=CHANNEL_ID, from_chat_id=1, message_id=1)
+
+    asyncio.run(main())
+
+
+def test_bad_request_does_not_count_as_failure():
+    async def main():
+        async with fake_bot(threshold=2) as (api, bot):
+            breaker = bot._breakers.get("deleteMessage")
+            await bot.delete_message(chat_id=CHANNEL_ID, message_id=1)
+            api.inject("deleteMessage", "5xx")
+            with pytest.raises(telegram.error.NetworkError):
+                await bot.delete_message(chat_id=CHANNEL_ID, message_id=2)
+            assert breaker.failures == 1
+            # 重复删除返回 400：接口是通的，清零连续失败计数
+            with pytest.raises(telegram.error.BadRequest):
+                await bot.delete_message(chat_id=CHANNEL_ID, message_id=1)
+            assert breaker.failures == 0
+            assert breaker.state == CLOSED
+
+    asyncio.run(main())
+
+
+def test_half_open_trial_reopens_then_closes():
+    async def main():
+        async with fake_bot(threshold=1, reset_timeout=0.1) as (api, bot):
+            breaker = bot._breakers.get("sendMessage")
+            api.inject("sendMessage", "5xx", 2)
+            with pytest.raises(telegram.error.NetworkError):
+                await send(bot)
+            assert breaker.state == OPEN
+
+            # 试探失败：重新打开，再等一个 reset_timeout
+            await asyncio.sleep(0.15)
+            with pytest.raises(telegram.error.NetworkError):
+                await send(bot)
+            assert breaker.state == OPEN
+            with pytest.raises(CircuitOpen):
+                await send(bot)
+
+            # 试探成功：关闭
+            await asyncio.sleep(0.15)
+            await send(bot)
+            assert breaker.state == CLOSED
+            await send(bot)
+            assert len(api.calls_to("sendMessage")) == 4
+
+    asyncio.run(main())
+
+
+def test_half_open_lets_one_trial_through():
+    async def main():
+        async with fake_bot(threshold=1, reset_timeout=0.1, latency={"sendMessage": 0.1}) as (api, bot):
+            breaker = bot._breakers.get("sendMessage")
+            api.inject("sendMessage", "5xx")
+            with pytest.raises(telegram.error.NetworkError):
+                await send(bot)
+            await asyncio.sleep(0.15)
+
+            trial = asyncio.ensure_future(send(bot, "trial"))
+            await asyncio.sleep(0.02)
+            assert breaker.state == HALF_OPEN
+            with pytest.raises(CircuitOpen):
+                await send(bot, "second")
+            await trial
+            assert breaker.state == CLOSED
+            assert [p["text"] for p in api.calls_to("sendMessage")] == ["hi", "trial"]
+
+    asyncio.run(main())
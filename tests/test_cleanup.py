@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import cleanup
+from conftest import fake_bot
+
+GROUP_ID = -1001000000001
+OTHER_GROUP_ID = -1001000000002
+
+
+def deleted_batches(api):
+    return [(int(p["chat_id"]), json.loads(p["message_ids"])) for p in api.calls_to("deleteMessages")]
+
+
+def test_messages_in_window_are_deleted_in_one_call_per_chat():
+    async def main():
+        async with fake_bot() as (api, bot):
+            buffer = cleanup.DeleteBuffer(bot, window=0.1)
+            for message_id in range(1, 6):
+                buffer.add(GROUP_ID, message_id)
+            buffer.add(OTHER_GROUP_ID, 9)
+            assert buffer.pending_count() == 6
+            assert api.calls_to("deleteMessages") == []
+
+            await asyncio.sleep(0.2)
+            await buffer.flush_all()
+            assert dict(deleted_batches(api)) == {GROUP_ID: [1, 2, 3, 4, 5], OTHER_GROUP_ID: [9]}
+            assert len(api.calls_to("deleteMessages")) == 2
+            assert api.calls_to("deleteMessage") == []
+            assert buffer.pending_count() == 0
+
+    asyncio.run(main())
+
+
+def test_full_batch_is_deleted_without_waiting():
+    async def main():
+        async with fake_bot() as (api, bot):
+            buffer = cleanup.DeleteBuffer(bot, window=30)
+            for message_id in range(cleanup.MAX_BATCH + 5):
+                buffer.add(GROUP_ID, message_id)
+            await api.wait_calls("deleteMessages", 1, timeout=5)
+            assert deleted_batches(api) == [(GROUP_ID, list(range(cleanup.MAX_BATCH)))]
+            assert buffer.pending_count() == 5
+            await buffer.flush_all()
+            assert deleted_batches(api)[1] == (GROUP_ID, list(range(cleanup.MAX_BATCH, cleanup.MAX_BATCH + 5)))
+
+    asyncio.run(main())
+
+
+def test_falls_back_to_paced_deletes_without_delete_messages():
+    async def main():
+        async with fake_bot() as (api, bot):
+            # 旧版自建 Bot API 服务器没有 deleteMessages
+            async def not_found(params):
+                return api._error(404, "Not Found")
+
+            api._api_deleteMessages = not_found
+            buffer = cleanup.DeleteBuffer(bot, window=0.05, pace=0.01)
+            for message_id in (1, 2, 3):
+                buffer.add(GROUP_ID, message_id)
+            await asyncio.sleep(0.1)
+            await buffer.flush_all()
+            assert not buffer.bulk
+            assert api.call_sequence() == ["deleteMessages", "deleteMessage", "deleteMessage", "deleteMessage"]
+
+            # 之后直接逐条删除
+            buffer.add(GROUP_ID, 4)
+            await buffer.flush_all()
+            assert api.call_sequence()[-1] == "deleteMessage"
+            assert len(api.calls_to("deleteMessages")) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import jobs
+from conftest import fake_bot
+
+CHANNEL_ID = -1001000000001
+TASK = {"chat_id": CHANNEL_ID, "from_chat_id": 1001, "message_id": 7, "time": "2026-01-01 09:00"}
+
+
+def test_expired_lease_is_reclaimed_by_another_replica(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.2)
+
+    async def main():
+        path = str(tmp_path / "jobs.db")
+        first = jobs.JobStore(path, owner="first")
+        second = jobs.JobStore(path, owner="second")
+        async with fake_bot() as (api, bot):
+            job_id = await first.add(TASK, time.time() - 1)
+            assert await first.claim() == [job_id]
+            # 租约有效期内其他副本拿不到
+            assert await second.claim() == []
+
+            # 第一个副本卡住没续租，租约过期后第二个副本接手
+            await asyncio.sleep(0.3)
+            assert await second.claim() == [job_id]
+            await first.run_job(bot, job_id)
+            assert api.calls_to("copyMessage") == []
+            await second.run_job(bot, job_id)
+
+            assert api.calls_to("copyMessage") == [
+                {"chat_id": str(CHANNEL_ID), "from_chat_id": "1001", "message_id": "7"}
+            ]
+            row = await second._call(second._get, job_id)
+            assert (row["status"], row["owner"], row["attempts"]) == ("done", "second", 1)
+            assert await first.pending() == []
+
+    asyncio.run(main())
+
+
+def test_failed_send_is_released_for_retry(tmp_path):
+    async def main():
+        store = jobs.JobStore(str(tmp_path / "jobs.db"), owner="only")
+        async with fake_bot() as (api, bot):
+            job_id = await store.add(TASK, time.time() - 1)
+            api.inject("copyMessage", "5xx")
+            assert await store.claim() == [job_id]
+            await store.run_job(bot, job_id)
+            row = await store._call(store._get, job_id)
+            assert (row["status"], row["owner"], row["attempts"]) == ("pending", None, 1)
+            assert row["send_at"] > time.time()
+            assert await store.claim() == []
+
+    asyncio.run(main())
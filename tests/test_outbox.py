@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from conftest import fake_bot
+from outbox import Outbox
+
+CHANNEL_ID = -1001000000001
+
+
+async def wait_status(outbox, entry_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while (await outbox._call(outbox._get, entry_id))["status"] != status:
+        assert time.monotonic() < deadline, f"entry {entry_id} never became {status}"
+        await asyncio.sleep(0.01)
+
+
+def test_repost_records_deletes_then_sends(tmp_path):
+    async def main():
+        outbox = Outbox(str(tmp_path / "outbox.db"))
+        async with fake_bot() as (api, bot):
+            message = await outbox.repost(bot, CHANNEL_ID, 42, "text", "hello")
+            assert message is not None
+            assert api.call_sequence() == ["deleteMessage", "sendMessage"]
+            assert api.calls_to("deleteMessage")[0]["message_id"] == "42"
+            assert api.calls_to("sendMessage")[0]["text"] == "hello"
+            row = await outbox._call(outbox._get, 1)
+            assert (row["deleted"], row["status"], row["attempts"]) == (1, "done", 1)
+            assert await outbox.backlog() == 0
+
+    asyncio.run(main())
+
+
+def test_send_failure_is_retried_by_the_worker(tmp_path):
+    async def main():
+        outbox = Outbox(str(tmp_path / "outbox.db"))
+        async with fake_bot() as (api, bot):
+            api.inject("sendMessage", "5xx")
+            assert await outbox.repost(bot, CHANNEL_ID, 42, "text", "hello") is None
+            row = await outbox._call(outbox._get, 1)
+            assert (row["deleted"], row["status"], row["attempts"]) == (1, "pending", 1)
+            assert "Bad Gateway" in row["last_error"]
+            assert row["next_attempt_at"] > time.time()
+            assert await outbox.backlog() == 1
+
+            # 不等退避：提前到期后交给后台重试
+            await outbox._call(outbox._execute, "UPDATE outbox SET next_attempt_at = 0 WHERE id = 1")
+            outbox.start(bot, rate=100, interval=0.05)
+            try:
+                await wait_status(outbox, 1, "done")
+            finally:
+                await outbox.stop()
+            # 原消息只删一次，内容发了两次（第一次 502）
+            assert api.call_sequence() == ["deleteMessage", "sendMessage", "sendMessage"]
+            assert await outbox.backlog() == 0
+
+    asyncio.run(main())
+
+
+def test_entry_interrupted_during_delete_is_recovered(tmp_path):
+    async def main():
+        path = str(tmp_path / "outbox.db")
+        # 上一个进程记录之后、标记删除之前退出
+        entry_id = await Outbox(path).add(CHANNEL_ID, "text", "hello", message_id=42)
+        outbox = Outbox(path)
+        async with fake_bot() as (api, bot):
+            outbox.start(bot, rate=100, interval=0.05)
+            try:
+                await wait_status(outbox, entry_id, "done")
+            finally:
+                await outbox.stop()
+            assert api.call_sequence() == ["deleteMessage", "sendMessage"]
+
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import asyncio
+
+import priority
+from conftest import fake_bot
+
+CHANNEL_ID = -1001000000001
+USER_ID = 1001
+
+
+# 并发名额只有一个时先占住它，让后面的请求都排队
+async def occupy(bot):
+    task = asyncio.ensure_future(bot.send_chat_action(chat_id=USER_ID, action="typing"))
+    await asyncio.sleep(0.05)
+    return task
+
+
+def send(bot, priority_class, chat_id, text):
+    with priority.use(priority_class):
+        return asyncio.ensure_future(bot.send_message(chat_id=chat_id, text=text))
+
+
+def test_higher_priority_goes_first():
+    async def main():
+        async with fake_bot(concurrency=1, latency={"sendChatAction": 0.2}) as (api, bot):
+            blocker = await occupy(bot)
+            tasks = [
+                send(bot, priority.BULK, CHANNEL_ID, "bulk"),
+                send(bot, priority.REPOST, CHANNEL_ID, "repost"),
+                send(bot, priority.INTERACTIVE, USER_ID, "interactive"),
+            ]
+            await asyncio.sleep(0.05)
+            assert [bot.rate_limiter.queue_depth(cls) for cls in priority.CLASSES] == [1, 1, 1]
+            await asyncio.gather(blocker, *tasks)
+            assert [p["text"] for p in api.calls_to("sendMessage")] == ["interactive", "repost", "bulk"]
+
+    asyncio.run(main())
+
+
+def test_classify_without_explicit_class():
+    assert priority.classify("sendMessage", {"chat_id": USER_ID}) == priority.INTERACTIVE
+    assert priority.classify("sendMessage", {"chat_id": CHANNEL_ID}) == priority.REPOST
+    assert priority.classify("deleteMessages", {"chat_id": CHANNEL_ID}) == priority.BULK
+    assert priority.classify("answerCallbackQuery", {}) == priority.INTERACTIVE
+    with priority.use(priority.BULK):
+        assert priority.classify("sendMessage", {"chat_id": USER_ID}) == priority.BULK
+
+
+def test_overdue_bulk_is_not_starved(monkeypatch):
+    monkeypatch.setitem(priority.MAX_WAIT, priority.BULK, 0.3)
+
+    async def main():
+        async with fake_bot(concurrency=1, latency={"sendChatAction": 0.1, "sendMessage": 0.05}) as (api, bot):
+            blocker = await occupy(bot)
+            tasks = [send(bot, priority.BULK, CHANNEL_ID, "bulk")]
+            tasks += [send(bot, priority.INTERACTIVE, USER_ID, f"i{n}") for n in range(10)]
+            await asyncio.gather(blocker, *tasks)
+            texts = [p["text"] for p in api.calls_to("sendMessage")]
+            # 私聊回复一直排着队，bulk 等够 MAX_WAIT 后插到前面，而不是排到最后
+            assert 0 < texts.index("bulk") < 10
+            assert [t for t in texts if t != "bulk"] == [f"i{n}" for n in range(10)]
+
+    asyncio.run(main())
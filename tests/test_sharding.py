@@ -0,0 +1,49 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from conftest import fake_bot
+from sharding import ChatShardedProcessor
+
+CHATS = (-1001, -1002, -1003)
+PER_CHAT = 5
+
+
+def text_update(update_id, chat_id, text, bot):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "group"}, "text": text},
+    }, bot)
+
+
+def test_updates_in_one_chat_keep_their_order():
+    async def main():
+        async with fake_bot() as (api, bot):
+            processor = ChatShardedProcessor(concurrency=len(CHATS))
+            application = ApplicationBuilder().bot(bot).concurrent_updates(processor).updater(None).build()
+
+            async def reply(update, context):
+                # 先到的更新处理得更久，逐条串行时顺序才不会乱
+                n = int(update.message.text.split("-")[1])
+                await asyncio.sleep((PER_CHAT - n) * 0.02)
+                await update.effective_chat.send_message(update.message.text)
+
+            application.add_handler(MessageHandler(filters.TEXT, reply))
+            async with application:
+                await application.start()
+                update_id = 0
+                for n in range(PER_CHAT):
+                    for chat_id in CHATS:
+                        update_id += 1
+                        await application.update_queue.put(text_update(update_id, chat_id, f"{chat_id}-{n}", bot))
+                await api.wait_calls("sendMessage", len(CHATS) * PER_CHAT, timeout=10)
+                await application.stop()
+
+            sent = [(int(p["chat_id"]), p["text"]) for p in api.calls_to("sendMessage")]
+            for chat_id in CHATS:
+                assert [text for c, text in sent if c == chat_id] == [f"{chat_id}-{n}" for n in range(PER_CHAT)]
+            # 不同会话并发处理：每个会话的第一条都在任何会话的第二条之前发出
+            assert {c for c, _ in sent[:len(CHATS)]} == set(CHATS)
+
+    asyncio.run(main())
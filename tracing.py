@@ -0,0 +1,133 @@
+import collections
+import contextlib
+import contextvars
+import itertools
+import os
+import time
+
+import memory
+import metrics
+
+# 频道帖子的生命周期追踪
+# 每个更新带一个 trace，从 webhook() 收到请求开始，经过分发、handle_channel_post 解析、
+# 发件箱记录、删除原消息、发送，每一段记一个 span（开始偏移和耗时，出错时记异常类型）。
+# 结束的 trace 放进按类型分开的环形缓冲区，只保留最近 TRACE_BUFFER 条，
+# 通过管理员命令 /trace 或 HTTP /admin/trace 查看最慢或最近的帖子。
+#
+#     with tracing.trace("channel_post", chat_id=chat_id):
+#         with tracing.span("delete"):
+#             await bot.delete_message(...)
+#
+# 不在 trace 里时 span() 什么也不记，后台任务之类的调用不受影响。
+
+TRACE_BUFFER = int(os.environ.get("TRACE_BUFFER", "500"))
+
+_current = contextvars.ContextVar("trace", default=None)
+_ids = itertools.count(1)
+# 类型 -> deque(Trace)
+_buffers = {}
+memory.register("trace_buffers", lambda: [t for buffer in _buffers.values() for t in buffer])
+
+
+class Trace:
+    __slots__ = ("id", "kind", "attrs", "started_at", "_started", "duration", "spans", "error")
+
+    def __init__(self, kind, attrs):
+        self.id = next(_ids)
+        self.kind = kind
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        # (名称, 开始偏移, 耗时, 异常类型或 None)，单位秒
+        self.spans = []
+        self.error = None
+
+
+# 开始一个 trace；已经在 trace 里时不新建，只改类型并补充属性
+# （webhook() 建的 update trace 进入 handle_channel_post 后变成 channel_post）
+@contextlib.contextmanager
+def trace(kind, **attrs):
+    current = _current.get()
+    if current is not None:
+        current.kind = kind
+        current.attrs.update(attrs)
+        yield current
+        return
+    # 多租户时带上租户名
+    current = Trace(kind, {**metrics.scope_labels(), **attrs})
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        current.duration = time.perf_counter() - current._started
+        buffer = _buffers.get(current.kind)
+        if buffer is None:
+            buffer = _buffers[current.kind] = collections.deque(maxlen=TRACE_BUFFER)
+        buffer.append(current)
+
+
+@contextlib.contextmanager
+def span(name):
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current.spans.append((name, started - current._started, time.perf_counter() - started, error))
+
+
+# 给当前 trace 补充属性（发件箱条目 ID、处理结果……）
+def annotate(**attrs):
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def current_id():
+    current = _current.get()
+    return current.id if current is not None else None
+
+
+def kinds():
+    return sorted(_buffers)
+
+
+# 按条件筛选最近的 trace；sort="slow" 按耗时从大到小，否则从新到旧
+def query(kind="channel_post", sort="recent", limit=10, **attrs):
+    traces = list(_buffers.get(kind, ()))
+    if attrs:
+        traces = [t for t in traces if all(str(t.attrs.get(k)) == str(v) for k, v in attrs.items())]
+    if sort == "slow":
+        traces.sort(key=lambda t: t.duration, reverse=True)
+    else:
+        traces.reverse()
+    return traces[:limit]
+
+
+def format_trace(t):
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t.started_at))
+    attrs = " ".join(f"{k}={v}" for k, v in t.attrs.items())
+    status = f"error={t.error}" if t.error else "ok"
+    lines = [f"#{t.id} {t.kind} {started} {t.duration * 1000:.1f}ms {status} {attrs}".rstrip()]
+    for name, offset, duration, error in sorted(t.spans, key=lambda s: s[1]):
+        line = f"  {name:<10} +{offset * 1000:7.1f}ms {duration * 1000:8.1f}ms"
+        lines.append(f"{line} {error}" if error else line)
+    return "\n".join(lines)
+
+
+def render(traces):
+    if not traces:
+        return "no traces"
+    return "\n\n".join(format_trace(t) for t in traces)
@@ -5,13 +5,40 @@ import asyncio
 from datetime import datetime
 import re
 import os
+import time
+import allowed_updates
+import botclient
+import eventloop
+import sharding
+import health
+import logsetup
+import metrics
+import priority
+import tracing
+import memory
+import admin
+from outbox import Outbox
+from jobs import JobStore
+import media
+from media import MediaCache
+
+# 设置日志：后台线程格式化输出
+logsetup.setup()
 
 # Bot Token
 import os
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 
-# 定时任务列表
-scheduled_tasks = []
+# 本地媒体文件的上传缓存（内容哈希 -> file_id）
+media_cache = MediaCache()
+memory.register("media_digests", lambda: media_cache._digests)
+# 定时任务表：多个副本共用 JOBS_PATH，到期任务按租约认领，不会重复发送
+scheduled_jobs = JobStore()
+
+metrics.register_gauge("scheduled_jobs_pending", scheduled_jobs.pending_count)
+
+# 帖子重发发件箱：先记录再删除原消息，发送失败后台重试
+post_outbox = Outbox(os.environ.get("OUTBOX_PATH", "outbox.db"))
 
 # 状态机
 PHOTO_TEXT, BUTTON_COUNT, BUTTON_LAYOUT, BUTTON_DETAILS, TARGET_CHANNEL, SCHEDULE_TIME, CANCEL_TASK = range(7)
@@ -95,11 +122,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     
     if query.data == "view_tasks":
-        if not scheduled_tasks:
+        pending = await scheduled_jobs.pending()
+        if not pending:
             await query.edit_message_text("当前没有定时任务。", reply_markup=None)
             await query.message.reply_text("选择下一步操作：", reply_markup=TASK_MENU)
         else:
-            tasks = "\n".join([f"任务 {i+1} t.me/c/{str(task['chat_id'])[4:]} {task['time']}" for i, task in enumerate(scheduled_tasks)])
+            tasks = "\n".join([f"任务 {i+1} t.me/c/{str(task['chat_id'])[4:]} {task['time']}" for i, task in enumerate(pending)])
             await query.edit_message_text(f"当前任务：\n{tasks}", reply_markup=None)
             await query.message.reply_text("选择下一步操作：", reply_markup=TASK_MENU)
         return ConversationHandler.END
@@ -114,14 +142,15 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return PHOTO_TEXT
     elif text == "查看当前任务":
-        if not scheduled_tasks:
+        pending = await scheduled_jobs.pending()
+        if not pending:
             await update.message.reply_text("当前没有定时任务。", reply_markup=TASK_MENU)
         else:
-            tasks = "\n".join([f"任务 {i+1} t.me/c/{str(task['chat_id'])[4:]} {task['time']}" for i, task in enumerate(scheduled_tasks)])
+            tasks = "\n".join([f"任务 {i+1} t.me/c/{str(task['chat_id'])[4:]} {task['time']}" for i, task in enumerate(pending)])
             await update.message.reply_text(f"当前任务：\n{tasks}", reply_markup=TASK_MENU)
         return ConversationHandler.END
     elif text == "取消任务":
-        if not scheduled_tasks:
+        if not await scheduled_jobs.pending():
             await update.message.reply_text("当前没有任务可取消！", reply_markup=REPLY_MAIN_MENU)
             return ConversationHandler.END
         await update.message.reply_text("您需要取消哪个任务？请输入任务编号（例如 1）：", reply_markup=BACK_MENU)
@@ -146,6 +175,20 @@ async def photo_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     video = message.video.file_id if message.video else None
     text = message.text or message.caption or ""
     
+    # 管理员可以用服务器上的文件：第一行写 file:文件名（MEDIA_DIR 里的相对路径），其余为文案
+    if media.MEDIA_DIR and not photo and not video and media.is_local(text) and update.effective_user.id in admin.ADMIN_IDS:
+        local, _, text = text.partition("\n")
+        try:
+            kind = media.kind_of(media.resolve(local))
+        except ValueError:
+            kind = None
+        if kind is None:
+            await update.message.reply_text("找不到这个图片/视频文件！请检查文件名后重新发送：", reply_markup=BACK_MENU)
+            return PHOTO_TEXT
+        local = local.strip()
+        photo, video = (local, None) if kind == "photo" else (None, local)
+        text = text.strip()
+    
     if photo:
         context.user_data["photo"] = photo
     if video:
@@ -252,17 +295,29 @@ async def button_details(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return BUTTON_DETAILS
     
-    context.user_data["buttons"] = buttons
     layout = context.user_data["layout"]
     keyboard = [[InlineKeyboardButton(buttons[i]["text"], url=buttons[i]["url"]) for i in row] for row in layout]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    if context.user_data.get("photo"):
-        await update.message.reply_photo(photo=context.user_data["photo"], caption=context.user_data.get("text"), reply_markup=reply_markup)
-    elif context.user_data.get("video"):
-        await update.message.reply_video(video=context.user_data["video"], caption=context.user_data.get("text"), reply_markup=reply_markup)
+    # 预览就是最终的帖子：定时任务到点时把这条消息 copy_message 到频道
+    if context.user_data.get("photo") or context.user_data.get("video"):
+        # 本地文件在这里上传，同样内容的文件再次使用时发缓存的 file_id
+        kind = "photo" if context.user_data.get("photo") else "video"
+        try:
+            preview = await media_cache.send(
+                context.bot, kind, context.user_data[kind],
+                chat_id=update.effective_chat.id, caption=context.user_data.get("text"), reply_markup=reply_markup,
+            )
+        except (ValueError, telegram.error.BadRequest) as e:
+            # 本地文件在设置期间被删掉、移走，或者 Telegram 不接受这个媒体：回到第一步重新发送
+            message = e.message if isinstance(e, telegram.error.BadRequest) else str(e)
+            context.user_data.pop("photo", None)
+            context.user_data.pop("video", None)
+            await update.message.reply_text(f"图片/视频无法使用（{message}）！请重新发送图片/视频和文案：", reply_markup=BACK_MENU)
+            return PHOTO_TEXT
     else:
-        await update.message.reply_text(text=context.user_data.get("text"), reply_markup=reply_markup)
+        preview = await update.message.reply_text(text=context.user_data.get("text"), reply_markup=reply_markup)
+    context.user_data["preview"] = (preview.chat_id, preview.message_id)
     
     await update.message.reply_text("恭喜，按钮帖子已生成！接下来，请告诉我需要发送到哪个频道（例如 @YourChannel 或 t.me/YourChannel）：", reply_markup=BACK_MENU)
     return TARGET_CHANNEL
@@ -280,9 +335,11 @@ async def target_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         text = f"@{chat_identifier}"
     
     try:
-        test_msg = await context.bot.send_message(chat_id=text, text="测试消息（机器人验证用，将自动删除）")
-        actual_chat_id = test_msg.chat_id
-        await context.bot.delete_message(chat_id=actual_chat_id, message_id=test_msg.message_id)
+        # 用户正在向导里等结果，按私聊回复的优先级发送
+        with priority.use(priority.INTERACTIVE):
+            test_msg = await context.bot.send_message(chat_id=text, text="测试消息（机器人验证用，将自动删除）")
+            actual_chat_id = test_msg.chat_id
+            await context.bot.delete_message(chat_id=actual_chat_id, message_id=test_msg.message_id)
         context.user_data["channel"] = actual_chat_id
         await update.message.reply_text("目标已确认！最后一步，请设置发送时间（格式：YYYY/MM/DD HH:MM，例如 2025/02/27 15:33）：", reply_markup=BACK_MENU)
         return SCHEDULE_TIME
@@ -298,36 +355,18 @@ async def schedule_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     text = text.replace("：", ":")
     try:
         send_time = datetime.strptime(text, "%Y/%m/%d %H:%M")
+        from_chat_id, message_id = context.user_data["preview"]
         task = {
             "chat_id": context.user_data["channel"],
-            "text": context.user_data.get("text"),
-            "photo": context.user_data.get("photo"),
-            "video": context.user_data.get("video"),
-            "buttons": context.user_data["buttons"],
-            "layout": context.user_data["layout"],
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
             "time": text
         }
-        scheduled_tasks.append(task)
-        
-        keyboard = [[InlineKeyboardButton(task["buttons"][i]["text"], url=task["buttons"][i]["url"]) for i in row] for row in task["layout"]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        async def send_task():
-            try:
-                if task["photo"]:
-                    await context.bot.send_photo(chat_id=task["chat_id"], photo=task["photo"], caption=task["text"], reply_markup=reply_markup)
-                elif task["video"]:
-                    await context.bot.send_video(chat_id=task["chat_id"], video=task["video"], caption=task["text"], reply_markup=reply_markup)
-                else:
-                    await context.bot.send_message(chat_id=task["chat_id"], text=task["text"], reply_markup=reply_markup)
-            except telegram.error.BadRequest as e:
-                print(f"定时任务失败：{e.message}，chat_id: {task['chat_id']}")
         
-        now = datetime.now()
-        delay = (send_time - now).total_seconds()
+        delay = (send_time - datetime.now()).total_seconds()
         if delay > 0:
-            asyncio.get_event_loop().call_later(delay, lambda: asyncio.ensure_future(send_task()))
-            await update.message.reply_text(f"定时任务设置成功！将在 {text} 发送到 {context.user_data['channel']}。返回菜单继续操作吧！", reply_markup=REPLY_MAIN_MENU)
+            await scheduled_jobs.add(task, time.time() + delay)
+            await update.message.reply_text(f"定时任务设置成功！将在 {text} 发送到 {context.user_data['channel']}（发送的是上面的预览，发送前请不要删除它）。返回菜单继续操作吧！", reply_markup=REPLY_MAIN_MENU)
         else:
             await update.message.reply_text("这个时间已过去！请设置一个未来的时间：", reply_markup=BACK_MENU)
             return SCHEDULE_TIME
@@ -344,12 +383,15 @@ async def cancel_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     
     try:
         task_num = int(text) - 1
-        if 0 <= task_num < len(scheduled_tasks):
-            scheduled_tasks.pop(task_num)
-            await update.message.reply_text("任务取消成功！", reply_markup=BACK_MENU)
+        pending = await scheduled_jobs.pending()
+        if 0 <= task_num < len(pending):
+            if await scheduled_jobs.cancel(pending[task_num]["id"]):
+                await update.message.reply_text("任务取消成功！", reply_markup=BACK_MENU)
+            else:
+                await update.message.reply_text("该任务正在发送，无法取消。", reply_markup=BACK_MENU)
             return ConversationHandler.END
         else:
-            await update.message.reply_text(f"请输入有效的任务编号（1-{len(scheduled_tasks)}）：", reply_markup=BACK_MENU)
+            await update.message.reply_text(f"请输入有效的任务编号（1-{len(pending)}）：", reply_markup=BACK_MENU)
             return CANCEL_TASK
     except ValueError:
         await update.message.reply_text("请正确输入任务编号（数字）：", reply_markup=BACK_MENU)
@@ -359,19 +401,13 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("已取消设置。", reply_markup=REPLY_MAIN_MENU)
     return await show_home(update, context)
 
-# 频道帖子识别与重发
-async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message = update.channel_post
-    # 检查文本或标题中是否包含 "==="
-    content = message.text if message.text else message.caption if message.caption else ""
+# 解析帖子：=== 之前是文案，之后是按钮；返回 (文案, 按钮键盘)，格式不对或没有有效按钮时返回 None
+def parse_post(content):
     if not content or "===" not in content:
-        return  # 如果没有内容或没有 "==="，直接退出
+        return None
     
     # 分割内容和按钮部分
     parts = content.split("===", 1)
-    if len(parts) != 2:
-        return  # 如果分割后不是两部分，格式错误，退出
-    
     content_text = parts[0].strip()  # 文案部分
     button_text = parts[1].strip()   # 按钮部分
     
@@ -395,39 +431,58 @@ async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE
             keyboard.append(row)
     
     if not buttons:
-        return  # 如果没有有效的按钮，退出
+        return None
     
     # 生成按钮键盘
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # 删除原消息
-    await context.bot.delete_message(chat_id=message.chat_id, message_id=message.message_id)
-    
-    # 根据消息类型重发
-    if message.photo:
-        await context.bot.send_photo(
-            chat_id=message.chat_id,
-            photo=message.photo[-1].file_id,  # 使用最高质量的图片
-            caption=content_text,
-            reply_markup=reply_markup
-        )
-    elif message.video:
-        await context.bot.send_video(
-            chat_id=message.chat_id,
-            video=message.video.file_id,
-            caption=content_text,
-            reply_markup=reply_markup
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=message.chat_id,
-            text=content_text,
-            reply_markup=reply_markup
+    return content_text, InlineKeyboardMarkup(keyboard)
+
+# 频道帖子识别与重发
+async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.channel_post
+    with tracing.trace("channel_post", update_id=update.update_id, chat_id=message.chat_id, message_id=message.message_id):
+        # 检查文本或标题中是否包含 "==="
+        with tracing.span("parse"):
+            parsed = parse_post(message.text or message.caption or "")
+        if parsed is None:
+            tracing.annotate(outcome="skipped")
+            return
+        content_text, reply_markup = parsed
+        
+        # 先写入发件箱，再删除原消息并按消息类型重发
+        if message.photo:
+            kind, file_id = "photo", message.photo[-1].file_id  # 使用最高质量的图片
+        elif message.video:
+            kind, file_id = "video", message.video.file_id
+        else:
+            kind, file_id = "text", None
+        await post_outbox.repost(
+            context.bot, message.chat_id, message.message_id, kind, content_text, file_id, reply_markup
         )
 
+async def post_init(application):
+    # 健康检查和 /metrics（含 scheduled_jobs_pending）
+    await health.start(application)
+    post_outbox.start(application.bot)
+    scheduled_jobs.start(application.bot)
+    memory.start()
+
+async def post_shutdown(application):
+    await post_outbox.stop()
+    await scheduled_jobs.stop()
+    await memory.stop()
+    await health.stop(application)
+
 def main():
-    application = ApplicationBuilder().token(TOKEN).build()
+    application = (
+        sharding.configure(botclient.application_builder(TOKEN))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
+    # 管理员命令（/trace、/profile、/memory），HTTP 入口挂在健康检查服务器上
+    admin.add_handlers(application)
+    admin.add_health_routes()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(button_handler))
 
@@ -452,7 +507,10 @@ def main():
     application.add_handler(conv_handler)
     application.add_handler(MessageHandler(telegram.ext.filters.ChatType.CHANNEL, handle_channel_post))
 
-    application.run_polling()
+    metrics.instrument_handlers(application)
+    memory.register_application(application)
+    application.run_polling(allowed_updates=allowed_updates.derive(application))
 
 if __name__ == "__main__":
+    eventloop.install(current=True)
     main()
\ No newline at end of file
@@ -3,31 +3,35 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes
 import asyncio
 import re
-from flask import Flask
-import threading
 import logging
 from datetime import datetime
 import os
+import allowed_updates
+import botclient
+import eventloop
+import sharding
+import health
+import logsetup
+from logsetup import Lazy
+from outbox import Outbox
+import metrics
+import tracing
+import memory
+import admin
+from ratelimit import ReplyThrottle
 
-# 设置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# 设置日志：后台线程格式化输出
+logsetup.setup()
 logger = logging.getLogger(__name__)
 
-# Flask 服务器
-app = Flask(__name__)
-
-@app.route('/')
-def keep_alive():
-    return "Bot is alive!"
-
-def run_flask():
-    app.run(host='0.0.0.0', port=8080)
-
 # Bot Token
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+# 私聊回复节流：每个用户在窗口内最多收到的回复数
+PRIVATE_REPLY_WINDOW = float(os.environ.get("PRIVATE_REPLY_WINDOW", "10"))
+PRIVATE_REPLY_LIMIT = int(os.environ.get("PRIVATE_REPLY_LIMIT", "1"))
+reply_throttle = ReplyThrottle(PRIVATE_REPLY_WINDOW, PRIVATE_REPLY_LIMIT)
+# 帖子重发发件箱：先记录再删除原消息，发送失败后台重试
+post_outbox = Outbox(os.environ.get("OUTBOX_PATH", "outbox.db"))
 
 # 主页信息
 HOME_MESSAGE = """
@@ -52,6 +56,10 @@ HOME_MESSAGE = """
 
 # 启动机器人或处理私聊消息 - 只显示主页信息
 async def handle_private(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not reply_throttle.allow(update.effective_user.id):
+        metrics.inc("private_replies_suppressed_total")
+        return
+    metrics.inc("private_replies_total")
     await update.message.reply_text(HOME_MESSAGE)
 
 # 处理机器人被加入频道
@@ -66,73 +74,98 @@ async def handle_new_chat_member(update: Update, context: ContextTypes.DEFAULT_T
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 logger.info(f"机器人被加入频道: {chat_title} (ID: {chat_id}), 邀请者: {inviter}, 时间: {timestamp}")
 
+# 解析帖子：=== 之前是文案，之后是按钮；返回 (文案, 按钮键盘)，没有有效按钮时返回 None
+def parse_post(text):
+    if "===" not in text:
+        return None
+    parts = text.split("===", 1)
+    content = parts[0].strip()
+    button_text = parts[1].strip()
+    lines = button_text.split("\n")
+    keyboard = []
+    buttons = []
+    
+    for line in lines:
+        items = re.split(r"[,，]", line)
+        row = []
+        for item in items:
+            item = item.strip()
+            if item.startswith("[") and item.endswith("]") and "+" in item:
+                btn_info = item[1:-1].split("+", 1)
+                if len(btn_info) == 2 and len(buttons) < 9:
+                    btn = InlineKeyboardButton(btn_info[0].strip(), url=btn_info[1].strip())
+                    row.append(btn)
+                    buttons.append(btn)
+        if row:
+            keyboard.append(row)
+    
+    if not buttons:
+        return None
+    return content, InlineKeyboardMarkup(keyboard)
+
 # 频道帖子识别与重发
 async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.channel_post
-    # 检查文本或标题中是否有 "==="
-    text = message.text or message.caption or ""
-    if "===" in text:
-        parts = text.split("===", 1)
-        if len(parts) == 2:
-            content = parts[0].strip()
-            button_text = parts[1].strip()
-            lines = button_text.split("\n")
-            keyboard = []
-            buttons = []
-            
-            for line in lines:
-                items = re.split(r"[,，]", line)
-                row = []
-                for item in items:
-                    item = item.strip()
-                    if item.startswith("[") and item.endswith("]") and "+" in item:
-                        btn_info = item[1:-1].split("+", 1)
-                        if len(btn_info) == 2 and len(buttons) < 9:
-                            btn = InlineKeyboardButton(btn_info[0].strip(), url=btn_info[1].strip())
-                            row.append(btn)
-                            buttons.append(btn)
-                if row:
-                    keyboard.append(row)
-            
-            if buttons:
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                # 删除原始消息
-                await context.bot.delete_message(chat_id=message.chat_id, message_id=message.message_id)
-                
-                # 根据消息类型重新发送
-                if message.photo:
-                    new_message = await context.bot.send_photo(
-                        chat_id=message.chat_id,
-                        photo=message.photo[-1].file_id,  # 使用最高质量的图片
-                        caption=content,
-                        reply_markup=reply_markup
-                    )
-                elif message.video:
-                    new_message = await context.bot.send_video(
-                        chat_id=message.chat_id,
-                        video=message.video.file_id,
-                        caption=content,
-                        reply_markup=reply_markup
-                    )
-                else:
-                    new_message = await context.bot.send_message(
-                        chat_id=message.chat_id,
-                        text=content,
-                        reply_markup=reply_markup
-                    )
-                
-                # 记录日志
-                chat_title = message.chat.title or "未命名频道"
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                message_link = f"https://t.me/c/{str(message.chat_id)[4:]}/{new_message.message_id}"
-                sender = message.from_user.username or message.from_user.full_name or f"ID:{message.from_user.id}"
-                logger.info(f"频道帖子处理: {chat_title} (ID: {message.chat_id}), 发送者: {sender}, 时间: {timestamp}, 消息链接: {message_link}")
+    with tracing.trace("channel_post", update_id=update.update_id, chat_id=message.chat_id, message_id=message.message_id):
+        with tracing.span("parse"):
+            parsed = parse_post(message.text or message.caption or "")
+        if parsed is None:
+            tracing.annotate(outcome="skipped")
+            return
+        content, reply_markup = parsed
+        # 先写入发件箱，再删除原始消息并根据消息类型重新发送
+        if message.photo:
+            kind, file_id = "photo", message.photo[-1].file_id  # 使用最高质量的图片
+        elif message.video:
+            kind, file_id = "video", message.video.file_id
+        else:
+            kind, file_id = "text", None
+        new_message = await post_outbox.repost(
+            context.bot, message.chat_id, message.message_id, kind, content, file_id, reply_markup
+        )
+        if new_message is None:
+            return  # 发送失败，已交给发件箱重试
+        
+        # 记录日志（发送者和链接在日志线程里才拼接，时间见日志行首）
+        logger.info(
+            "频道帖子处理: %s (ID: %s), 发送者: %s, 消息链接: %s",
+            message.chat.title or "未命名频道", message.chat_id,
+            Lazy(describe_sender, message), Lazy(message_link, message.chat_id, new_message.message_id),
+        )
+
+# 日志用：帖子发送者（频道帖子没有 from_user，以频道身份发送）
+def describe_sender(message):
+    user = message.from_user
+    if user is not None:
+        return user.username or user.full_name or f"ID:{user.id}"
+    return message.sender_chat.title if message.sender_chat else "频道"
+
+# 日志用：重发后新帖子的链接
+def message_link(chat_id, message_id):
+    return f"https://t.me/c/{str(chat_id)[4:]}/{message_id}"
+
+async def post_init(application):
+    await health.start(application)
+    post_outbox.start(application.bot)
+    memory.start()
+
+async def post_shutdown(application):
+    await post_outbox.stop()
+    await memory.stop()
+    await health.stop(application)
 
 def main():
-    # 启动 Flask 服务器线程
-    threading.Thread(target=run_flask, daemon=True).start()
+    # 健康检查服务器和机器人共用同一个事件循环
+    application = (
+        sharding.configure(botclient.application_builder(TOKEN))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    application = ApplicationBuilder().token(TOKEN).build()
+    # 管理员命令（/trace），要排在通用私聊处理之前
+    admin.add_handlers(application)
+    admin.add_health_routes()
 
     # 处理私聊（包括 /start 和任何消息）
     application.add_handler(CommandHandler("start", handle_private))
@@ -153,7 +186,10 @@ def main():
         handle_new_chat_member
     ))
 
-    application.run_polling()
+    metrics.instrument_handlers(application)
+    memory.register_application(application)
+    application.run_polling(allowed_updates=allowed_updates.derive(application))
 
 if __name__ == "__main__":
+    eventloop.install(current=True)
     main()
\ No newline at end of file
@@ -4,19 +4,50 @@ from telegram.ext import Application, CommandHandler, MessageHandler, ContextTyp
 import logging
 import os
 import asyncio
+import signal
+import time
 from aiohttp import web
+import inline_reply
+import allowed_updates
+import botclient
+import eventloop
+import logsetup
+from outbox import Outbox
+import metrics
+import tracing
+import memory
+import admin
+from ratelimit import ReplyThrottle
 
-# 设置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# 设置日志：后台线程格式化输出，更新载荷抽样记录
+logsetup.setup()
 logger = logging.getLogger(__name__)
+payload_sampler = logsetup.Sampler()
 
 # 配置
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
-application = Application.builder().token(TOKEN).build()
+# 开启后，处理器的第一个简单回复直接放在 webhook 响应体里返回
+WEBHOOK_REPLY = os.environ.get("WEBHOOK_REPLY", "0") == "1"
+# 私聊回复节流：每个用户在窗口内最多收到的回复数
+PRIVATE_REPLY_WINDOW = float(os.environ.get("PRIVATE_REPLY_WINDOW", "10"))
+PRIVATE_REPLY_LIMIT = int(os.environ.get("PRIVATE_REPLY_LIMIT", "1"))
+reply_throttle = ReplyThrottle(PRIVATE_REPLY_WINDOW, PRIVATE_REPLY_LIMIT)
+PORT = int(os.environ.get("PORT", "10000"))
+application = botclient.application_builder(TOKEN).build()
+# 端口先于 Application 初始化打开，初始化完成前到达的更新在这里等待
+application_ready = asyncio.Event()
+# start_bot 结束（成功或失败）时置位；失败时 start_error 记下原因，等待中的和之后的更新都返回 503
+application_started = asyncio.Event()
+start_error = None
+# 帖子重发发件箱：先记录再删除原消息，发送失败后台重试
+post_outbox = Outbox(os.environ.get("OUTBOX_PATH", "outbox.db"))
+# 收到 SIGTERM 后停止接收新请求，最多等 SHUTDOWN_TIMEOUT 秒让处理中的更新完成
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+inflight_updates = set()
+metrics.register_gauge("webhook_inflight_updates", lambda: len(inflight_updates))
+memory.register("webhook_inflight_updates", lambda: inflight_updates)
+draining = False
 
 # 主页信息
 HOME_MESSAGE = """
@@ -38,9 +69,16 @@ HOME_MESSAGE = """
 [推特+https://twitter.com]
 开始在频道发帖试试吧！
 """
+HOME_MESSAGE_JSON = inline_reply.pre_serialize(HOME_MESSAGE)
 
 # 处理私聊消息
 async def handle_private(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not reply_throttle.allow(update.effective_user.id):
+        metrics.inc("private_replies_suppressed_total")
+        return
+    metrics.inc("private_replies_total")
+    if inline_reply.send_message(update.message.chat_id, HOME_MESSAGE_JSON):
+        return
     await update.message.reply_text(HOME_MESSAGE)
 
 # 处理机器人被加入频道
@@ -54,63 +92,78 @@ async def handle_new_chat_member(update: Update, context: ContextTypes.DEFAULT_T
                 chat_id = message.chat_id
                 logger.info(f"机器人被加入频道: {chat_title} (ID: {chat_id}), 邀请者: {inviter}")
 
+# 解析帖子：=== 之前是文案，之后是按钮；返回 (文案, 按钮键盘)，没有有效按钮时返回 None
+def parse_post(text):
+    if "===" not in text:
+        return None
+    parts = text.split("===", 1)
+    content = parts[0].strip()
+    button_text = parts[1].strip()
+    lines = button_text.split("\n")
+    keyboard = []
+    buttons = []
+    
+    for line in lines:
+        items = line.split(",")
+        row = []
+        for item in items:
+            item = item.strip()
+            if item.startswith("[") and item.endswith("]") and "+" in item:
+                btn_info = item[1:-1].split("+", 1)
+                if len(btn_info) == 2 and len(buttons) < 9:
+                    btn = InlineKeyboardButton(btn_info[0].strip(), url=btn_info[1].strip())
+                    row.append(btn)
+                    buttons.append(btn)
+        if row:
+            keyboard.append(row)
+    
+    if not buttons:
+        return None
+    return content, InlineKeyboardMarkup(keyboard)
+
 # 频道帖子识别与重发
 async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.channel_post
-    text = message.text or message.caption or ""
-    if "===" in text:
-        parts = text.split("===", 1)
-        if len(parts) == 2:
-            content = parts[0].strip()
-            button_text = parts[1].strip()
-            lines = button_text.split("\n")
-            keyboard = []
-            buttons = []
-            
-            for line in lines:
-                items = line.split(",")
-                row = []
-                for item in items:
-                    item = item.strip()
-                    if item.startswith("[") and item.endswith("]") and "+" in item:
-                        btn_info = item[1:-1].split("+", 1)
-                        if len(btn_info) == 2 and len(buttons) < 9:
-                            btn = InlineKeyboardButton(btn_info[0].strip(), url=btn_info[1].strip())
-                            row.append(btn)
-                            buttons.append(btn)
-                if row:
-                    keyboard.append(row)
-            
-            if buttons:
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.bot.delete_message(chat_id=message.chat_id, message_id=message.message_id)
-                
-                if message.photo:
-                    await context.bot.send_photo(
-                        chat_id=message.chat_id,
-                        photo=message.photo[-1].file_id,
-                        caption=content,
-                        reply_markup=reply_markup
-                    )
-                elif message.video:
-                    await context.bot.send_video(
-                        chat_id=message.chat_id,
-                        video=message.video.file_id,
-                        caption=content,
-                        reply_markup=reply_markup
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=message.chat_id,
-                        text=content,
-                        reply_markup=reply_markup
-                    )
+    with tracing.trace("channel_post", update_id=update.update_id, chat_id=message.chat_id, message_id=message.message_id):
+        with tracing.span("parse"):
+            parsed = parse_post(message.text or message.caption or "")
+        if parsed is None:
+            tracing.annotate(outcome="skipped")
+            return
+        content, reply_markup = parsed
+        if message.photo:
+            kind, file_id = "photo", message.photo[-1].file_id  # 使用最高质量的图片
+        elif message.video:
+            kind, file_id = "video", message.video.file_id
+        else:
+            kind, file_id = "text", None
+        await post_outbox.repost(
+            context.bot, message.chat_id, message.message_id, kind, content, file_id, reply_markup
+        )
 
 # Webhook 处理
 async def webhook(request):
+    # 停机中返回 503，Telegram 会稍后重发给新实例
+    if draining:
+        return web.Response(text="Shutting down", status=503)
+    if start_error is not None:
+        return web.Response(text="Bot failed to start", status=503)
+    task = asyncio.current_task()
+    inflight_updates.add(task)
+    started = time.perf_counter()
     try:
-        json_data = await request.json()
-        logger.info(f"Received JSON: {json_data}")
+        with tracing.trace("update"):
+            return await handle_webhook(request)
+    finally:
+        inflight_updates.discard(task)
+        metrics.histogram("webhook_request_seconds", time.perf_counter() - started)
+
+async def handle_webhook(request):
+    try:
+        with tracing.span("receive"):
+            json_data = await request.json()
+        if payload_sampler.allow():
+            logger.info("Received JSON: %s", json_data)
         if not json_data or "update_id" not in json_data:
             logger.error("Invalid JSON: missing update_id")
             return web.Response(text="Error: Invalid update", status=400)
@@ -121,52 +174,131 @@ async def webhook(request):
             if "message_id" not in json_data["message"]:
                 logger.error("Invalid JSON: missing message_id in message")
                 return web.Response(text="Error: Missing message_id", status=400)
-        update = Update.de_json(json_data, application.bot)
+        if not application_started.is_set():
+            await application_started.wait()
+        if start_error is not None:
+            return web.Response(text="Bot failed to start", status=503)
+        with tracing.span("decode"):
+            update = Update.de_json(json_data, application.bot)
         if update is None:
             logger.error("Failed to parse update")
             return web.Response(text="Error: Invalid update", status=400)
-        await application.process_update(update)
-        logger.info("Update processed successfully")
+        tracing.annotate(update_id=update.update_id)
+        if not WEBHOOK_REPLY:
+            with tracing.span("dispatch"):
+                await application.process_update(update)
+            logger.debug("Update processed successfully")
+            return web.Response(text="OK", status=200)
+        slot, token = inline_reply.open_slot()
+        try:
+            with tracing.span("dispatch"):
+                await application.process_update(update)
+        finally:
+            inline_reply.close_slot(token)
+        logger.debug("Update processed successfully")
+        if slot.body is not None:
+            return web.Response(body=slot.body, content_type="application/json")
         return web.Response(text="OK", status=200)
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         return web.Response(text="Error", status=500)
 
-# 根路径处理
+# 根路径处理（健康检查探针访问频繁，不记日志）
 async def keep_alive(request):
-    logger.info("Root path accessed")
     return web.Response(text="Bot is alive!")
 
+# 指标
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
 # 设置处理器
 def setup_handlers():
+    admin.add_handlers(application)
     application.add_handler(CommandHandler("start", handle_private))
     application.add_handler(MessageHandler(filters.ChatType.PRIVATE, handle_private))
     application.add_handler(MessageHandler(filters.ChatType.CHANNEL, handle_channel_post))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_chat_member))
+    metrics.instrument_handlers(application)
+    memory.register_application(application)
 
-# 设置 Webhook
+# 设置 Webhook（已经一致时跳过）
 async def set_webhook():
     await application.initialize()  # 初始化 Application
-    await application.bot.set_webhook(url=f"{WEBHOOK_URL}/{TOKEN}")
-    logger.info(f"Webhook set to {WEBHOOK_URL}/{TOKEN}")
+    url = f"{WEBHOOK_URL}/{TOKEN}"
+    if await botclient.ensure_webhook(application.bot, url, allowed_updates.derive(application)):
+        logger.info(f"Webhook set to {url}")
 
 # 启动 aiohttp 服务器
 async def main():
     setup_handlers()
-    await set_webhook()
     
     app = web.Application()
     app.router.add_post(f"/{TOKEN}", webhook)
     app.router.add_get('/', keep_alive)  # 添加根路径
-    runner = web.AppRunner(app)
+    app.router.add_get('/metrics', metrics_endpoint)
+    admin.add_routes(app)
+    # 每条更新一行的访问日志在事件循环里格式化，默认关闭（LOG_ACCESS=1 打开）
+    runner = web.AppRunner(app, access_log=logsetup.access_logger())
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 10000)
+    site = web.TCPSite(runner, '0.0.0.0', PORT)
     await site.start()
-    logger.info("aiohttp server started on port 10000")
+    logger.info(f"aiohttp server started on port {PORT}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
     
-    # 保持运行
-    while True:
-        await asyncio.sleep(3600)  # 每小时休眠一次，避免退出
+    # 先开端口再初始化：getMe / getWebhookInfo 的网络往返不再推迟端口就绪
+    await start_bot()
+    
+    # 运行到收到停机信号
+    await stop.wait()
+    await shutdown(runner, site)
+
+# 端口打开之后调用：初始化、设置 webhook、启动后台任务（host.py 对每个租户调用）
+async def start_bot():
+    global start_error
+    # host.py 重试启动时清掉上一次的失败
+    start_error = None
+    try:
+        await set_webhook()
+    except Exception as e:
+        start_error = e
+        raise
+    finally:
+        application_started.set()
+    application_ready.set()
+    post_outbox.start(application.bot)
+    memory.start()
+
+# 优雅停机：停止接收 -> 等处理中的更新完成 -> 清理剩余状态 -> 关闭服务器和 Application
+async def shutdown(runner, site):
+    global draining
+    draining = True
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_TIMEOUT
+    await site.stop()
+    await drain(deadline)
+    await runner.cleanup()
+    await stop_bot()
+
+# 等处理中的更新完成，处理剩余状态；调用前 draining 已置位、不再接收新请求
+async def drain(deadline):
+    logger.info(f"Shutting down, draining {len(inflight_updates)} in-flight updates")
+    if inflight_updates:
+        # 所有等待共用 shutdown 定下的 deadline，多租户时也不会超出总的停机时间
+        remaining = max(deadline - asyncio.get_running_loop().time(), 0)
+        _, pending = await asyncio.wait(set(inflight_updates), timeout=remaining)
+        if pending:
+            logger.error(f"{len(pending)} updates still in flight at the shutdown deadline")
+
+async def stop_bot():
+    await post_outbox.stop()
+    await memory.stop()
+    if application_ready.is_set():
+        await application.shutdown()
+    logger.info("Shutdown complete")
 
 if __name__ == "__main__":
+    eventloop.install()
     asyncio.run(main())
\ No newline at end of file